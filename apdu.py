@@ -0,0 +1,123 @@
+"""ISO 7816-4 command APDU encoding into a reusable buffer.
+
+`ApduBuilder` writes header, Lc, data and Le straight into one bytearray that keeps
+`headroom` bytes free in front (and `tailroom` behind) for the transport framing,
+so a bridge can wrap the APDU in place instead of copying it into a new frame.
+"""
+
+# Short APDU limits; anything larger switches to extended length
+SHORT_LC_MAX = 0xFF
+SHORT_LE_MAX = 0x100
+EXTENDED_LC_MAX = 0xFFFF
+EXTENDED_LE_MAX = 0x10000
+
+# CLA INS P1 P2 + Lc(3) + 255 data bytes + Le(3), enough for every short APDU
+DEFAULT_CAPACITY = 4 + 3 + SHORT_LC_MAX + 3
+
+class ApduBuilder(object):
+    """Reusable command APDU buffer.
+
+    `build()` and `load()` return a memoryview of the encoded APDU. The view stays
+    valid until the next call; when a larger APDU needs more room a new buffer is
+    allocated rather than resizing the old one under an exported view.
+
+    Args:
+        headroom (int): Bytes reserved in front of the APDU for the transport header.
+        tailroom (int): Bytes reserved after the APDU for the transport trailer.
+        capacity (int): Initial room for the APDU itself.
+    """
+    def __init__(self, headroom=0, tailroom=0, capacity=DEFAULT_CAPACITY):
+        self.headroom = headroom
+        self.tailroom = tailroom
+        self.length = 0
+        self._buf = bytearray(headroom + capacity + tailroom)
+
+    def _reserve(self, size):
+        if self.headroom + size + self.tailroom > len(self._buf):
+            self._buf = bytearray(self.headroom + size + self.tailroom)
+        self.length = size
+        return self._buf
+
+    def build(self, cla, ins, p1, p2, data=None, le=None, extended=None):
+        """Encode a command APDU.
+
+        Args:
+            data (bytes-like|list[int]|None): Command data, Lc is derived from it.
+            le (int|None): Expected response length, 0x100 (short) / 0x10000 (extended) mean "all".
+            extended (bool|None): Force extended length; by default it is used only when
+                the data or Le do not fit a short APDU.
+
+        Returns:
+            memoryview: The encoded APDU.
+        """
+        nc = len(data) if data else 0
+        if nc > EXTENDED_LC_MAX:
+            raise ValueError(f"data length MAX can only be {EXTENDED_LC_MAX}")
+        if le != None and not 0 <= le <= EXTENDED_LE_MAX:
+            raise ValueError(f"le must be between 0 and {EXTENDED_LE_MAX}")
+        if extended == None:
+            extended = nc > SHORT_LC_MAX or (le != None and le > SHORT_LE_MAX)
+
+        size = 4
+        if nc:
+            size += (3 if extended else 1) + nc
+        if le != None:
+            size += (2 if nc else 3) if extended else 1
+
+        buf = self._reserve(size)
+        pos = self.headroom
+        buf[pos] = cla
+        buf[pos + 1] = ins
+        buf[pos + 2] = p1
+        buf[pos + 3] = p2
+        pos += 4
+        if nc:
+            if extended:
+                buf[pos] = 0x00
+                buf[pos + 1] = nc >> 8
+                buf[pos + 2] = nc & 0xff
+                pos += 3
+            else:
+                buf[pos] = nc
+                pos += 1
+            buf[pos:pos + nc] = data
+            pos += nc
+        if le != None:
+            if extended:
+                if not nc:
+                    buf[pos] = 0x00
+                    pos += 1
+                buf[pos] = (le >> 8) & 0xff
+                buf[pos + 1] = le & 0xff
+            else:
+                buf[pos] = le & 0xff
+        return self.apdu()
+
+    def load(self, apdu):
+        """Copy a precomputed APDU (e.g. `GET_CHALLENGE_8`) into the buffer and return its view."""
+        buf = self._reserve(len(apdu))
+        buf[self.headroom:self.headroom + self.length] = apdu
+        return self.apdu()
+
+    def apdu(self):
+        """memoryview of the current APDU."""
+        return memoryview(self._buf)[self.headroom:self.headroom + self.length]
+
+    def frame(self, head, tail):
+        """Writable memoryview of the APDU plus `head` bytes before and `tail` bytes after it.
+
+        Transports fill the extra bytes with their framing and send the whole view.
+        """
+        if head > self.headroom or tail > self.tailroom:
+            raise ValueError("Transport framing does not fit the reserved head/tail room")
+        start = self.headroom - head
+        return memoryview(self._buf)[start:self.headroom + self.length + tail]
+
+def static_apdu(cla, ins, p1, p2, data=None, le=None):
+    """Encode a fixed APDU once, for use with `ApduBuilder.load()`."""
+    return bytes(ApduBuilder().build(cla, ins, p1, p2, data, le))
+
+GET_CHALLENGE_4 = static_apdu(0x00, 0x84, 0x00, 0x00, le=4)
+GET_CHALLENGE_8 = static_apdu(0x00, 0x84, 0x00, 0x00, le=8)
+GET_BALANCE_PASSBOOK = static_apdu(0x80, 0x5c, 0x00, 0x01, le=4)
+GET_BALANCE_WALLET = static_apdu(0x80, 0x5c, 0x00, 0x02, le=4)
@@ -0,0 +1,169 @@
+import os
+import hashlib
+from collections import OrderedDict
+from Crypto.Cipher import DES, DES3  # type: ignore
+from Crypto.Util.Padding import pad  # type: ignore
+
+ZERO_IV = b"\x00" * 8
+
+# Number of prepared entries (cipher contexts and derived keys) kept by a CipherCache
+CIPHER_CACHE_SIZE = 64
+
+#https://github.com/Legrandin/pycryptodome/issues/297#issuecomment-500383674
+def new_cipher(key):
+    """Return DES/3DES ECB cipher matching key size and duplication rules.
+
+    Key interpretation:
+    - 8 bytes -> DES
+    - 16 bytes -> if halves equal, DES; else 2-key 3DES
+    - 24 bytes -> reduce to DES or 2-key 3DES when halves repeat, else 3DES
+    """
+    key = bytes(key)
+    if len(key) == 8:
+        return DES.new(key, DES.MODE_ECB)
+    elif len(key) == 16:
+        if key[:8] == key[8:16]:
+            return DES.new(key[:8], DES.MODE_ECB)
+        return DES3.new(key, DES3.MODE_ECB)
+    if key[:8] == key[8:16] and key[-8:] == key[8:16]:
+        return DES.new(key[:8], DES.MODE_ECB)
+    elif key[:8] == key[8:16]:
+        return DES3.new(key[8:], DES3.MODE_ECB)
+    elif key[-8:] == key[8:16]:
+        return DES3.new(key[:-8], DES3.MODE_ECB)
+    return DES3.new(key, DES3.MODE_ECB)
+
+def xor_block(src, dst):
+    """XOR the first 8 bytes of two blocks."""
+    return (int.from_bytes(src[:8], "big") ^ int.from_bytes(dst[:8], "big")).to_bytes(8, "big")
+
+class _CacheEntry(object):
+    __slots__ = ("key", "value")
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def wipe(self):
+        """Overwrite the key copy (and derived key material) with zeros."""
+        self.key[:] = bytes(len(self.key))
+        if isinstance(self.value, bytearray):
+            self.value[:] = bytes(len(self.value))
+        self.value = None
+
+class CipherCache(object):
+    """Bounded LRU cache of key-scheduled cipher contexts and derived keys.
+
+    Entries are indexed by a salted digest of the key, never by the key itself; each
+    entry keeps a private bytearray copy of its key which is zeroised on eviction
+    and on `clear()`. The pycryptodome cipher objects expose no wipe primitive, they
+    are simply dropped.
+
+    Attributes:
+        maxsize (int): Maximum number of entries.
+        hits (int): Lookups served from the cache.
+        misses (int): Lookups that had to prepare a new entry.
+    """
+    def __init__(self, maxsize=CIPHER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._salt = os.urandom(16)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, kind, key, factory):
+        index = (kind, hashlib.blake2b(key, digest_size=16, key=self._salt).digest())
+        entry = self._entries.get(index)
+        if entry is not None:
+            self._entries.move_to_end(index)
+            self.hits += 1
+            return entry.value
+
+        self.misses += 1
+        entry = _CacheEntry(bytearray(key), factory(key))
+        self._entries[index] = entry
+        while len(self._entries) > self.maxsize:
+            _, evicted = self._entries.popitem(last=False)
+            evicted.wipe()
+        return entry.value
+
+    def cipher(self, key):
+        """ECB cipher for `key`, following the `new_cipher()` key rules."""
+        return self._lookup("cipher", key, new_cipher)
+
+    def des(self, key):
+        """Single-DES ECB cipher for an 8-byte key (or key half)."""
+        return self._lookup("des", key, lambda k: DES.new(bytes(k), DES.MODE_ECB))
+
+    def mac_halves(self, key):
+        """(DES-L, DES-R) ECB ciphers used by the 3DES MAC output transformation."""
+        return self._lookup("halves", key, lambda k: (DES.new(bytes(k[:8]), DES.MODE_ECB), DES.new(bytes(k[8:16]), DES.MODE_ECB)))
+
+    def xor_halves(self, key):
+        """XOR of the two key halves, e.g. the TAC key derived from the internal key."""
+        return bytes(self._lookup("xor", key, lambda k: bytearray(xor_block(k[0:8], k[8:]))))
+
+    def clear(self):
+        """Drop every entry, zeroising the key copies."""
+        while self._entries:
+            _, entry = self._entries.popitem()
+            entry.wipe()
+
+class MacEngine(object):
+    """FMCOS DES / 3DES MAC on key-scheduled ECB ciphers from a `CipherCache`.
+
+    The CBC chain over the padded message is run block by block on the cached ECB
+    object, so repeated MACs under one key never schedule it again.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else CipherCache()
+
+    @staticmethod
+    def _cbc_chain(des, buf, iv):
+        """Last block of the CBC encryption of ISO7816-padded `buf` under the ECB cipher `des`."""
+        data = pad(bytes(buf), 8, style='iso7816')
+        block = bytes(iv[:8])
+        for i in range(0, len(data), 8):
+            block = des.encrypt(bytes(a ^ b for a, b in zip(block, data[i:i + 8])))
+        return block
+
+    def des_mac(self, buf, key, iv=ZERO_IV, ret_cnt=4):
+        """Single-DES CBC-MAC over ISO7816-padded data; return the first ret_cnt bytes.
+
+        Only the first 8 bytes of `iv` are used, so a GET CHALLENGE response can be passed with its SW1 SW2.
+        """
+        if len(key) != 8:
+            raise ValueError(f"DES MAC key must be 8 bytes, got {len(key)}")
+        return self._cbc_chain(self.cache.des(key), buf, iv)[:ret_cnt]
+
+    def tdes_mac(self, buf, key, iv=ZERO_IV, ret_cnt=4):
+        """3DES "retail" MAC: DES-L CBC chain, then DES-R decrypt and DES-L encrypt of the last block."""
+        des_l, des_r = self.cache.mac_halves(key)
+        val = self._cbc_chain(des_l, buf, iv)
+        val = des_r.decrypt(val)
+        val = des_l.encrypt(val)
+        return val[:ret_cnt]
+
+    def mac(self, buf, key, iv=ZERO_IV, ret_cnt=4):
+        """DES MAC for 8-byte keys, 3DES MAC otherwise."""
+        if len(key) == 8:
+            return self.des_mac(buf, key, iv, ret_cnt)
+        return self.tdes_mac(buf, key, iv, ret_cnt)
+
+    def mac_many(self, bufs, key, iv=ZERO_IV, ret_cnt=4):
+        """MAC several independent messages under the same key and IV.
+
+        Args:
+            bufs (iterable[bytes]): Messages, each padded and chained on its own.
+            key (bytes): 8-byte DES or 16-byte 3DES key.
+
+        Returns:
+            list[bytes]: One MAC per message, in order.
+        """
+        return [self.mac(buf, key, iv, ret_cnt) for buf in bufs]
+
+default_cipher_cache = CipherCache()
+default_mac_engine = MacEngine(default_cipher_cache)
@@ -0,0 +1,252 @@
+"""Incremental re-personalisation: diff a card against a target profile.
+
+The card is probed live (SELECT, READ BINARY / READ RECORD of the EFs whose
+content the profile declares, GET BALANCE, INITIALIZE for key versions) and only
+the missing or different parts end up in the `Plan`:
+
+- missing DFs are created with everything below them, missing EFs and
+  wallets / passbooks are created and filled;
+- binary content is compared byte by byte and only the changed ranges are
+  rewritten, records are updated or appended one by one;
+- purchase, credit, debit and overdraft keys are rewritten when INITIALIZE
+  reports a different key version (or no key); keys whose version the card
+  does not reveal are only written into new DFs, or when the profile entry has
+  "reinject": true.
+
+Things FMCOS does not report are not diffed: EF sizes and access rights, files
+and DFs that exist on the card but not in the profile, and loop file content.
+"""
+import logging
+from cardprofile import _Compiler, _path_str, load_profile, ProfileError, MAX_DATA_CHUNK
+from cardlog import apdu_log
+from fmcos import CPUFileType, KeyType, BalanceType
+from status_words import CardError, FileNotFound
+
+diff_log = apdu_log.getChild("diff")
+
+#Key type -> (INITIALIZE P1, offset of the key version in the response, Le)
+VERSIONED_KEYS = {
+    KeyType.CreditKey: (0x00, 6, 0x10),
+    KeyType.PurchaseKey: (0x01, 9, 0x0F),
+    KeyType.OverdrawLimitKey: (0x04, 9, 0x13),
+    KeyType.DebitKey: (0x05, 6, 0x10),
+}
+PROBE_TERMINAL = bytes(6)
+#Rewrite the unchanged bytes between two changes when that is cheaper than another APDU header
+MERGE_GAP = 8
+
+def changed_ranges(current, target, gap=MERGE_GAP, limit=MAX_DATA_CHUNK):
+    """(offset, data) chunks of `target` that differ from `current`, merged across gaps up to `gap` bytes."""
+    chunks = []
+    start = None
+    last = None
+    for i in range(len(target)):
+        if i < len(current) and current[i] == target[i]:
+            continue
+        if start != None and i - last <= gap + 1 and i - start + 1 <= limit:
+            last = i
+            continue
+        if start != None:
+            chunks.append((start, target[start:last + 1]))
+        start = last = i
+    if start != None:
+        chunks.append((start, target[start:last + 1]))
+    return chunks
+
+class _Differ(_Compiler):
+    def __init__(self, profile, fmcos):
+        super().__init__(profile)
+        self.fmcos = fmcos
+        self.probes = 0
+
+    def credentials(self, node):
+        """(external_auth, pin) arguments for `FMCOS.ensure_rights()` from the DF's profile keys."""
+        ext = pin = None
+        for args in node.keys:
+            if args["key_type"] == KeyType.ExternalAuthenticationKey and ext == None:
+                ext = (args["key_id"], args["key"])
+            elif args["key_type"] == KeyType.PinKey and pin == None:
+                pin = (args["key_id"], args["key"])
+        return ext, pin
+
+    def live_select(self, path):
+        self.probes += 1
+        return self.fmcos.is_success(self.fmcos.select_path(path))
+
+    def diff_df(self, node, names, parent=None):
+        if not self.live_select(node.path):
+            if parent == None:
+                self.error(_path_str(node.path), "MF cannot be selected")
+                return
+            diff_log.info("%s missing, created", _path_str(node.path))
+            self.create_df(parent, node, names)
+            return
+
+        ext, pin = self.credentials(node)
+        wallets = [wallet for wallet in node.wallets if not self.probe_wallet(node, wallet, ext, pin)]
+        present = {wallet["balance_type"] for wallet in node.wallets} - {wallet["balance_type"] for wallet in wallets}
+        keys = self.probe_keys(node, present, ext, pin)
+        files = []
+        for ef in node.files:
+            files.append(self.probe_file(node, ef, ext, pin))
+
+        if keys or wallets or any(work for work in files):
+            self.select(node.path, names)
+        #Keys already on the card can authenticate the rest, new ones once written
+        written = {(args["key_type"], args["key_id"]) for args, _ in keys}
+        for args in node.keys:
+            if (args["key_type"], args["key_id"]) not in written:
+                self.register(node, args["key_type"], args["key_id"], args["key"], args.get("followup_status"), args["usage_rights"])
+        for args, update in keys:
+            where = f"{_path_str(node.path)} {args['key_type'].name}/{args['key_id']}"
+            if update:
+                self.authorise(node, args.get("change_rights"), f"WRITE KEY {args['key_type'].name}")
+                args = dict(args, key_add_update=args["key_type"])
+            else:
+                self.authorise(node, node.keyfile["key_permission"] if node.keyfile else None, f"WRITE KEY {args['key_type'].name}")
+            if "protection" in args:
+                args = dict(args, extauth_key=next(a["key"] for a in node.keys if a["key_type"] == KeyType.ExternalAuthenticationKey and a["key_id"] == 0))
+            self.plan.add("cmd_write_key", f"WRITE KEY {where}", **args)
+            self.register(node, args["key_type"], args["key_id"], args["key"], args.get("followup_status"), args["usage_rights"])
+
+        for ef, work in zip(node.files, files):
+            if work == "create":
+                self.authorise(node, node.create_permissions, f"CREATE {ef['file_id']:04X}")
+                kwargs = {name: ef[name] for name in ("file_id", "file_type", "file_size", "read_perm", "write_perm", "access_rights", "protection")}
+                self.plan.add("cmd_create_file", f"CREATE {_path_str(node.path)}/{ef['file_id']:04X}", **kwargs)
+        for wallet in wallets:
+            self.authorise(node, node.create_permissions, f"CREATE {wallet['balance_type'].name}")
+            self.plan.add("cmd_create_edep", f"CREATE {_path_str(node.path)} {wallet['balance_type'].name}", **wallet)
+        for ef, work in zip(node.files, files):
+            if work == "create":
+                self.compile_content(node, ef)
+            elif work:
+                kind, ops = work
+                if kind == "binary":
+                    self.emit_binary(node, ef, ops)
+                else:
+                    self.emit_records(node, ef, ops)
+
+        for child in node.children:
+            self.diff_df(child, names, parent=node)
+
+    def probe_wallet(self, node, wallet, ext, pin):
+        """True when the wallet / passbook exists in the selected DF."""
+        self.fmcos.ensure_rights(wallet["usage_rights"], external_auth=ext, pin=pin)
+        self.probes += 1
+        return self.fmcos.is_success(self.fmcos.cmd_get_balance(wallet["balance_type"]))
+
+    def probe_keys(self, node, purses, ext, pin):
+        """Keys to write as [(args, update)], from the key versions INITIALIZE reports."""
+        writes = []
+        for args in node.keys:
+            key_type, key_id = args["key_type"], args["key_id"]
+            if (key_type, key_id) in node.reinject:
+                #Written anyway, so no INITIALIZE is opened on the purse to read its version
+                writes.append((args, True))
+                continue
+            probe = VERSIONED_KEYS.get(key_type)
+            if probe == None:
+                continue
+            if key_type == KeyType.OverdrawLimitKey:
+                balance_type = BalanceType.Passbook if BalanceType.Passbook in purses else None
+            else:
+                balance_type = next(iter(sorted(purses)), None)
+            if balance_type == None:
+                #No purse to run INITIALIZE against yet: new purses get their keys written
+                if any(wallet["balance_type"] not in purses for wallet in node.wallets):
+                    writes.append((args, False))
+                continue
+
+            p1, offset, le = probe
+            data = key_id.to_bytes(1, "big") + (PROBE_TERMINAL if p1 == 0x04 else bytes(4) + PROBE_TERMINAL)
+            self.probes += 1
+            ret = self.fmcos.sendCommand(cla=0x80, ins=0x50, p1=p1, p2=balance_type.value, Data=data, le=le)
+            if ret[-2:] == b"\x94\x03":
+                writes.append((args, False))
+            elif self.fmcos.is_success(ret) and len(ret) > offset + 2:
+                version = ret[offset]
+                if version != args["key_version"]:
+                    diff_log.info("%s %s/%d version %02X, profile %02X", _path_str(node.path), key_type.name, key_id, version, args["key_version"])
+                    writes.append((args, True))
+            else:
+                diff_log.warning("%s %s/%d version unknown (SW %s)", _path_str(node.path), key_type.name, key_id, ret[-2:].hex())
+        return writes
+
+    def probe_file(self, node, ef, ext, pin):
+        """What an EF needs: None, "create", ("binary", chunks) or ("records", ops)."""
+        fmcos = self.fmcos
+        fid = ef["file_id"]
+        path = node.path + [fid]
+        has_content = ef["data"] != None or (ef["records"] and ef["file_type"] != CPUFileType.LoopFile)
+        if not has_content:
+            return None if self.live_select(path) else "create"
+
+        fmcos.ensure_rights(ef["read_perm"], external_auth=ext, pin=pin)
+        key = None
+        if ef["protection"] != None:
+            #Reads use the key selected by the read bits of the access rights
+            line_keys = self.line_keys(node)
+            wanted = 3 - ((ef["access_rights"] >> 2) & 0x03)
+            key = next((args["key"] for args in line_keys if args["key_id"] == wanted), line_keys[0]["key"])
+        sfi = fid if fid <= 0x1e else 0
+        try:
+            if sfi == 0 and not self.live_select(path):
+                return "create"
+            if ef["data"] != None:
+                self.probes += 1
+                current = b"".join(fmcos.read_file(sfi or None, length=len(ef["data"]), key=key, protection=ef["protection"]))
+                limit = min(MAX_DATA_CHUNK, fmcos.write_chunk_size(ef["protection"]))
+                return ("binary", changed_ranges(current, ef["data"], limit=limit)) if current != ef["data"] else None
+
+            length = ef["file_size"] & 0xFF if ef["file_type"] == CPUFileType.FixLength else None
+            self.probes += 1
+            current = list(fmcos.iter_records(sfi, record_length=length, has_tlv=ef["use_tlv"], key=key, protection=ef["protection"]))
+        except FileNotFound:
+            return "create"
+        except (CardError, ValueError) as e:
+            #Unreadable (access rights, MAC): rewrite it all
+            diff_log.warning("%s not readable (%s), rewritten", _path_str(path), e)
+            if ef["data"] != None:
+                data = ef["data"]
+                return ("binary", [(offset, data[offset:offset + MAX_DATA_CHUNK]) for offset in range(0, len(data), MAX_DATA_CHUNK)])
+            return ("records", [("cmd_update_record", number, record) for number, record in enumerate(ef["records"], 1)])
+
+        ops = []
+        for number, record in enumerate(ef["records"], 1):
+            if number > len(current):
+                ops.append(("cmd_append_record", number, record))
+            elif bytes(current[number - 1]) != record:
+                ops.append(("cmd_update_record", number, record))
+        return ("records", ops) if ops else None
+
+    def diff(self):
+        mf, names = self.parse()
+        self.diff_df(mf, names)
+        if self.errors:
+            raise ProfileError(self.errors)
+        if diff_log.isEnabledFor(logging.INFO):
+            diff_log.info("%d probe exchanges, %d plan steps", self.probes, len(self.plan))
+        return self.plan
+
+def diff_profile(fmcos, profile):
+    """Probe the card in the field and return the `Plan` that brings it to `profile`.
+
+    Key versions are read with INITIALIZE on the live purse (zero amount, never completed),
+    which opens a transaction the next command abandons: run it where an interrupted purse
+    transaction is acceptable. Keys marked "reinject" are written without this probe.
+
+    Args:
+        fmcos (FMCOS): Connection to the card; the probes use the profile's
+            EXTERNAL AUTHENTICATE / PIN keys where reads need them.
+        profile (dict|str): Target profile, or path to a JSON / YAML file.
+    """
+    if isinstance(profile, str):
+        profile = load_profile(profile)
+    if profile.get("erase", False):
+        profile = dict(profile, erase=False)
+    return _Differ(profile, fmcos).diff()
+
+def repersonalise(fmcos, profile):
+    """Diff the card against `profile` and run the resulting plan; return the number of steps run."""
+    return diff_profile(fmcos, profile).run(fmcos)
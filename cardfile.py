@@ -0,0 +1,216 @@
+from status_words import error_class, raise_for_status
+
+# Largest UPDATE BINARY payload, see FMCOS._cmd_update_bin_rec (room for padding + MAC)
+MAX_UPDATE_LENGTH = 245
+
+class CardBinaryFile(object):
+    """Write-back buffer over a binary EF.
+
+    Content is paged in lazily with READ BINARY the first time a byte is accessed;
+    writes only touch the local copy and record dirty byte ranges. `flush()` sends
+    the dirty ranges with as few UPDATE BINARY APDUs as possible: a window of up to
+    `write_size` bytes (245, less when the card's FSC is smaller) starts at each
+    dirty byte not yet covered and also carries the clean bytes in between when
+    they are already loaded.
+
+    The object exposes a read-only buffer (`memoryview(f)` on Python 3.12+, `view()`
+    otherwise) over the whole file; writes go through item assignment or `write()`.
+
+    Args:
+        fmcos: FMCOS instance used for the exchanges.
+        file_id (str|int): FID to SELECT, as a string (e.g. '0002') or an int outside 1..0x1E;
+            an int in 1..0x1E is an SFI, for files of up to 256 bytes addressed without SELECT.
+        size (int): File size in bytes (FMCOS does not return it on SELECT).
+        key (bytes): Line protection key, required with `protection`.
+        protection (Protection): Line protection for both reads and writes.
+    """
+    def __init__(self, fmcos, file_id, size, key=None, protection=None):
+        if size <= 0 or size > 0x8000:
+            raise ValueError("size must be between 1 and 0x8000")
+        if protection and key == None:
+            raise ValueError("key is required for MAC/encryption")
+
+        self.fmcos = fmcos
+        self.size = size
+        self.key = key
+        self.protection = protection
+        self.sfi = None
+        self.fid = None
+        if isinstance(file_id, int) and 1 <= file_id <= 0x1e:
+            if size > 0x100:
+                raise ValueError("SFI addressing only reaches offsets up to 0xFF, open the file by FID")
+            self.sfi = file_id
+        else:
+            self.fid = int(file_id, 16) if isinstance(file_id, str) else file_id
+
+        self.page_size = fmcos.read_chunk_size(protection)
+        self.write_size = min(MAX_UPDATE_LENGTH, fmcos.write_chunk_size(protection))
+        self._data = bytearray(size)
+        self._loaded = [False] * ((size + self.page_size - 1) // self.page_size)
+        self._dirty = []
+        self.apdu_count = 0
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def __buffer__(self, flags):
+        return self.view()
+
+    def view(self):
+        """Read-only memoryview of the whole file, loading what is missing."""
+        self._load(0, self.size)
+        return memoryview(self._data).toreadonly()
+
+    def __getitem__(self, index):
+        start, stop = self._range(index)
+        self._load(start, stop)
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        start, stop = self._range(index)
+        if isinstance(index, slice):
+            value = bytes(value)
+            if len(value) != stop - start:
+                raise ValueError("CardBinaryFile cannot be resized")
+        self._load_partial(start, stop)
+        self._data[index] = value
+        self._mark_dirty(start, stop)
+
+    def read(self, offset=0, length=None):
+        """Return `length` bytes from `offset` (to the end of the file by default)."""
+        stop = self.size if length == None else offset + length
+        return bytes(self[offset:stop])
+
+    def write(self, offset, data):
+        """Overwrite the bytes at `offset` with `data`."""
+        self[offset:offset + len(data)] = data
+
+    @property
+    def dirty(self):
+        """True when there are changes not yet sent to the card."""
+        return bool(self._dirty)
+
+    def _range(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step != 1:
+                raise ValueError("CardBinaryFile only supports contiguous slices")
+            return start, max(start, stop)
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("CardBinaryFile index out of range")
+        return index, index + 1
+
+    def _pages(self, start, stop):
+        return range(start // self.page_size, (stop - 1) // self.page_size + 1) if stop > start else range(0)
+
+    def _load(self, start, stop):
+        for page in self._pages(start, stop):
+            if not self._loaded[page]:
+                self._read_page(page)
+
+    def _load_partial(self, start, stop):
+        """Load only the pages a write covers partially."""
+        for page in self._pages(start, stop):
+            page_start = page * self.page_size
+            page_stop = min(page_start + self.page_size, self.size)
+            if not self._loaded[page] and (start > page_start or stop < page_stop):
+                self._read_page(page)
+            self._loaded[page] = True
+
+    def _read_page(self, page):
+        offset = page * self.page_size
+        length = min(self.page_size, self.size - offset)
+        self._select()
+        data, sw = self.fmcos._read_chunk(0xB0, *self._p1p2(offset), length, self.key, self.protection)
+        self.apdu_count += 1
+        if sw != b"\x90\x00":
+            raise error_class(sw)(sw, f"READ BINARY at offset {offset}")
+        if len(data) != length:
+            raise ValueError(f"READ BINARY at offset {offset} returned {len(data)} of {length} bytes")
+        #Keep local changes made before the page was read
+        dirty = [(s, e) for s, e in self._dirty if s < offset + length and e > offset]
+        saved = [(s, bytes(self._data[s:e])) for s, e in dirty]
+        self._data[offset:offset + length] = data
+        for s, chunk in saved:
+            self._data[s:s + len(chunk)] = chunk
+        self._loaded[page] = True
+
+    def _mark_dirty(self, start, stop):
+        ranges = []
+        for s, e in self._dirty:
+            if e < start or s > stop:
+                ranges.append((s, e))
+            else:
+                start, stop = min(s, start), max(e, stop)
+        ranges.append((start, stop))
+        self._dirty = sorted(ranges)
+
+    def _windows(self):
+        """Cover every dirty byte with the fewest UPDATE BINARY windows."""
+        windows = []
+        ranges = list(self._dirty)
+        i = 0
+        while i < len(ranges):
+            start = ranges[i][0]
+            limit = start + self.write_size
+            stop = min(ranges[i][1], limit)
+            if stop < ranges[i][1]:
+                ranges[i] = (stop, ranges[i][1])
+                windows.append((start, stop))
+                continue
+            i += 1
+            #Absorb the following ranges while the window has room and the gap is loaded
+            while i < len(ranges) and ranges[i][0] < limit:
+                if not all(self._loaded[p] for p in self._pages(stop, ranges[i][0])):
+                    break
+                if ranges[i][1] > limit:
+                    stop = limit
+                    ranges[i] = (limit, ranges[i][1])
+                    break
+                stop = ranges[i][1]
+                i += 1
+            windows.append((start, stop))
+        return windows
+
+    def flush(self):
+        """Write the dirty ranges back to the card; return the number of UPDATE BINARY APDUs sent."""
+        if not self._dirty:
+            return 0
+        windows = self._windows()
+        self._select()
+        for start, stop in windows:
+            p1, p2 = self._p1p2(start)
+            ret = self.fmcos.cmd_update_binary(p1=p1, p2=p2, data=bytes(self._data[start:stop]), key=self.key, protection=self.protection)
+            self.apdu_count += 1
+            raise_for_status(ret, f"UPDATE BINARY at offset {start}")
+            self._trim_dirty(start, stop)
+        return len(windows)
+
+    def _trim_dirty(self, start, stop):
+        ranges = []
+        for s, e in self._dirty:
+            if s < start:
+                ranges.append((s, min(e, start)))
+            if e > stop:
+                ranges.append((max(s, stop), e))
+        self._dirty = ranges
+
+    def _p1p2(self, offset):
+        if self.sfi != None:
+            return 0x80 | self.sfi, offset
+        return offset >> 8, offset & 0xff
+
+    def _select(self):
+        if self.fid != None and self.fmcos.selected_ef != self.fid:
+            ret = self.fmcos.cmd_select(self.fid)
+            self.apdu_count += 1
+            raise_for_status(ret, f"SELECT {self.fid:04X}")
@@ -0,0 +1,60 @@
+"""Loggers shared by the FMCOS modules.
+
+All loggers are children of "fmcos":
+    fmcos.transport      reader bridges, raw frames and APDUs (DEBUG)
+    fmcos.apdu           command APDUs and status words (DEBUG), command results (INFO)
+    fmcos.crypto         MAC / TAC / session key intermediates (DEBUG, includes key material)
+    fmcos.transaction    purse transactions (INFO)
+    fmcos.station        issuance station workers (INFO), failed jobs (WARNING)
+
+Arguments are passed %-style and binary values wrapped in `Hex`, so nothing is
+formatted unless the record is actually emitted.
+"""
+import logging
+from utils import bytes_to_hexstr
+
+transport_log = logging.getLogger("fmcos.transport")
+apdu_log = logging.getLogger("fmcos.apdu")
+crypto_log = logging.getLogger("fmcos.crypto")
+transaction_log = logging.getLogger("fmcos.transaction")
+station_log = logging.getLogger("fmcos.station")
+
+LOG_FORMAT = "[%(name)s] %(funcName)s: %(message)s"
+
+class Hex(object):
+    """Defer `bytes_to_hexstr()` until the log record is formatted."""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return bytes_to_hexstr(self.data)
+
+class Lazy(object):
+    """Defer `func(*args)` until the log record is formatted."""
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+def enable_debug(*loggers, level=logging.DEBUG):
+    """Set `loggers` (objects or names) to `level` and make sure their records reach the console.
+
+    Backs the `fmcos_debug` / `hw_debug` switches. Applications that configure
+    `logging` themselves only need to set the levels of the loggers above.
+    """
+    for logger in loggers:
+        if isinstance(logger, str):
+            logger = logging.getLogger(logger)
+        logger.setLevel(level)
+
+    parent = logging.getLogger("fmcos")
+    if not parent.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        parent.addHandler(handler)
@@ -0,0 +1,97 @@
+"""Per-card file metadata cache keyed by card UID and file path.
+
+FMCOS only returns an FCI (DF name, SFI) when a DF is selected; EF type, size
+and access rights are known from the CREATE FILE parameters. `FMCOS` records
+both here, so metadata queries are answered without talking to the card.
+"""
+
+def normalise_path(path):
+    """Path as a tuple of int FIDs, from '3F00/3F01/0002', [0x3F00, 0x3F01] or a tuple."""
+    if isinstance(path, str):
+        return tuple(int(fid, 16) for fid in path.split("/") if fid)
+    return tuple(path)
+
+class FileInfo(object):
+    """Metadata of one MF/DF/EF.
+
+    Attributes:
+        path (tuple[int]): FIDs from the MF down to this file.
+        file_type (CPUFileType|int|None): File type byte used on creation.
+        size (int|None): File size (EF) or space (DF / key file).
+        df_name (bytes|None): DF name from the FCI or CREATE.
+        sfi (int|None): SFI from the FCI (tag 88) or CREATE.
+        read_perm, write_perm, access_rights (int|None): EF access bytes.
+        create_perm, erase_perm (int|None): DF access bytes.
+        protection (Protection|None): Line protection of the EF.
+    """
+    __slots__ = ("path", "file_type", "size", "df_name", "sfi", "read_perm", "write_perm",
+                 "access_rights", "create_perm", "erase_perm", "protection")
+
+    def __init__(self, path, **fields):
+        self.path = path
+        for name in self.__slots__[1:]:
+            setattr(self, name, fields.get(name))
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            if value is not None:
+                setattr(self, name, value)
+
+    @property
+    def fid(self):
+        return self.path[-1] if self.path else None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[1:] if getattr(self, name) is not None)
+        return f"FileInfo({'/'.join(f'{fid:04X}' for fid in self.path)}{', ' if fields else ''}{fields})"
+
+class MetadataCache(object):
+    """FileInfo entries indexed by (uid, path), plus a (uid, DF name) -> path index."""
+    def __init__(self):
+        self._entries = {}
+        self._names = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, uid, path):
+        """FileInfo for `path` on card `uid`, or None."""
+        return self._entries.get((uid, normalise_path(path)))
+
+    def update(self, uid, path, **fields):
+        """Merge `fields` (None values are ignored) into the entry for `path`, creating it if needed."""
+        path = normalise_path(path)
+        info = self._entries.get((uid, path))
+        if info is None:
+            info = self._entries[(uid, path)] = FileInfo(path)
+        info.update(**fields)
+        if info.df_name is not None:
+            self._names[(uid, bytes(info.df_name))] = path
+        return info
+
+    def find_df(self, uid, df_name):
+        """FileInfo of the DF named `df_name` on card `uid`, or None."""
+        path = self._names.get((uid, bytes(df_name)))
+        return None if path is None else self._entries.get((uid, path))
+
+    def invalidate(self, uid, path=None, keep_root=False):
+        """Drop `path` and everything below it (the whole card when `path` is None).
+
+        Args:
+            keep_root (bool): Keep the entry of `path` itself, e.g. after ERASE DF.
+        """
+        path = None if path is None else normalise_path(path)
+        depth = 0 if path is None else len(path)
+        for key in [key for key in self._entries if key[0] == uid]:
+            entry_path = key[1]
+            if path is not None and entry_path[:depth] != path:
+                continue
+            if keep_root and len(entry_path) == depth:
+                continue
+            del self._entries[key]
+        for key in [key for key, value in self._names.items() if key[0] == uid and (uid, value) not in self._entries]:
+            del self._names[key]
+
+    def clear(self):
+        self._entries.clear()
+        self._names.clear()
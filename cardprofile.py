@@ -0,0 +1,588 @@
+"""Declarative card profiles compiled into a personalisation plan.
+
+A profile describes the file system to issue: DFs, their key file and keys,
+EFs with optional initial content, and wallets / passbooks with their loop file.
+It is written as JSON (YAML when PyYAML is installed), validated offline and
+compiled into a `Plan`: an ordered list of FMCOS calls with the fewest SELECTs,
+the creation order FMCOS requires, and EXTERNAL AUTHENTICATE / VERIFY PIN only
+where the tracked security state does not already meet an access condition.
+
+    {
+      "erase": true,
+      "mf": {
+        "dfs": [{
+          "file_id": "3F01", "df_name": "benchTest", "file_space": 4096,
+          "create_permissions": "F0", "erase_permission": "F0", "app_id": "95",
+          "keyfile": {"file_id": "0001", "file_space": 512, "key_permission": "F0"},
+          "keys": [{"key_type": "ExternalAuthenticationKey", "key_id": 0, "usage_rights": "F0",
+                    "change_rights": "F0", "followup_status": "AA", "error_counter": "FF",
+                    "key": "39393939393939393939393939393939"}],
+          "files": [{"file_id": "0002", "file_type": "BinFile", "file_size": 80, "read_perm": "F0",
+                     "write_perm": "F0", "access_rights": "FF", "data": "hello"},
+                    {"file_id": "0018", "file_type": "LoopFile", "record_count": 5, "record_length": 23,
+                     "read_perm": "F0", "write_perm": "EF", "access_rights": "FF"}],
+          "wallets": [{"balance_type": "Wallet", "usage_rights": "F0", "loop_file_id": "18"}]
+        }]
+      }
+    }
+
+Numbers are ints or hex strings, keys are hex strings, names and data are ASCII
+text or "hex:..." strings. Field names follow the matching `FMCOS.cmd_*` arguments.
+The MF is never created; "credentials" lists keys already on it (e.g. a transport
+key) for the ERASE DF, "create_permissions" / "erase_permission" its access rights.
+"""
+import json
+from fmcos import CPUFileType, KeyType, BalanceType, Protection
+from cardsession import EXTERNAL_AUTH, PIN, allows
+from status_words import raise_for_status
+
+# Optional YAML support .. `pip install pyyaml`
+try:
+    import yaml  # type: ignore
+except ModuleNotFoundError:
+    yaml = None
+
+MF_FID = 0x3f00
+FREE = 0xF0
+MAX_DATA_CHUNK = 245    #UPDATE BINARY / APPEND RECORD payload limit, see FMCOS._cmd_update_bin_rec
+EDEP_SPACE = 0x20
+
+EF_TYPES = (CPUFileType.BinFile, CPUFileType.FixLength, CPUFileType.VariableLength, CPUFileType.LoopFile)
+RECORD_TYPES = (CPUFileType.FixLength, CPUFileType.VariableLength, CPUFileType.LoopFile)
+
+#Fields cmd_write_key requires per key type
+KEY_FIELDS = {
+    KeyType.ExternalAuthenticationKey: ("change_rights", "followup_status", "error_counter"),
+    KeyType.PinKey: ("followup_status", "error_counter"),
+    KeyType.UnlockPinKey: ("change_rights", "error_counter"),
+    KeyType.FileLineProtectionKey: ("change_rights", "error_counter"),
+    KeyType.ChangePinKey: ("change_rights", "error_counter"),
+}
+for _key_type in (KeyType.InternalKey, KeyType.OverdrawLimitKey, KeyType.DebitKey, KeyType.PurchaseKey, \
+                  KeyType.CreditKey, KeyType.DESEncrypt, KeyType.DESDecrypt, KeyType.DESMAC):
+    KEY_FIELDS[_key_type] = ("change_rights", "key_version", "algo_id")
+
+class ProfileError(ValueError):
+    """A profile failed validation; `errors` lists every problem found."""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("Invalid card profile:\n  " + "\n  ".join(self.errors))
+
+def load_profile(path):
+    """Read a profile from a .json or .yaml / .yml file."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml == None:
+                raise ValueError("YAML profiles need PyYAML (`pip install pyyaml`)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def _int(value):
+    return int(value, 16) if isinstance(value, str) else value
+
+def _bytes(value, text=True):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if value.startswith("hex:"):
+        return bytes.fromhex(value[4:])
+    return value.encode("ascii") if text else bytes.fromhex(value)
+
+def _path_str(path):
+    return "/".join(f"{fid:04X}" for fid in path)
+
+class PlanStep(object):
+    """One FMCOS call of a plan: `getattr(fmcos, method)(**kwargs)`."""
+    __slots__ = ("method", "kwargs", "comment")
+
+    def __init__(self, method, kwargs, comment):
+        self.method = method
+        self.kwargs = kwargs
+        self.comment = comment
+
+    def __repr__(self):
+        args = []
+        for name, value in self.kwargs.items():
+            if value == None:
+                continue
+            if name in ("key", "pin_code", "extauth_key"):
+                value = f"<{len(value)} bytes>"
+            elif isinstance(value, bytes):
+                value = value.hex().upper()
+            elif hasattr(value, "name"):
+                value = value.name
+            elif isinstance(value, int) and not isinstance(value, bool) and value > 9:
+                value = f"0x{value:02X}"
+            args.append(f"{name}={value}")
+        return f"{self.method}({', '.join(args)})  #{self.comment}"
+
+class Plan(object):
+    """Compiled personalisation, run against one card with `run()`."""
+    def __init__(self):
+        self.steps = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __str__(self):
+        return "\n".join(repr(step) for step in self.steps)
+
+    def count(self, method):
+        """Number of steps calling `method`, e.g. plan.count("cmd_select")."""
+        return sum(1 for step in self.steps if step.method == method)
+
+    def add(self, method, comment, **kwargs):
+        self.steps.append(PlanStep(method, kwargs, comment))
+
+    def run(self, fmcos):
+        """Execute every step on the card in the field; raise the typed `CardError` of the first failure."""
+        for step in self.steps:
+            ret = getattr(fmcos, step.method)(**step.kwargs)
+            raise_for_status(ret, step.comment)
+        return len(self.steps)
+
+class _Node(object):
+    """Validated DF of a profile."""
+    def __init__(self, path, spec):
+        self.path = path
+        self.spec = spec
+        self.df_name = None
+        self.keyfile = None
+        self.keys = []
+        self.files = []
+        self.wallets = []
+        self.children = []
+        self.credentials = []
+        self.reinject = set()
+
+class _Compiler(object):
+    def __init__(self, profile):
+        self.profile = profile
+        self.errors = []
+        self.names = {}
+        self.plan = Plan()
+        #Simulated card: selected DF path (or the two DFs it may be after CREATE DF) and security state
+        self.pos = None
+        self.maybe = None
+        self.state = None
+        self.keys = {}
+
+    # ------------------------------------------------------------------ validation
+
+    def error(self, where, message):
+        self.errors.append(f"{where}: {message}")
+
+    def field(self, where, spec, name, required=True, default=None, byte=True):
+        value = spec.get(name, default)
+        if value == None:
+            if required:
+                self.error(where, f"missing '{name}'")
+            return None
+        try:
+            value = _int(value)
+        except (TypeError, ValueError):
+            self.error(where, f"'{name}' is not a number: {value!r}")
+            return None
+        if not isinstance(value, int) or value < 0 or value > (0xFF if byte else 0xFFFF):
+            self.error(where, f"'{name}' out of range: {value!r}")
+            return None
+        return value
+
+    def data(self, where, spec, name, text=True):
+        value = spec.get(name)
+        if value == None:
+            return None
+        try:
+            return _bytes(value, text)
+        except (ValueError, UnicodeEncodeError, AttributeError):
+            self.error(where, f"'{name}' is not valid {'text or hex:' if text else 'hex'}")
+            return None
+
+    def enum(self, where, spec, name, enum, allowed=None, required=True):
+        value = spec.get(name)
+        if value == None:
+            if required:
+                self.error(where, f"missing '{name}'")
+            return None
+        try:
+            value = enum[value] if isinstance(value, str) else enum(value)
+        except (KeyError, ValueError):
+            self.error(where, f"unknown {name} {value!r}")
+            return None
+        if allowed != None and value not in allowed:
+            self.error(where, f"{name} {value.name} not allowed here")
+            return None
+        return value
+
+    def parse_df(self, path, spec):
+        node = _Node(path, spec)
+        where = _path_str(path)
+        is_mf = len(path) == 1
+
+        if not is_mf:
+            node.df_name = self.data(where, spec, "df_name")
+            if node.df_name != None:
+                if not 1 <= len(node.df_name) <= 16:
+                    self.error(where, "df_name must be 1 to 16 bytes")
+                elif node.df_name in self.names:
+                    self.error(where, f"df_name also used by {self.names[node.df_name]}")
+                self.names[node.df_name] = where
+            else:
+                self.error(where, "missing 'df_name'")
+            node.file_space = self.field(where, spec, "file_space", byte=False)
+            node.app_id = self.field(where, spec, "app_id")
+        else:
+            node.file_space = self.field(where, spec, "file_space", required=False, byte=False)
+            node.app_id = self.field(where, spec, "app_id", required=False)
+        node.create_permissions = self.field(where, spec, "create_permissions", required=not is_mf, default=FREE if is_mf else None)
+        node.erase_permission = self.field(where, spec, "erase_permission", required=not is_mf, default=FREE if is_mf else None)
+
+        fids = {}
+        used = 0
+        if spec.get("keyfile") != None:
+            kf = spec["keyfile"]
+            node.keyfile = {
+                "file_id": self.field(f"{where} keyfile", kf, "file_id", byte=False),
+                "file_space": self.field(f"{where} keyfile", kf, "file_space", byte=False),
+                "df_sid": self.field(f"{where} keyfile", kf, "df_sid", required=False, default=node.app_id if node.app_id != None else 0),
+                "key_permission": self.field(f"{where} keyfile", kf, "key_permission"),
+            }
+            fids[node.keyfile["file_id"]] = "keyfile"
+            used += node.keyfile["file_space"] or 0
+
+        self.parse_keys(node, where, spec.get("keys", []))
+        self.parse_credentials(node, where, spec.get("credentials", []), is_mf)
+        for file_spec in spec.get("files", []):
+            ef = self.parse_file(node, where, file_spec)
+            if ef == None:
+                continue
+            if ef["file_id"] in fids:
+                self.error(where, f"file_id {ef['file_id']:04X} used twice")
+            fids[ef["file_id"]] = "file"
+            used += ef["space"]
+        for wallet_spec in spec.get("wallets", []):
+            wallet = self.parse_wallet(node, where, wallet_spec)
+            if wallet != None:
+                used += EDEP_SPACE
+        for child_spec in spec.get("dfs", []):
+            fid = self.field(where, child_spec, "file_id", byte=False)
+            if fid == None:
+                continue
+            if fid == MF_FID or fid in fids:
+                self.error(where, f"DF file_id {fid:04X} clashes with another file")
+                continue
+            fids[fid] = "df"
+            child = self.parse_df(path + [fid], child_spec)
+            node.children.append(child)
+            used += child.file_space or 0
+
+        if node.file_space != None and used > node.file_space:
+            self.error(where, f"contents need {used} bytes, file_space is {node.file_space}")
+        return node
+
+    def parse_keys(self, node, where, specs):
+        if specs and node.keyfile == None:
+            self.error(where, "keys need a keyfile")
+        seen = set()
+        for spec in specs:
+            key_type = self.enum(where, spec, "key_type", KeyType, allowed=KEY_FIELDS)
+            key_id = self.field(where, spec, "key_id")
+            if key_type == None or key_id == None:
+                continue
+            kw = f"{where} key {key_type.name}/{key_id}"
+            if (key_type, key_id) in seen:
+                self.error(kw, "defined twice")
+            seen.add((key_type, key_id))
+            key = self.data(kw, spec, "key", text=False)
+            if key == None:
+                self.error(kw, "missing 'key'")
+            elif key_type == KeyType.PinKey and not 1 <= len(key) <= 8:
+                self.error(kw, "PIN must be 1 to 8 bytes")
+            elif key_type != KeyType.PinKey and len(key) not in (8, 16):
+                self.error(kw, "key must be 8 or 16 bytes")
+            args = {"key_add_update": 0x01, "key_id": key_id, "key_type": key_type, "key": key,
+                    "usage_rights": self.field(kw, spec, "usage_rights")}
+            for name in KEY_FIELDS[key_type]:
+                args[name] = self.field(kw, spec, name)
+            protection = self.enum(kw, spec, "protection", Protection, required=False)
+            if protection != None:
+                args["protection"] = protection
+            if spec.get("reinject", False):
+                node.reinject.add((key_type, key_id))
+            node.keys.append(args)
+
+        if any("protection" in args for args in node.keys) and (KeyType.ExternalAuthenticationKey, 0) not in seen:
+            self.error(where, "protected WRITE KEY needs ExternalAuthenticationKey 0 in the same DF")
+
+    def parse_credentials(self, node, where, specs, is_mf):
+        if specs and not is_mf:
+            self.error(where, "credentials are only used on the MF, DFs are created by the profile")
+        for spec in specs:
+            key_type = self.enum(where, spec, "key_type", KeyType, allowed=(KeyType.ExternalAuthenticationKey, KeyType.PinKey))
+            key_id = self.field(where, spec, "key_id")
+            key = self.data(where, spec, "key", text=False)
+            followup = self.field(where, spec, "followup_status", required=False)
+            usage = self.field(where, spec, "usage_rights", required=False, default=FREE)
+            if key_type != None and key_id != None and key != None:
+                node.credentials.append((key_type, key_id, key, followup, usage))
+
+    def parse_file(self, node, where, spec):
+        fid = self.field(where, spec, "file_id", byte=False)
+        if fid == None:
+            return None
+        fw = f"{where}/{fid:04X}"
+        file_type = self.enum(fw, spec, "file_type", CPUFileType, allowed=EF_TYPES)
+        ef = {"file_id": fid, "file_type": file_type,
+              "read_perm": self.field(fw, spec, "read_perm"),
+              "write_perm": self.field(fw, spec, "write_perm"),
+              "access_rights": self.field(fw, spec, "access_rights"),
+              "protection": self.enum(fw, spec, "protection", Protection, required=False),
+              "use_tlv": bool(spec.get("use_tlv", False))}
+        if file_type in (CPUFileType.FixLength, CPUFileType.LoopFile) and "file_size" not in spec:
+            count = self.field(fw, spec, "record_count")
+            length = self.field(fw, spec, "record_length")
+            ef["file_size"] = None if count == None or length == None else (count << 8) | length
+        else:
+            ef["file_size"] = self.field(fw, spec, "file_size", byte=False)
+        size = ef["file_size"] or 0
+        if file_type in (CPUFileType.FixLength, CPUFileType.LoopFile):
+            ef["space"] = (size >> 8) * (size & 0xFF)
+        else:
+            ef["space"] = size
+
+        ef["data"] = self.data(fw, spec, "data")
+        if ef["data"] != None and file_type != CPUFileType.BinFile:
+            self.error(fw, "'data' is for binary files, use 'records'")
+        if ef["data"] != None and len(ef["data"]) > size:
+            self.error(fw, f"data is {len(ef['data'])} bytes, file_size is {size}")
+        ef["records"] = [self.data(fw, {"record": r}, "record") for r in spec.get("records", [])]
+        if ef["records"] and file_type not in RECORD_TYPES:
+            self.error(fw, "'records' is for record files")
+        for record in ef["records"]:
+            if record == None:
+                continue
+            length = len(record) + (2 if ef["use_tlv"] else 0)
+            if file_type in (CPUFileType.FixLength, CPUFileType.LoopFile) and length != size & 0xFF:
+                self.error(fw, f"record of {length} bytes, record_length is {size & 0xFF}")
+        if file_type == CPUFileType.FixLength and len(ef["records"]) > size >> 8:
+            self.error(fw, f"{len(ef['records'])} records, record_count is {size >> 8}")
+        if (ef["data"] or ef["records"]) and ef["protection"] != None and not self.line_keys(node):
+            self.error(fw, "protected content needs a FileLineProtectionKey in the DF")
+        node.files.append(ef)
+        return ef
+
+    def parse_wallet(self, node, where, spec):
+        balance_type = self.enum(where, spec, "balance_type", BalanceType)
+        usage = self.field(where, spec, "usage_rights")
+        loop = self.field(where, spec, "loop_file_id")
+        if balance_type == None or usage == None or loop == None:
+            return None
+        if any(wallet["balance_type"] == balance_type for wallet in node.wallets):
+            self.error(where, f"{balance_type.name} defined twice")
+        if not any(ef["file_id"] == loop and ef["file_type"] == CPUFileType.LoopFile for ef in node.files):
+            self.error(where, f"{balance_type.name} loop_file_id {loop:02X} is not a LoopFile of this DF")
+        wallet = {"balance_type": balance_type, "usage_rights": usage, "loop_file_id": loop}
+        node.wallets.append(wallet)
+        return wallet
+
+    def line_keys(self, node):
+        return [args for args in node.keys if args["key_type"] == KeyType.FileLineProtectionKey]
+
+    # ------------------------------------------------------------------ plan
+
+    def select(self, target, names):
+        """Route from the simulated position to `target` with the fewest SELECTs."""
+        if self.maybe == None and self.pos == target:
+            return
+        if self.maybe != None and target in self.maybe:
+            #CREATE DF may or may not have made the new DF current; its FID and the parent's work from both
+            self.plan.add("cmd_select", f"SELECT {_path_str(target)}", fileID=f"{target[-1]:04x}")
+            self.state = None
+        elif self.pos != None and (target == [MF_FID] or target == self.pos[:-1] or target[:-1] == self.pos):
+            self.plan.add("cmd_select", f"SELECT {_path_str(target)}", fileID=f"{target[-1]:04x}")
+            self.state = 0
+        elif names.get(tuple(target)) != None:
+            self.plan.add("cmd_select", f"SELECT {_path_str(target)} by name", name=names[tuple(target)])
+            self.state = 0
+        else:
+            #Down from the current DF when it is an ancestor, otherwise from the MF
+            start = len(self.pos) if self.pos != None and target[:len(self.pos)] == self.pos else 0
+            for depth in range(start, len(target)):
+                self.plan.add("cmd_select", f"SELECT {_path_str(target[:depth + 1])}", fileID=f"{target[depth]:04x}")
+            self.state = 0
+        self.pos = list(target)
+        self.maybe = None
+
+    def authorise(self, node, perm, reason):
+        """Present a credential of `node` unless the simulated state already meets `perm`."""
+        if perm == None or perm == FREE or (self.state != None and allows(perm, self.state)):
+            return
+        state = 0 if self.state == None else self.state
+        #VERIFY PIN is one APDU, EXTERNAL AUTHENTICATE needs a GET CHALLENGE first
+        for kind, key_id, secret, followup, usage in sorted(self.keys.get(tuple(node.path), []), key=lambda cred: cred[0] != PIN):
+            if followup == None or not allows(perm, followup) or not allows(usage, state):
+                continue
+            if kind == EXTERNAL_AUTH:
+                self.plan.add("cmd_external_authenticate", f"EXTERNAL AUTHENTICATE {key_id} for {reason}", key_id=key_id, key=secret)
+            else:
+                self.plan.add("cmd_verify_pin", f"VERIFY PIN {key_id} for {reason}", key_id=key_id, pin_code=secret)
+            self.state = followup
+            return
+        self.error(_path_str(node.path), f"no key meets access condition {perm:02X} for {reason}")
+
+    def register(self, node, key_type, key_id, secret, followup, usage):
+        kind = {KeyType.ExternalAuthenticationKey: EXTERNAL_AUTH, KeyType.PinKey: PIN}.get(key_type)
+        if kind != None:
+            self.keys.setdefault(tuple(node.path), []).append((kind, key_id, secret, None if followup == None else followup & 0x0F, usage))
+
+    def compile_df(self, node, names):
+        where = _path_str(node.path)
+        self.select(node.path, names)
+
+        if node.keyfile != None:
+            self.authorise(node, node.create_permissions, "CREATE keyfile")
+            self.plan.add("cmd_create_keyfile", f"CREATE {where} keyfile", **node.keyfile)
+
+        #External authentication keys first: later steps may need them, protected WRITE KEY uses key 0
+        order = {KeyType.ExternalAuthenticationKey: 0, KeyType.PinKey: 1}
+        keys = sorted(node.keys, key=lambda args: (order.get(args["key_type"], 2), args["key_id"]))
+        extauth = next((args["key"] for args in keys if args["key_type"] == KeyType.ExternalAuthenticationKey and args["key_id"] == 0), None)
+        for args in keys:
+            self.authorise(node, node.keyfile["key_permission"], f"WRITE KEY {args['key_type'].name}")
+            if "protection" in args:
+                args = dict(args, extauth_key=extauth)
+            self.plan.add("cmd_write_key", f"WRITE KEY {where} {args['key_type'].name}/{args['key_id']}", **args)
+            self.register(node, args["key_type"], args["key_id"], args["key"], args.get("followup_status"), args["usage_rights"])
+
+        for ef in node.files:
+            self.authorise(node, node.create_permissions, f"CREATE {ef['file_id']:04X}")
+            kwargs = {name: ef[name] for name in ("file_id", "file_type", "file_size", "read_perm", "write_perm", "access_rights", "protection")}
+            self.plan.add("cmd_create_file", f"CREATE {where}/{ef['file_id']:04X}", **kwargs)
+        for wallet in node.wallets:
+            self.authorise(node, node.create_permissions, f"CREATE {wallet['balance_type'].name}")
+            self.plan.add("cmd_create_edep", f"CREATE {where} {wallet['balance_type'].name}", **wallet)
+
+        for ef in node.files:
+            self.compile_content(node, ef)
+
+        for child in node.children:
+            self.create_df(node, child, names)
+
+    def has_work(self, node):
+        return bool(node.keyfile or node.keys or node.files or node.wallets or node.children)
+
+    def line_key(self, node, ef):
+        """Line protection key of an EF, None for unprotected files."""
+        if ef["protection"] == None:
+            return None
+        #FMCOS picks the line protection key from the write bits of the access rights (NOTES.md)
+        line_keys = self.line_keys(node)
+        wanted = 3 - (ef["access_rights"] & 0x03)
+        return next((args["key"] for args in line_keys if args["key_id"] == wanted), line_keys[0]["key"])
+
+    def compile_content(self, node, ef):
+        if ef["data"] != None:
+            data = ef["data"]
+            self.emit_binary(node, ef, [(offset, data[offset:offset + MAX_DATA_CHUNK]) for offset in range(0, len(data), MAX_DATA_CHUNK)])
+        elif ef["records"]:
+            self.emit_records(node, ef, [("cmd_append_record", number, record) for number, record in enumerate(ef["records"], 1)])
+
+    def emit_binary(self, node, ef, chunks):
+        """UPDATE BINARY each (offset, data) chunk, by SFI when the EF and offsets allow it."""
+        if not chunks:
+            return
+        fid = ef["file_id"]
+        where = f"{_path_str(node.path)}/{fid:04X}"
+        self.authorise(node, ef["write_perm"], f"writing {fid:04X}")
+        key = self.line_key(node, ef)
+        by_sfi = fid <= 0x1e and all(offset <= 0xff for offset, _ in chunks)
+        if not by_sfi:
+            self.plan.add("cmd_select", f"SELECT {where}", fileID=f"{fid:04x}")
+        for offset, chunk in chunks:
+            if by_sfi:
+                self.plan.add("update_binary_sfi", f"UPDATE BINARY {where} at {offset}", sfi=fid, data=chunk, \
+                              offset=offset, key=key, protection=ef["protection"])
+            else:
+                self.plan.add("cmd_update_binary", f"UPDATE BINARY {where} at {offset}", p1=offset >> 8, \
+                              p2=offset & 0xff, data=chunk, key=key, protection=ef["protection"])
+
+    def emit_records(self, node, ef, ops):
+        """Send (method, record number, data) record writes: cmd_append_record or cmd_update_record."""
+        if not ops:
+            return
+        fid = ef["file_id"]
+        where = f"{_path_str(node.path)}/{fid:04X}"
+        self.authorise(node, ef["write_perm"], f"writing {fid:04X}")
+        key = self.line_key(node, ef)
+        by_sfi = fid <= 0x1e
+        if not by_sfi:
+            self.plan.add("cmd_select", f"SELECT {where}", fileID=f"{fid:04x}")
+        for method, number, record in ops:
+            kwargs = {"file_id": fid if by_sfi else 0, "data": record, "key": key, "use_tlv": ef["use_tlv"], "protection": ef["protection"]}
+            if method == "cmd_update_record":
+                kwargs["record_number"] = number
+            self.plan.add(method, f"{'APPEND' if method == 'cmd_append_record' else 'UPDATE'} RECORD {where} #{number}", **kwargs)
+
+    def parse(self):
+        """Validate the profile; return the MF node and the DF path -> name index."""
+        profile = self.profile
+        if not isinstance(profile, dict) or not isinstance(profile.get("mf", {}), dict):
+            raise ProfileError(["profile must be an object with an 'mf' object"])
+        mf = self.parse_df([MF_FID], profile.get("mf", {}))
+        if self.errors:
+            raise ProfileError(self.errors)
+
+        names = {}
+        def collect(node):
+            if node.df_name != None:
+                names[tuple(node.path)] = node.df_name
+            for child in node.children:
+                collect(child)
+        collect(mf)
+
+        for key_type, key_id, key, followup, usage in mf.credentials:
+            self.register(mf, key_type, key_id, key, followup, usage)
+        return mf, names
+
+    def create_df(self, parent, child, names):
+        """CREATE DF `child` from `parent` and personalise everything below it."""
+        self.select(parent.path, names)
+        self.authorise(parent, parent.create_permissions, f"CREATE DF {child.path[-1]:04X}")
+        self.plan.add("cmd_create_directory", f"CREATE DF {_path_str(child.path)}", file_id=child.path[-1], \
+                      file_space=child.file_space, create_permissions=child.create_permissions, \
+                      erase_permission=child.erase_permission, app_id=child.app_id, df_name=child.df_name)
+        self.maybe = [list(parent.path), list(child.path)]
+        if self.has_work(child):
+            self.compile_df(child, names)
+
+    def compile(self):
+        mf, names = self.parse()
+        self.select([MF_FID], names)
+        if self.profile.get("erase", False):
+            self.authorise(mf, mf.erase_permission, "ERASE DF")
+            self.plan.add("cmd_erase_df", "ERASE DF 3F00")
+            self.state = 0
+            #The MF key file goes with the erase
+            self.keys.clear()
+        self.compile_df(mf, names)
+
+        if self.errors:
+            raise ProfileError(self.errors)
+        return self.plan
+
+def validate_profile(profile):
+    """Check a profile offline; raise `ProfileError` listing every problem."""
+    compile_profile(profile)
+
+def compile_profile(profile):
+    """Validate `profile` (dict, or path to a JSON / YAML file) and return its `Plan`."""
+    if isinstance(profile, str):
+        profile = load_profile(profile)
+    return _Compiler(profile).compile()
+
+def personalise(fmcos, profile):
+    """Compile `profile` and run it on the card in the field; return the number of steps."""
+    plan = profile if isinstance(profile, Plan) else compile_profile(profile)
+    return plan.run(fmcos)
@@ -0,0 +1,74 @@
+"""Security status of the current DF as seen from the terminal.
+
+FMCOS keeps one security state register (0..F) per session; it is cleared to 0
+when another DF is selected or the card is reset, and set to the key's follow-up
+state by a successful EXTERNAL AUTHENTICATE or VERIFY PIN. Access conditions are
+bytes XY allowing a command while Y <= state <= X (NOTES.md).
+
+`SecuritySession` mirrors that register so `FMCOS` can skip authentications whose
+result is already in effect and only authenticate when a command needs it.
+"""
+import hashlib
+
+EXTERNAL_AUTH = "external_auth"
+PIN = "pin"
+
+def allows(perm, state):
+    """True when access condition byte `perm` is met with security state `state`."""
+    return (perm & 0x0F) <= state <= (perm >> 4)
+
+def _digest(secret):
+    #Only a digest is kept, the session never holds keys or PINs
+    return hashlib.sha256(bytes(secret)).digest()
+
+class SecuritySession(object):
+    """Tracked security state of the card in the field.
+
+    Attributes:
+        state (int|None): Security state register, None when unknown.
+        satisfied (tuple|None): (kind, key_id, digest) of the authentication currently
+            in effect, None when no authentication is known to hold.
+        skipped (int): Authentications answered from the tracked state.
+    """
+    def __init__(self):
+        self.state = None
+        self.satisfied = None
+        self.skipped = 0
+        self._followups = {}
+
+    def reset(self, known=False):
+        """Forget the authentication in effect; `known` means the card is back to state 0 (DF change, ERASE DF)."""
+        self.state = 0 if known else None
+        self.satisfied = None
+
+    def register_key(self, uid, df_path, kind, key_id, followup_status):
+        """Remember the follow-up state of an external auth / PIN key, e.g. from WRITE KEY."""
+        self._followups[(uid, tuple(df_path), kind, key_id)] = followup_status & 0x0F
+
+    def followup(self, uid, df_path, kind, key_id):
+        """Follow-up state of a key, None when not registered."""
+        if df_path == None:
+            return None
+        return self._followups.get((uid, tuple(df_path), kind, key_id))
+
+    def is_satisfied(self, kind, key_id, secret):
+        """True when the same key / PIN has already been presented successfully in this DF."""
+        return self.satisfied != None and self.satisfied == (kind, key_id, _digest(secret))
+
+    def record(self, kind, key_id, secret, followup_status=None):
+        """Record a successful authentication; it replaces the previous one like the card register does."""
+        self.satisfied = (kind, key_id, _digest(secret))
+        self.state = followup_status
+
+    def forget(self, kind, key_id):
+        """Drop the authentication in effect when it used `key_id`, e.g. after the key or PIN changed."""
+        if self.satisfied != None and self.satisfied[:2] == (kind, key_id):
+            self.satisfied = None
+
+    def allows(self, perm):
+        """True when `perm` is known to be met, False when it is not or the state is unknown."""
+        if perm == None:
+            return False
+        if perm & 0x0F == 0 and perm >> 4 == 0x0F:
+            return True
+        return self.state != None and allows(perm, self.state)
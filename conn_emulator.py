@@ -0,0 +1,950 @@
+import os
+import logging
+import struct
+from utils import bytes_to_hexstr
+from transport import Transport
+from cardlog import transport_log, Hex, enable_debug
+from fmcos import CPUFileType, KeyType
+from tlv import FCI
+from cardcrypto import ZERO_IV, default_cipher_cache, default_mac_engine
+from Crypto.Util.Padding import pad, unpad  # type: ignore
+
+SW_OK = b"\x90\x00"
+
+log = transport_log.getChild("emulator")
+
+# Card capacity and the fixed space charged for objects that do not declare a size
+FM1208_CAPACITY = 0x1F00
+EDEP_SPACE = 0x20
+
+# INITIALIZE P1 -> key type used to derive the session (process) key
+_INITIALIZE_KEYS = {
+    0x00: KeyType.CreditKey,
+    0x01: KeyType.PurchaseKey,
+    0x02: KeyType.PurchaseKey,
+    0x03: KeyType.PurchaseKey,
+    0x04: KeyType.OverdrawLimitKey,
+    0x05: KeyType.DebitKey,
+}
+
+class _CardError(Exception):
+    """Internal: abort the current command with the given SW1 SW2."""
+    def __init__(self, sw):
+        super().__init__(bytes_to_hexstr(sw))
+        self.sw = sw
+
+def _allowed(perm, state):
+    """FMCOS access condition: low nibble <= security state <= high nibble."""
+    return (perm & 0x0F) <= state <= (perm >> 4)
+
+def _make_cipher(key):
+    return default_cipher_cache.cipher(key)
+
+def _encrypt(data, key):
+    cipher = _make_cipher(key)
+    return cipher.encrypt(pad(data, 8, style='iso7816'))
+
+def _decrypt(data, key):
+    cipher = _make_cipher(key)
+    return unpad(cipher.decrypt(data), 8, style='iso7816')
+
+def _mac(buf, key, iv=ZERO_IV):
+    """FMCOS DES / 3DES MAC, 4 bytes."""
+    return default_mac_engine.mac(buf, key, iv)
+
+def _xor_halves(key):
+    return default_cipher_cache.xor_halves(key)
+
+class _Key(object):
+    """One entry of a DF key file."""
+    def __init__(self, key_type, key_id, usage_rights, change_rights, value, key_version=0, algo_id=0,
+                 followup_status=0, error_counter=0xFF):
+        self.key_type = key_type
+        self.key_id = key_id
+        self.usage_rights = usage_rights
+        self.change_rights = change_rights
+        self.value = value
+        self.key_version = key_version
+        self.algo_id = algo_id
+        self.followup_status = followup_status
+        # High nibble: retry limit, low nibble: tries left
+        self.error_counter = error_counter
+
+    def tries_left(self):
+        return self.error_counter & 0x0F
+
+    def record_failure(self):
+        left = max(self.tries_left() - 1, 0)
+        self.error_counter = (self.error_counter & 0xF0) | left
+        if left == 0:
+            raise _CardError(b"\x69\x83")
+        raise _CardError(bytes([0x63, 0xC0 | left]))
+
+    def record_success(self):
+        self.error_counter = (self.error_counter & 0xF0) | (self.error_counter >> 4)
+
+class _Purse(object):
+    """Electronic deposit / electronic purse (EDEP) state."""
+    def __init__(self, usage_rights, loop_file_id):
+        self.usage_rights = usage_rights
+        self.loop_file_id = loop_file_id
+        self.balance = 0
+        self.overdraft_limit = 0
+        self.online_serial = 0
+        self.offline_serial = 0
+
+class _EFile(object):
+    """Elementary file: binary, fixed/variable record or loop (cyclic) file."""
+    def __init__(self, fid, file_type, size, read_perm, write_perm, access_rights):
+        self.fid = fid
+        self.file_type = file_type & 0x3F
+        self.protection = file_type & 0xC0
+        self.size = size
+        self.read_perm = read_perm
+        self.write_perm = write_perm
+        self.access_rights = access_rights
+        self.data = bytearray(size) if self.file_type == CPUFileType.BinFile else None
+        self.records = []
+
+    def record_layout(self):
+        """Return (max record count, record length) for fixed and loop files."""
+        return self.size >> 8, self.size & 0xFF
+
+    def space(self):
+        if self.file_type in (CPUFileType.FixLength, CPUFileType.LoopFile):
+            count, length = self.record_layout()
+            return count * (length + 1) + 8
+        return self.size
+
+    def line_key_id(self, write):
+        """Key ID of the line protection key selected by the access rights byte (see NOTES.md)."""
+        bits = self.access_rights & 0x03 if write else (self.access_rights >> 2) & 0x03
+        return 3 - bits
+
+class _DFile(object):
+    """MF / DF with its key file, children and purses."""
+    def __init__(self, fid, name, space, create_perm, erase_perm, app_id, parent=None):
+        self.fid = fid
+        self.name = name
+        self.space = space
+        self.create_perm = create_perm
+        self.erase_perm = erase_perm
+        self.app_id = app_id
+        self.parent = parent
+        self.clear()
+
+    def clear(self):
+        self.children = {}
+        self.keyfile_perm = None
+        self.keys = {}
+        self.purses = {}
+        self.used = 0
+        self.blocked = None     # None, "temporary" or "permanent"
+
+    def find_key(self, key_type, key_id=None):
+        if key_id is not None:
+            return self.keys.get((key_type, key_id))
+        for (k_type, _), key in sorted(self.keys.items()):
+            if k_type == key_type:
+                return key
+        return None
+
+    def walk(self):
+        yield self
+        for child in self.children.values():
+            if isinstance(child, _DFile):
+                yield from child.walk()
+
+    def fci(self):
+        """FCI template returned by SELECT: 6F [84 DF name] [A5 [88 SFI]]."""
+        return FCI(df_name=self.name, sfi=self.app_id & 0xFF).encode()
+
+class VirtualFM1208(object):
+    """Pure-Python model of an FM1208 card running FMCOS 2.0.
+
+    Implements the file system (MF/DF/key file/binary/record/loop files and EDEPs),
+    access-rights checks against the security state register, line protection
+    (MAC and MAC+ENC), external/internal authentication, PIN handling, application
+    blocking and the load/purchase/withdraw/unload/overdraft transactions.
+
+    With `t0=True` the card answers like a T=0 card: response data is held back
+    behind 61xx and has to be fetched with GET RESPONSE (00 C0).
+    """
+    def __init__(self, capacity=FM1208_CAPACITY, read_all_records=True, t0=False):
+        self.mf = _DFile(0x3F00, b"1PAY.SYS.DDF01", capacity, 0xF0, 0xF0, 0x01)
+        # Support the ISO "read all records from P1" READ RECORD mode
+        self.read_all_records = read_all_records
+        self.t0 = t0
+        self._response = b""
+        self.card_blocked = False
+        self.reset()
+        self._handlers = {
+            0xA4: self._select,
+            0x84: self._get_challenge,
+            0x0E: self._erase_df,
+            0xE0: self._create_file,
+            0xD4: self._write_key,
+            0x82: self._external_authenticate,
+            0x88: self._internal_authenticate,
+            0x20: self._verify_pin,
+            0x5E: self._change_reset_pin,
+            0x24: self._pin_unblock,
+            0xB0: self._read_binary,
+            0xD6: self._update_binary,
+            0xB2: self._read_record,
+            0xDC: self._update_record,
+            0xE2: self._append_record,
+            0x5C: self._get_balance,
+            0x50: self._initialize,
+            0x52: self._credit,
+            0x54: self._debit,
+            0x58: self._update_overdraft,
+            0x16: self._card_block,
+            0x1E: self._app_block,
+            0x18: self._app_unblock,
+        }
+
+    def reset(self):
+        """Power cycle: back to MF, security state and pending operations cleared."""
+        self.current_df = self.mf
+        self.current_ef = None
+        self.security_state = 0
+        self.challenge = None
+        self.pending = None
+
+    # ------------------------------------------------------------------ APDU dispatch
+
+    def process(self, apdu):
+        """Execute one command APDU and return response data + SW1 SW2."""
+        apdu = bytes(apdu)
+        if len(apdu) < 4:
+            return b"\x67\x00"
+        cla, ins, p1, p2 = apdu[:4]
+        data = b""
+        le = None
+        if len(apdu) == 5:
+            le = apdu[4]
+        elif len(apdu) > 5:
+            lc = apdu[4]
+            data = apdu[5:5 + lc]
+            if len(data) != lc or len(apdu) > 6 + lc:
+                return b"\x67\x00"
+            if len(apdu) == 6 + lc:
+                le = apdu[-1]
+
+        if cla & ~0x04 not in (0x00, 0x80):
+            return b"\x6E\x00"
+        if self.t0 and ins == 0xC0:
+            return self._get_response(le)
+        handler = self._handlers.get(ins)
+        if handler is None:
+            return b"\x6D\x00"
+        if self.card_blocked and ins != 0x84:
+            return b"\x6A\x81"
+
+        self._response = b""
+        try:
+            ret = handler(cla, p1, p2, data, le)
+        except _CardError as e:
+            return e.sw
+        if self.t0 and ret:
+            self._response = ret
+            return bytes([0x61, len(ret) & 0xFF])
+        return ret + SW_OK
+
+    def _get_response(self, le):
+        """GET RESPONSE: hand out the data held back by the previous command."""
+        if not self._response:
+            return b"\x69\x85"
+        length = le or 256
+        if length > len(self._response):
+            return bytes([0x6C, len(self._response) & 0xFF])
+        ret, self._response = self._response[:length], self._response[length:]
+        if self._response:
+            return ret + bytes([0x61, len(self._response) & 0xFF])
+        return ret + SW_OK
+
+    # ------------------------------------------------------------------ helpers
+
+    def _check(self, perm):
+        #A DF is still being personalised until its master key (external authentication key 00)
+        #is loaded, its access conditions only apply from then on
+        if self.current_df.find_key(KeyType.ExternalAuthenticationKey, 0) is None:
+            return
+        if not _allowed(perm, self.security_state):
+            raise _CardError(b"\x69\x82")
+
+    def _check_app(self):
+        if self.current_df.blocked:
+            raise _CardError(b"\x6A\x81")
+
+    def _take_challenge(self):
+        chlg = self.challenge
+        self.challenge = None
+        if chlg is None:
+            raise _CardError(b"\x69\x84")
+        return chlg
+
+    def _verify_mac(self, cla, ins, p1, p2, data, key):
+        """Strip and check the trailing 4-byte line protection MAC of `data`."""
+        if key is None:
+            raise _CardError(b"\x69\x88")
+        if len(data) < 4:
+            raise _CardError(b"\x67\x00")
+        iv = self._take_challenge()
+        payload = data[:-4]
+        mac_input = bytes([cla, ins, p1, p2, len(data)]) + payload
+        if _mac(mac_input, key.value, iv) != data[-4:]:
+            raise _CardError(b"\x93\x02")
+        return payload
+
+    def _line_key(self, key_id=0):
+        key = self.current_df.find_key(KeyType.FileLineProtectionKey, key_id)
+        return key if key is not None else self.current_df.find_key(KeyType.FileLineProtectionKey)
+
+    def _select_df(self, df):
+        if df is not self.current_df:
+            self.security_state = 0
+            self.challenge = None
+        self.current_df = df
+        self.current_ef = None
+
+    def _find_ef(self, sfi):
+        """Resolve an SFI (0 = current EF) to an EF of the current DF and make it current."""
+        if sfi == 0:
+            ef = self.current_ef
+        else:
+            ef = self.current_df.children.get(sfi)
+        if not isinstance(ef, _EFile):
+            raise _CardError(b"\x6A\x82")
+        self.current_ef = ef
+        return ef
+
+    def _allocate(self, space):
+        df = self.current_df
+        if df.used + space > df.space:
+            raise _CardError(b"\x6A\x84")
+        df.used += space
+
+    # ------------------------------------------------------------------ file system
+
+    def _select(self, cla, p1, p2, data, le):
+        if p1 == 0x04:
+            for df in self.mf.walk():
+                if df.name == data:
+                    self._select_df(df)
+                    break
+            else:
+                raise _CardError(b"\x6A\x82")
+            self._check_app()
+            return df.fci()
+
+        if p1 != 0x00 or len(data) != 2:
+            raise _CardError(b"\x6A\x86")
+        fid = (data[0] << 8) | data[1]
+        df = self.current_df
+        if fid == 0x3F00:
+            target = self.mf
+        elif fid == df.fid:
+            target = df
+        elif fid in df.children:
+            target = df.children[fid]
+        elif df.parent is not None and fid == df.parent.fid:
+            target = df.parent
+        else:
+            raise _CardError(b"\x6A\x82")
+
+        if isinstance(target, _DFile):
+            self._select_df(target)
+            self._check_app()
+            return target.fci()
+        self._check_app()
+        self.current_ef = target
+        return b""
+
+    def _get_challenge(self, cla, p1, p2, data, le):
+        if le not in (4, 8):
+            raise _CardError(b"\x67\x00")
+        chlg = os.urandom(le)
+        self.challenge = chlg + b"\x00" * (8 - le)
+        return chlg
+
+    def _erase_df(self, cla, p1, p2, data, le):
+        df = self.current_df
+        self._check(df.erase_perm)
+        df.clear()
+        self.current_ef = None
+        self.security_state = 0
+        return b""
+
+    def _create_file(self, cla, p1, p2, data, le):
+        self._check_app()
+        df = self.current_df
+        fid = (p1 << 8) | p2
+        if len(data) < 7:
+            raise _CardError(b"\x67\x00")
+        file_type = data[0]
+        base_type = file_type & 0x3F
+
+        if base_type == CPUFileType.Keyfile:
+            self._check(df.create_perm)
+            if df.keyfile_perm is not None:
+                raise _CardError(b"\x6A\x89")
+            self._allocate(struct.unpack(">H", data[1:3])[0])
+            df.keyfile_perm = data[4]
+            return b""
+
+        if base_type == CPUFileType.Wallet:
+            self._check(df.create_perm)
+            if fid in df.purses:
+                raise _CardError(b"\x6A\x89")
+            self._allocate(EDEP_SPACE)
+            df.purses[fid] = _Purse(usage_rights=data[3], loop_file_id=data[6])
+            return b""
+
+        if fid in df.children or fid == 0x3F00:
+            raise _CardError(b"\x6A\x89")
+
+        if base_type == CPUFileType.MFDF:
+            self._check(df.create_perm)
+            space = struct.unpack(">H", data[1:3])[0]
+            name = bytes(data[8:])
+            if any(other.name == name for other in self.mf.walk()):
+                raise _CardError(b"\x6A\x8A")
+            self._allocate(space)
+            df.children[fid] = _DFile(fid, name, space, data[3], data[4], data[5], parent=df)
+            return b""
+
+        if base_type not in (CPUFileType.BinFile, CPUFileType.FixLength, CPUFileType.VariableLength, CPUFileType.LoopFile):
+            raise _CardError(b"\x6A\x80")
+        self._check(df.create_perm)
+        ef = _EFile(fid, file_type, struct.unpack(">H", data[1:3])[0], data[3], data[4], data[6])
+        self._allocate(ef.space())
+        df.children[fid] = ef
+        return b""
+
+    # ------------------------------------------------------------------ keys and authentication
+
+    def _write_key(self, cla, p1, p2, data, le):
+        self._check_app()
+        df = self.current_df
+        if df.keyfile_perm is None:
+            raise _CardError(b"\x6A\x82")
+
+        if cla & 0x04:
+            master = df.find_key(KeyType.ExternalAuthenticationKey, 0)
+            data = self._verify_mac(cla, 0xD4, p1, p2, data, master)
+            if len(data) % 8 == 0 and data:
+                try:
+                    plain = _decrypt(data, master.value)
+                except ValueError:
+                    raise _CardError(b"\x69\x88")
+                data = plain[1:1 + plain[0]]
+        if not data:
+            raise _CardError(b"\x67\x00")
+
+        key_type = data[0] & 0x3F
+        key_id = p2
+        if p1 == 0x01:
+            self._check(df.keyfile_perm)
+        else:
+            existing = df.keys.get((key_type, key_id))
+            if existing is None:
+                raise _CardError(b"\x6A\x88")
+            self._check(existing.change_rights)
+
+        match key_type:
+            case KeyType.InternalKey | KeyType.OverdrawLimitKey | KeyType.DebitKey | KeyType.PurchaseKey \
+                | KeyType.CreditKey | KeyType.DESEncrypt | KeyType.DESDecrypt | KeyType.DESMAC:
+                key = _Key(key_type, key_id, data[1], data[2], bytes(data[5:]), key_version=data[3], algo_id=data[4])
+            case KeyType.ExternalAuthenticationKey | KeyType.PinKey:
+                key = _Key(key_type, key_id, data[1], data[2], bytes(data[5:]), followup_status=data[3], error_counter=data[4])
+            case KeyType.UnlockPinKey | KeyType.FileLineProtectionKey | KeyType.ChangePinKey:
+                key = _Key(key_type, key_id, data[1], data[2], bytes(data[5:]), error_counter=data[4])
+            case _:
+                raise _CardError(b"\x6A\x80")
+        if len(key.value) not in (8, 16) and key_type != KeyType.PinKey:
+            raise _CardError(b"\x67\x00")
+        df.keys[(key_type, key_id)] = key
+        return b""
+
+    def _external_authenticate(self, cla, p1, p2, data, le):
+        self._check_app()
+        key = self.current_df.find_key(KeyType.ExternalAuthenticationKey, p2)
+        if key is None:
+            raise _CardError(b"\x6A\x88")
+        if key.tries_left() == 0:
+            raise _CardError(b"\x69\x83")
+        self._check(key.usage_rights)
+        chlg = self._take_challenge()
+        if _make_cipher(key.value).encrypt(chlg) != bytes(data):
+            key.record_failure()
+        key.record_success()
+        self.security_state = key.followup_status & 0x0F
+        return b""
+
+    def _internal_authenticate(self, cla, p1, p2, data, le):
+        self._check_app()
+        key_type = {0x00: KeyType.DESEncrypt, 0x01: KeyType.DESDecrypt, 0x02: KeyType.DESMAC}.get(p1)
+        if key_type is None:
+            raise _CardError(b"\x6A\x86")
+        key = self.current_df.find_key(key_type, p2)
+        if key is None:
+            raise _CardError(b"\x6A\x88")
+        self._check(key.usage_rights)
+        if key_type == KeyType.DESMAC:
+            return _mac(bytes(data), key.value)
+        cipher = _make_cipher(key.value)
+        data = pad(bytes(data), 8, style='iso7816') if len(data) % 8 else bytes(data)
+        if key_type == KeyType.DESEncrypt:
+            return cipher.encrypt(data)
+        return cipher.decrypt(data)
+
+    def _pin_key(self, key_id):
+        key = self.current_df.find_key(KeyType.PinKey, key_id)
+        if key is None:
+            raise _CardError(b"\x6A\x88")
+        if key.tries_left() == 0:
+            raise _CardError(b"\x69\x83")
+        return key
+
+    def _verify_pin(self, cla, p1, p2, data, le):
+        self._check_app()
+        key = self._pin_key(p2)
+        self._check(key.usage_rights)
+        if key.value != bytes(data):
+            key.record_failure()
+        key.record_success()
+        self.security_state = key.followup_status & 0x0F
+        return b""
+
+    def _change_reset_pin(self, cla, p1, p2, data, le):
+        self._check_app()
+        key = self._pin_key(p2)
+        if p1 == 0x01:
+            # Change: old PIN | FF | new PIN
+            old_len = len(key.value)
+            if bytes(data[:old_len]) != key.value or data[old_len:old_len + 1] != b"\xff":
+                key.record_failure()
+            key.record_success()
+            key.value = bytes(data[old_len + 1:])
+            return b""
+
+        if p1 == 0x00:
+            # Reset: new PIN | MAC(new PIN) keyed with the XOR of the change PIN key halves
+            change_key = self.current_df.find_key(KeyType.ChangePinKey, p2) or self.current_df.find_key(KeyType.ChangePinKey)
+            if change_key is None:
+                raise _CardError(b"\x6A\x88")
+            self._check(change_key.usage_rights)
+            new_pin = bytes(data[:-4])
+            if _mac(new_pin, _xor_halves(change_key.value)) != data[-4:]:
+                raise _CardError(b"\x93\x02")
+            key.value = new_pin
+            key.record_success()
+            return b""
+        raise _CardError(b"\x6A\x86")
+
+    def _pin_unblock(self, cla, p1, p2, data, le):
+        self._check_app()
+        key = self.current_df.find_key(KeyType.PinKey, p1)
+        unlock_key = self.current_df.find_key(KeyType.UnlockPinKey, p1) or self.current_df.find_key(KeyType.UnlockPinKey)
+        if key is None or unlock_key is None:
+            raise _CardError(b"\x6A\x88")
+        enc_pin = self._verify_mac(cla, 0x24, p1, p2, data, unlock_key)
+        plain = _decrypt(enc_pin, unlock_key.value)
+        if plain[1:1 + plain[0]] != key.value:
+            raise _CardError(b"\x6A\x80")
+        key.record_success()
+        return b""
+
+    # ------------------------------------------------------------------ binary / record files
+
+    def _read_binary(self, cla, p1, p2, data, le):
+        self._check_app()
+        if p1 & 0x80:
+            ef = self._find_ef(p1 & 0x1F)
+            offset = p2
+        else:
+            ef = self._find_ef(0)
+            offset = (p1 << 8) | p2
+        if ef.file_type != CPUFileType.BinFile:
+            raise _CardError(b"\x69\x81")
+        self._check(ef.read_perm)
+        if offset >= ef.size:
+            raise _CardError(b"\x6B\x00")
+
+        available = ef.size - offset
+        if le == 0 or le is None:
+            length = min(available, 256)
+        elif le > available:
+            raise _CardError(bytes([0x6C, available & 0xFF]))
+        else:
+            length = le
+        return self._protected_read(cla, 0xB0, p1, p2, data, ef, bytes(ef.data[offset:offset + length]))
+
+    def _update_binary(self, cla, p1, p2, data, le):
+        self._check_app()
+        if p1 & 0x80:
+            ef = self._find_ef(p1 & 0x1F)
+            offset = p2
+        else:
+            ef = self._find_ef(0)
+            offset = (p1 << 8) | p2
+        if ef.file_type != CPUFileType.BinFile:
+            raise _CardError(b"\x69\x81")
+        self._check(ef.write_perm)
+        payload = self._protected_write(cla, 0xD6, p1, p2, data, ef)
+        if offset + len(payload) > ef.size:
+            raise _CardError(b"\x6A\x84")
+        ef.data[offset:offset + len(payload)] = payload
+        return b""
+
+    def _protected_read(self, cla, ins, p1, p2, data, ef, plain):
+        """Wrap read data with MAC (and encryption) when the file or command asks for it."""
+        if not cla & 0x04:
+            if ef.protection:
+                raise _CardError(b"\x69\x82")
+            return plain
+        key = self._line_key(ef.line_key_id(write=False))
+        # The response MAC is chained from the same challenge as the command MAC
+        iv = self.challenge
+        self._verify_mac(cla, ins, p1, p2, data, key)
+        if ef.protection == 0xC0:
+            plain = _encrypt(bytes([len(plain)]) + plain, key.value)
+        return plain + _mac(plain, key.value, iv)
+
+    def _protected_write(self, cla, ins, p1, p2, data, ef):
+        """Check MAC (and decrypt) incoming data for protected files."""
+        if not cla & 0x04:
+            if ef.protection:
+                raise _CardError(b"\x69\x82")
+            return bytes(data)
+        key = self._line_key(ef.line_key_id(write=True))
+        payload = self._verify_mac(cla, ins, p1, p2, data, key)
+        if ef.protection == 0xC0:
+            try:
+                plain = _decrypt(payload, key.value)
+            except ValueError:
+                raise _CardError(b"\x69\x88")
+            payload = plain[1:1 + plain[0]]
+        return bytes(payload)
+
+    def _record_ef(self, p2):
+        ef = self._find_ef(p2 >> 3)
+        if ef.file_type not in (CPUFileType.FixLength, CPUFileType.VariableLength, CPUFileType.LoopFile):
+            raise _CardError(b"\x69\x81")
+        return ef
+
+    def _read_record(self, cla, p1, p2, data, le):
+        self._check_app()
+        ef = self._record_ef(p2)
+        self._check(ef.read_perm)
+        mode = p2 & 0x07
+        if mode == 0x05 and self.read_all_records:
+            return self._read_all_records(cla, p1, p2, data, le, ef)
+        if mode == 0x04:
+            index = p1
+        elif mode == 0x00:
+            index = 1
+        elif mode == 0x01:
+            index = len(ef.records)
+        else:
+            raise _CardError(b"\x6A\x86")
+        if index < 1 or index > len(ef.records):
+            raise _CardError(b"\x6A\x83")
+
+        record = ef.records[index - 1]
+        if le and le > len(record):
+            raise _CardError(bytes([0x6C, len(record)]))
+        if le:
+            record = record[:le]
+        return self._protected_read(cla, 0xB2, p1, p2, data, ef, bytes(record))
+
+    def _read_all_records(self, cla, p1, p2, data, le, ef):
+        """READ RECORD P2 b3..b1 = 101: records P1..last, as many whole records as fit in Le."""
+        if p1 < 1 or p1 > len(ef.records):
+            raise _CardError(b"\x6A\x83")
+        limit = le or 256
+        out = b""
+        for record in ef.records[p1 - 1:]:
+            if len(out) + len(record) > limit:
+                break
+            out += record
+        if not out:
+            raise _CardError(bytes([0x6C, len(ef.records[p1 - 1]) & 0xFF]))
+        return self._protected_read(cla, 0xB2, p1, p2, data, ef, out)
+
+    def _check_record_length(self, ef, payload):
+        if ef.file_type in (CPUFileType.FixLength, CPUFileType.LoopFile):
+            if len(payload) != ef.record_layout()[1]:
+                raise _CardError(b"\x67\x00")
+        elif sum(len(r) for r in ef.records) + len(payload) > ef.size:
+            raise _CardError(b"\x6A\x84")
+
+    def _update_record(self, cla, p1, p2, data, le):
+        self._check_app()
+        ef = self._record_ef(p2)
+        self._check(ef.write_perm)
+        payload = self._protected_write(cla, 0xDC, p1, p2, data, ef)
+        if p1 < 1 or p1 > len(ef.records) + 1 or (p1 > len(ef.records) and ef.file_type != CPUFileType.VariableLength):
+            raise _CardError(b"\x6A\x83")
+        if p1 > len(ef.records):
+            self._check_record_length(ef, payload)
+            ef.records.append(payload)
+        else:
+            if ef.file_type != CPUFileType.VariableLength and len(payload) != len(ef.records[p1 - 1]):
+                raise _CardError(b"\x67\x00")
+            ef.records[p1 - 1] = payload
+        return b""
+
+    def _append_record(self, cla, p1, p2, data, le):
+        self._check_app()
+        ef = self._record_ef(p2)
+        self._check(ef.write_perm)
+        payload = self._protected_write(cla, 0xE2, p1, p2, data, ef)
+        self._push_record(ef, payload)
+        return b""
+
+    def _push_record(self, ef, payload):
+        if ef.file_type == CPUFileType.LoopFile:
+            count, length = ef.record_layout()
+            if len(payload) != length:
+                raise _CardError(b"\x67\x00")
+            # Record 1 is always the most recent entry
+            ef.records.insert(0, payload)
+            del ef.records[count:]
+            return
+        if ef.file_type == CPUFileType.FixLength and len(ef.records) >= ef.record_layout()[0]:
+            raise _CardError(b"\x6A\x84")
+        self._check_record_length(ef, payload)
+        ef.records.append(payload)
+
+    # ------------------------------------------------------------------ blocking
+
+    def _check_block_mac(self, cla, ins, p1, p2, data):
+        self._verify_mac(cla, ins, p1, p2, data, self._line_key())
+
+    def _card_block(self, cla, p1, p2, data, le):
+        self._check_block_mac(cla, 0x16, p1, p2, data)
+        self.card_blocked = True
+        return b""
+
+    def _app_block(self, cla, p1, p2, data, le):
+        self._check_app()
+        self._check_block_mac(cla, 0x1E, p1, p2, data)
+        self.current_df.blocked = "permanent" if p2 == 0x01 else "temporary"
+        return b""
+
+    def _app_unblock(self, cla, p1, p2, data, le):
+        if self.current_df.blocked != "temporary":
+            raise _CardError(b"\x69\x85")
+        self._check_block_mac(cla, 0x18, p1, p2, data)
+        self.current_df.blocked = None
+        return b""
+
+    # ------------------------------------------------------------------ electronic purse
+
+    def _purse(self, balance_type):
+        purse = self.current_df.purses.get(balance_type)
+        if purse is None:
+            raise _CardError(b"\x6A\x82")
+        self._check(purse.usage_rights)
+        return purse
+
+    def _log_transaction(self, purse, serial, amount, trans_type, terminal_id, date_time):
+        loop = self.current_df.children.get(purse.loop_file_id)
+        if not isinstance(loop, _EFile):
+            return
+        # serial(2) overdraft limit(3) amount(4) type(1) terminal(6) date(4) time(3)
+        record = serial + struct.pack(">I", purse.overdraft_limit)[1:] + amount + bytes([trans_type]) + terminal_id + date_time
+        if loop.file_type == CPUFileType.LoopFile and len(record) != loop.record_layout()[1]:
+            return
+        self._push_record(loop, record)
+
+    def _get_balance(self, cla, p1, p2, data, le):
+        self._check_app()
+        return struct.pack(">I", self._purse(p2).balance)
+
+    def _initialize(self, cla, p1, p2, data, le):
+        """INITIALIZE FOR LOAD (00) / PURCHASE (01) / CASH WITHDRAW (02) / CAPP (03) / OVERDRAFT (04) / UNLOAD (05)."""
+        self._check_app()
+        self.pending = None
+        purse = self._purse(p2)
+        key_type = _INITIALIZE_KEYS.get(p1)
+        if key_type is None or not data:
+            raise _CardError(b"\x6A\x86")
+        key = self.current_df.find_key(key_type, data[0])
+        if key is None:
+            raise _CardError(b"\x94\x03")
+
+        random_1 = os.urandom(4)
+        balance = struct.pack(">I", purse.balance)
+        key_info = bytes([key.key_version, key.algo_id])
+        pending = {"p1": p1, "balance_type": p2, "purse": purse, "key": key}
+
+        if p1 == 0x04:
+            # Online: the process key comes from the online serial only
+            serial = struct.pack(">H", purse.online_serial)
+            terminal_id = bytes(data[1:7])
+            process_key = _encrypt(random_1 + serial, key.value)[:8]
+            old_limit = struct.pack(">I", purse.overdraft_limit)[1:]
+            mac_1 = _mac(balance + old_limit + b"\x07" + terminal_id, process_key)
+            pending.update(terminal_id=terminal_id, serial=serial, process_key=process_key)
+            self.pending = pending
+            return balance + serial + old_limit + key_info + random_1 + mac_1
+
+        amount = bytes(data[1:5])
+        terminal_id = bytes(data[5:11])
+        pending.update(amount=amount, terminal_id=terminal_id)
+        if p1 != 0x00 and struct.unpack(">I", amount)[0] > purse.balance:
+            raise _CardError(b"\x94\x01")
+
+        if p1 in (0x00, 0x05):
+            serial = struct.pack(">H", purse.online_serial)
+            trans_type = p2 if p1 == 0x00 else 0x03
+            process_key = _encrypt(random_1 + serial, key.value)[:8]
+            mac_1 = _mac(balance + amount + bytes([trans_type]) + terminal_id, process_key)
+            pending.update(serial=serial, process_key=process_key, trans_type=trans_type)
+            self.pending = pending
+            return balance + serial + key_info + random_1 + mac_1
+
+        # Offline: the process key also needs the terminal serial sent with the debit
+        serial = struct.pack(">H", purse.offline_serial)
+        pending.update(serial=serial, random_1=random_1)
+        self.pending = pending
+        return balance + serial + struct.pack(">I", purse.overdraft_limit)[1:] + key_info + random_1
+
+    def _take_pending(self, *init_p1):
+        pending, self.pending = self.pending, None
+        if pending is None or pending["p1"] not in init_p1:
+            raise _CardError(b"\x69\x85")
+        return pending
+
+    def _tac_key(self):
+        internal = self.current_df.find_key(KeyType.InternalKey)
+        if internal is None:
+            raise _CardError(b"\x94\x03")
+        return _xor_halves(internal.value) if len(internal.value) == 16 else internal.value
+
+    def _online_mac2(self, pending, data):
+        """Check MAC2 of CREDIT FOR LOAD / DEBIT FOR UNLOAD: date(4) time(3) MAC2(4)."""
+        date_time = bytes(data[:7])
+        mac2_buffer = pending["amount"] + bytes([pending["trans_type"]]) + pending["terminal_id"] + date_time
+        if _mac(mac2_buffer, pending["process_key"]) != data[7:11]:
+            raise _CardError(b"\x93\x02")
+        return date_time, mac2_buffer
+
+    def _commit_online(self, pending, delta, date_time, trans_type):
+        purse = pending["purse"]
+        serial = pending["serial"]
+        purse.balance += delta
+        purse.online_serial = (struct.unpack(">H", serial)[0] + 1) & 0xFFFF
+        self._log_transaction(purse, serial, pending.get("amount", bytes(4)), trans_type, pending["terminal_id"], date_time)
+        return struct.pack(">I", purse.balance) + serial
+
+    def _credit(self, cla, p1, p2, data, le):
+        """CREDIT FOR LOAD -> TAC."""
+        pending = self._take_pending(0x00)
+        date_time, mac2_buffer = self._online_mac2(pending, data)
+        amount = struct.unpack(">I", pending["amount"])[0]
+        prefix = self._commit_online(pending, amount, date_time, pending["trans_type"])
+        return _mac(prefix + mac2_buffer, self._tac_key())
+
+    def _debit(self, cla, p1, p2, data, le):
+        """DEBIT FOR PURCHASE / CASH WITHDRAW (P1=01) and DEBIT FOR UNLOAD (P1=03)."""
+        if p1 == 0x03:
+            pending = self._take_pending(0x05)
+            date_time, mac2_buffer = self._online_mac2(pending, data)
+            amount = struct.unpack(">I", pending["amount"])[0]
+            prefix = self._commit_online(pending, -amount, date_time, pending["trans_type"])
+            return _mac(prefix + mac2_buffer, pending["process_key"])
+
+        pending = self._take_pending(0x01, 0x02, 0x03)
+        if pending["p1"] == 0x01:
+            trans_type = 0x05 if pending["balance_type"] == 0x01 else 0x06
+        else:
+            trans_type = 0x04 if pending["p1"] == 0x02 else 0x09
+        purse = pending["purse"]
+        serial = pending["serial"]
+        amount = pending["amount"]
+        terminal_id = pending["terminal_id"]
+        terminal_serial = bytes(data[:4])
+        date_time = bytes(data[4:11])
+
+        process_key = _encrypt(pending["random_1"] + serial + terminal_serial[-2:], pending["key"].value)[:8]
+        mac1_buffer = amount + bytes([trans_type]) + terminal_id + date_time
+        if _mac(mac1_buffer, process_key) != data[11:15]:
+            raise _CardError(b"\x93\x02")
+
+        purse.balance -= struct.unpack(">I", amount)[0]
+        purse.offline_serial = (struct.unpack(">H", serial)[0] + 1) & 0xFFFF
+        self._log_transaction(purse, serial, amount, trans_type, terminal_id, date_time)
+        tac = _mac(amount + bytes([trans_type]) + terminal_id + terminal_serial + date_time, self._tac_key())
+        return tac + _mac(amount, process_key)
+
+    def _update_overdraft(self, cla, p1, p2, data, le):
+        """UPDATE OVERDRAW LIMIT: new limit(3) date(4) time(3) MAC2(4) -> TAC."""
+        pending = self._take_pending(0x04)
+        new_limit = bytes(data[:3])
+        date_time = bytes(data[3:10])
+        mac2_buffer = new_limit + b"\x07" + pending["terminal_id"] + date_time
+        if _mac(mac2_buffer, pending["process_key"]) != data[10:14]:
+            raise _CardError(b"\x93\x02")
+
+        purse = pending["purse"]
+        limit = struct.unpack(">I", b"\x00" + new_limit)[0]
+        # The available balance includes the overdraft, replace the old limit with the new one
+        delta = limit - purse.overdraft_limit
+        purse.overdraft_limit = limit
+        prefix = self._commit_online(pending, delta, date_time, 0x07)
+        return _mac(prefix + mac2_buffer, self._tac_key())
+
+class BRIDGE_EMULATOR(Transport):
+    """Transport backed by a `VirtualFM1208`, for hardware-free testing and benchmarking.
+
+    Attributes:
+        card: The emulated card, kept across `remove_card()` / `insert_card()`.
+        uid: UID reported by `nfcFindCard()`.
+        apdu_count: Number of APDUs exchanged so far.
+    """
+    def __init__(self, hw_debug=False, card=None, uid=None):
+        self.nfc = None
+        self._debug = hw_debug
+        if hw_debug:
+            enable_debug(log)
+        self.card = card if card is not None else VirtualFM1208()
+        self.uid = uid if uid is not None else os.urandom(4)
+        self.in_field = True
+        self.apdu_count = 0
+
+    def insert_card(self, card=None, uid=None):
+        """Put a card (the current one by default) in the field, which power-on resets it."""
+        if card is not None:
+            self.card = card
+        if uid is not None:
+            self.uid = uid
+        self.card.reset()
+        self.in_field = True
+
+    def remove_card(self):
+        """Take the card out of the field."""
+        self.in_field = False
+
+    def nfcFindCard(self):
+        """Return the UID when a card is present, otherwise 'noCard'."""
+        if not self.in_field:
+            return 'noCard'
+        return self.uid
+
+    def transceive(self, apdu):
+        """Execute the APDU on the emulated card."""
+        if not self.in_field:
+            raise ValueError("No card in the emulator field")
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug("EMULATOR => %s", Hex(apdu))
+        self.apdu_count += 1
+        ret = self.card.process(apdu)
+        if debug:
+            log.debug("EMULATOR <= %s", Hex(ret))
+        return ret
@@ -1,54 +1,108 @@
+import re
 import sys
+import logging
+from transport import Transport
+from cardlog import transport_log, enable_debug
 
-# Optional color support for prettier console logs. Install with: `pip install ansicolors`
-try:
-    from colors import color  # type: ignore
-except ModuleNotFoundError:
-    def color(s, fg=None):
-        _ = fg
-        return str(s)
+# Matches the TX (">>> 00A4...") and RX ("<<< 6F..9000") lines printed by `hf 14a apdu`
+_APDU_LINE_RE = re.compile(r"(>>>|<<<)\s+([0-9A-Fa-f]+)")
+# Hex bytes after "UID:" in the `hf 14a reader` output ("04 A1 B2 C3" or "04A1B2C3")
+_UID_RE = re.compile(r"[0-9A-Fa-f]{2}(?: ?[0-9A-Fa-f]{2})*")
 
-class BRIDGE_PM3(object):
+log = transport_log.getChild("pm3")
+
+class PM3Batch(object):
+    """Queue of independent APDUs executed together by `BRIDGE_PM3.transceive_many()`.
+
+    Use as a context manager; the queue is flushed on exit and `results[i]` holds the
+    response for the i-th queued APDU.
+    """
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.apdus = []
+        self.results = []
+
+    def queue(self, apdu):
+        """Queue an APDU and return its index in `results`."""
+        self.apdus.append(bytes(apdu))
+        return len(self.apdus) - 1
+
+    def flush(self):
+        """Execute all queued APDUs and return the list of responses."""
+        if self.apdus:
+            self.results += self.bridge.transceive_many(self.apdus)
+            self.apdus = []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+class BRIDGE_PM3(Transport):
     """Thin wrapper around a Proxmark3 console to send/receive ISO14443-4 APDUs.
 
     This class builds Proxmark3 commands (e.g., `hf 14a apdu`) and parses the console output.
 
     Attributes:
         pm3: A Proxmark3 Python binding/console instance with `.console(cmd)` and `.grabbed_output`.
-        _debug: When True, prints colored TX/RX traces and status words.
-        recv_buff: Last raw hex string received from PM3 (e.g., "9000" or response data + SW).
+        _debug: When True, logs TX/RX traces on "fmcos.transport.pm3" and lets the pm3 console echo.
+        batch_separator: Command separator understood by the pm3 binding (e.g. "; "), or None
+            when every command needs its own console call.
+        batch_size: Maximum number of APDU commands joined into one console call.
     """
-    def __init__(self, hw_debug, pm3=None):
+    #SELECT APDUs are sent with `-s`, which re-selects the card
+    select_resets_card = True
+
+    def __init__(self, hw_debug, pm3=None, batch_separator=None, batch_size=16):
         # Placeholder for possible future NFC state. Not used directly in this bridge.
         self.nfc = None
 
         # Enable/disable verbose logging.
         self._debug = hw_debug  # fixed typo: self.self._debug -> self._debug
+        if hw_debug:
+            enable_debug(log)
 
         # The Proxmark3 interface/console object is required.
         if pm3 is None:
             raise ValueError("Need a pm3 instance")
         self.pm3 = pm3
-        self.recv_buff = None
+        self.batch_separator = batch_separator
+        self.batch_size = batch_size
+        # Newer pm3 bindings take capture/quiet flags, older ones only the command
+        self._console_flags = True
+
+    def _console(self, cmd):
+        """Run a console command with output captured and (unless debugging) not echoed."""
+        if self._console_flags:
+            try:
+                self.pm3.console(cmd, capture=True, quiet=not self._debug)
+                return self.pm3.grabbed_output
+            except TypeError:
+                self._console_flags = False
+        self.pm3.console(cmd)
+        return self.pm3.grabbed_output
+
+    def _apdu_cmd(self, data, select=False):
+        """Build the `hf 14a apdu` command line for one APDU."""
+        exec_cmd =  "hf 14a apdu -k"  # keep field active
 
-    def recv(self):
-        """Return last captured response from PM3 as bytes.
+        if select:
+            exec_cmd += "s"  # activate field and select card
 
-        Expects `self.recv_buff` to be a hex string as produced by `extract_ret`.
-        """
-        ret_buff = bytes.fromhex(self.recv_buff)
+        exec_cmd += "d "  # full APDU package (data follows)
 
-        if self._debug:
-            if ret_buff[-2:] == b"\x90\x00":
-                print(f"[{color('+', fg='green')}] PM3 <= {self.recv_buff}")
-            else:
-                print(f"[{color('-', fg='red')}] PM3 <= {self.recv_buff}")
+        # Convert APDU to hex string (no spaces)
+        return exec_cmd + bytes(data).hex()
 
-        #Convert to bytes and return
-        return ret_buff
+    def _is_select(self, apdu):
+        """Return True for ISO SELECT APDUs (00 A4 00/04 00), which need the `-s` flag."""
+        return len(apdu) > 5 and apdu[0]==0x00 and apdu[1]==0xA4 and (apdu[2]==0x00 or apdu[2]==0x04) and apdu[3]==0x00
 
     def send(self, data, select=False):
-        """Send an APDU via Proxmark3 `hf 14a apdu` and capture the response.
+        """Send an APDU via Proxmark3 `hf 14a apdu` and return the response hex string.
 
         Args:
             data (bytes|bytearray|list[int]): APDU to send.
@@ -59,64 +113,110 @@ class BRIDGE_PM3(object):
             - `-s` selects the card (useful before a SELECT APDU).
             - `-d` expects a full APDU (CLA INS P1 P2 [Lc Data] [Le]).
         """
-        exec_cmd =  "hf 14a apdu -k"  # keep field active
+        exec_cmd = self._apdu_cmd(data, select)
 
-        if select:
-            exec_cmd += "s"  # activate field and select card
-        
-        exec_cmd += "d "  # full APDU package (data follows)
-
-        # Convert APDU to hex string (no spaces)
-        exec_cmd += bytearray(data).hex()
-
-        if self._debug:
-            print(f"[{color('+', fg='green')}] PM3 => exec_cmd = {color(exec_cmd, fg='yellow')}")
+        log.debug("PM3 => exec_cmd = %s", exec_cmd)
 
         # Execute the command; the PM3 binding is expected to populate `.grabbed_output`.
-        self.pm3.console(exec_cmd)
-        self.recv_buff = self.extract_ret(self.pm3.grabbed_output.split('\n'))
+        recv_hex = self.extract_ret(self._console(exec_cmd))
+
+        log.debug("PM3 <= %s", recv_hex)
+        return recv_hex
 
     def extract_ret(self, ret):
-        """Extract the last APDU response hex string from PM3 console output lines.
+        """Extract the first APDU response hex string from PM3 console output.
 
-        PM3 typically logs APDU RX lines prefixed with "<<< ". We pick the data field.
+        PM3 logs APDU RX lines prefixed with "<<< ". We pick the data field.
 
         Args:
-            ret (Iterable[str]): Lines of console output.
+            ret (str | Iterable[str]): Console output or its lines.
 
         Returns:
             str | None: Hex string of APDU response (data + SW), or None if not found.
         """
-        for line in ret:
-            if line.find("<<< ") != -1:
-                ret_data = line.split(" ")[2]
-                return ret_data
+        if not isinstance(ret, str):
+            ret = "\n".join(ret)
+        for direction, hex_data in _APDU_LINE_RE.findall(ret):
+            if direction == "<<<":
+                return hex_data
         return None
 
-    def sendToNfc(self, data):
-        """Convenience wrapper: auto-enable select for ISO SELECT APDUs.
+    def extract_many(self, output, count):
+        """Map every `>>>` request line in `output` to the `<<<` response that follows it.
 
-        Detects SELECT by checking header: 00 A4 00/04 00, then calls `send(select=True)`.
+        Returns:
+            list[bytes]: `count` responses in request order.
         """
-        enable_select = False
-        if len(data) > 5 and data[0]==0x00 and data[1]==0xA4 and (data[2]==0x00 or data[2]==0x04) and data[3]==0x00:
-            enable_select = True
-        self.send(data, select=enable_select)
+        responses = []
+        pending = False
+        for direction, hex_data in _APDU_LINE_RE.findall(output):
+            if direction == ">>>":
+                if pending:
+                    raise ValueError(f"PM3 returned no response for APDU #{len(responses)}")
+                pending = True
+            elif pending:
+                responses.append(bytes.fromhex(hex_data))
+                pending = False
+        if pending or len(responses) != count:
+            raise ValueError(f"PM3 returned {len(responses)} responses for {count} APDUs")
+        return responses
+
+    def wait_for_card(self, timeout=None, interval=0.1):
+        """Probe for a card with `hf 14a reader` until one answers; False on timeout."""
+        return self._wait_until(True, timeout, interval)
+
+    def wait_for_removal(self, timeout=None, interval=0.1):
+        """Probe with `hf 14a reader` until the card stops answering; False on timeout."""
+        return self._wait_until(False, timeout, interval)
+
+    def batch(self):
+        """Return a `PM3Batch` that queues APDUs and sends them with `transceive_many()`."""
+        return PM3Batch(self)
+
+    def transceive_many(self, apdus):
+        """Send several independent APDUs in as few console calls as possible.
+
+        With `batch_separator` set, up to `batch_size` commands are joined into one console
+        call. The captured output of all calls is parsed in a single pass.
+        """
+        cmds = [self._apdu_cmd(apdu, self._is_select(apdu)) for apdu in apdus]
+        for exec_cmd in cmds:
+            log.debug("PM3 => exec_cmd = %s", exec_cmd)
+
+        if self.batch_separator:
+            step = max(self.batch_size, 1)
+            groups = [self.batch_separator.join(cmds[i:i + step]) for i in range(0, len(cmds), step)]
+        else:
+            groups = cmds
+        output = "\n".join(self._console(group) for group in groups)
+
+        responses = self.extract_many(output, len(apdus))
+        if log.isEnabledFor(logging.DEBUG):
+            for recv_buff in responses:
+                log.debug("PM3 <= %s", recv_buff.hex())
+        return responses
+
+    def transceive(self, apdu):
+        """Send an APDU and return the response bytes.
+
+        SELECT APDUs (00 A4 00/04 00) automatically get the `-s` flag so the card is selected first.
+        """
+        recv_hex = self.send(apdu, select=self._is_select(apdu))
+        if recv_hex == None:
+            raise ValueError("Did not recieve any data from PM3")
+        return bytes.fromhex(recv_hex)
 
     def nfcFindCard(self):
-        """Trigger a 14a inventory and return the UID line or 'noCard'."""
-        self.pm3.console("hf 14a info")
+        """Run a plain 14a anticollision (`hf 14a reader`) and return the UID bytes or 'noCard'.
 
-        for line in self.pm3.grabbed_output.split("\n"):
+        `hf 14a reader` is used rather than `hf 14a info`, which also fingerprints the card
+        and is far too slow to use as a presence probe.
+        """
+        for line in self._console("hf 14a reader").split("\n"):
             if line.find("UID:") != -1:
-                #print(line)
-                return line
+                # e.g. "[+]  UID: 04 A1 B2 C3 D4 E5 F6   ( ONUID, re-used )"
+                match = _UID_RE.search(line[line.find("UID:") + 4:])
+                if match == None:
+                    return "noCard"
+                return bytes.fromhex(match.group(0).replace(" ", ""))
         return "noCard"
-
-    def nfcGetRecData(self):
-        """Get last received data as bytes; raise if nothing is available."""
-        # sleep(0.1)
-        recvdata = self.recv()
-        if recvdata == None:
-            raise ValueError("Did not recieve any data from PM3")
-        return recvdata
\ No newline at end of file
@@ -1,7 +1,10 @@
 import sys
+import math
+import threading
 import serial  # type: ignore
-from time import sleep
 from utils import bytes_to_hexstr
+from transport import Transport, TargetInfo
+from cardlog import transport_log, Hex, enable_debug
 
 # Optional color support for console logs. Install with: `pip install ansicolors`
 try:
@@ -11,7 +14,9 @@ except ModuleNotFoundError:
         _ = fg
         return str(s)
 
-class BRIDGE_PN532(object):
+log = transport_log.getChild("pn532")
+
+class BRIDGE_PN532(Transport):
     """Serial bridge for PN532 to send/receive APDUs over ISO14443.
 
     PN532 frame layout (HSU):
@@ -21,27 +26,84 @@ class BRIDGE_PN532(object):
       - TFI: 0xD4 host->PN532, 0xD5 PN532->host
       - DCS: 0x100 - sum(TFI+Data) (8-bit)
     """
+    #A normal information frame carries 255 bytes: TFI, InDataExchange code, status, data, SW1 SW2
+    max_le = 250
+    #Extended frame header (00 00 FF FF FF LENm LENl LCS) + D4 40 01 in front, DCS + postamble behind
+    frame_headroom = 11
+    frame_tailroom = 2
+
     def __init__(self, com_port, hw_debug):
         self.nfc = None
         self._debug = hw_debug
+        if hw_debug:
+            enable_debug(log)
         self.com_port = com_port
+        #Tg addressed by InDataExchange, and the TargetInfo of the targets from the last InListPassiveTarget
+        self.target = 0x01
+        self.targets = []
+        #Held for a whole command/response exchange, so several target sessions can share the port
+        self.lock = threading.RLock()
         self.NfcReady()
 
-    def recv(self):
-        """Read bytes from PN532 and optionally log them."""
-        data = self.nfc.read(100)
-        sleep(0.05)
-        if self._debug:
-            print(f"[{color('+', fg='green')}] PN532 <= {bytes_to_hexstr(data)}")
+    def _read_exact(self, count):
+        """Read exactly `count` bytes from the serial port or raise on timeout."""
+        data = self.nfc.read(count)
+        if len(data) != count:
+            raise ValueError(f"PN532 read timed out ({len(data)}/{count} bytes)")
         return data
 
+    def recv(self):
+        """Read the next PN532 information frame and return its TFI + data.
+
+        Syncs on the start code (0x00 0xFF), skips ACK frames, validates LCS/DCS and
+        returns as soon as the complete frame has arrived. Both normal and extended
+        (LEN=0xFF 0xFF) frames are handled.
+        """
+        while True:
+            # Sync on start code; the preamble byte is optional on some modules
+            prev = None
+            while True:
+                cur = self._read_exact(1)[0]
+                if prev == 0x00 and cur == 0xFF:
+                    break
+                prev = cur
+
+            length, lcs = self._read_exact(2)
+            if length == 0x00 and lcs == 0xFF:
+                # ACK frame (00 00 FF 00 FF 00), response frame follows
+                self._read_exact(1)
+                log.debug("PN532 <= ACK")
+                continue
+            if length == 0xFF and lcs == 0x00:
+                self._read_exact(1)
+                raise ValueError("PN532 returned NACK")
+
+            if length == 0xFF and lcs == 0xFF:
+                # Extended frame: LENm LENl LCS
+                len_m, len_l, lcs = self._read_exact(3)
+                length = (len_m << 8) | len_l
+                if (len_m + len_l + lcs) & 0xFF:
+                    raise ValueError("PN532 extended frame LCS mismatch")
+            elif (length + lcs) & 0xFF:
+                raise ValueError("PN532 frame LCS mismatch")
+
+            # TFI + data, DCS, postamble
+            body = self._read_exact(length + 2)
+            data = body[:length]
+            if (sum(data) + body[length]) & 0xFF:
+                raise ValueError("PN532 frame DCS mismatch")
+
+            log.debug("PN532 <= %s", Hex(data))
+
+            if data[0] == 0x7F:
+                raise ValueError("PN532 returned an application error frame")
+            return data
+
     def send(self, data):
         """Write bytes to PN532 and optionally log them."""
-        if self._debug:
-            print(f"[{color('+', fg='green')}] PN532 => {bytes_to_hexstr(data)}")
+        log.debug("PN532 => %s", Hex(data))
 
         self.nfc.write(data)
-        sleep(0.05)
 
     def NfcReady(self):
         """Open serial port and initialize PN532 in ISO14443A initiator mode.
@@ -53,6 +115,7 @@ class BRIDGE_PN532(object):
         except:
             print( f"{color('-', fg='red')} Unable to open COM port" )
             sys.exit(-1)
+        self.nfc.reset_input_buffer()
         # Prebuilt PN532 wake-up/initialize frame.
         self.send(b'\x55\x55\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xFF\x03\xFD\xD4\x14\x01\x17\x00')
         self.recv()
@@ -62,7 +125,7 @@ class BRIDGE_PN532(object):
 
         Args:
             data (list[int] | bytes): If `custom_data=False`, this is the APDU payload
-                and will be wrapped with [0xD4, 0x40, 0x01] (TFI, InDataExchange, target 1).
+                and will be wrapped with [0xD4, 0x40, Tg] (TFI, InDataExchange, `self.target`).
                 If `custom_data=True`, then `data` must include TFI (0xD4) and the command.
             custom_data (bool): Set True when providing raw PN532 command bytes.
 
@@ -70,87 +133,219 @@ class BRIDGE_PN532(object):
             bytes: The fully encoded PN532 frame that was sent.
         """
         if not custom_data:
-            data = [0xD4, 0x40, 0x01] + data
-        # Compute LEN (length of TFI+DATA) and DCS (checksum of TFI+DATA)
-        len = 0  # shadows built-in len; kept to avoid behavior change
-        dsum = 0
-        for i in data:
-            len = len + 1
-            dsum = dsum + i
-        # LCS = 0x100 - LEN (mod 256)
-        lcs = 0xFF - len + 0x01
+            data = bytes([0xD4, 0x40, self.target]) + bytes(data)
+        else:
+            data = bytes(data)
         # DCS = 0x100 - sum(TFI+DATA) (mod 256)
-        dcs = 0xFF - dsum % 0x100 + 0x01
+        dcs = -sum(data) & 0xFF
         # Assemble full frame: PREAMBLE+START | LEN LCS | TFI+DATA | DCS | POSTAMBLE
-        redata = b'\x00\x00\xff' + bytes([len, lcs]) + bytes(data) + bytes([dcs, 0x00])
+        redata = self._frame_header(len(data)) + data + bytes([dcs, 0x00])
         self.send(redata)
         return redata
 
-    def nfcFindCard(self):
-        """Search for an ISO14443A card and return UID bytes or 'noCard'."""
-        # sleep(0.1)
-        # InListPassiveTarget (0x4A) with max 1 target, 106 kbps type A
-        self.sendToNfc([0xD4, 0x4A, 0x01, 0x00], custom_data=True)
-        recdata = self.recv()
-        # Response header for InListPassiveTarget is TFI(0xD5) + 0x4B
-        if recdata[11:13] == b'\xd5\x4b':
-            uid = recdata[19:23]
-            return uid
-        else:
-            return 'noCard'
+    def _frame_header(self, length):
+        """PREAMBLE + START | LEN LCS for a frame carrying `length` bytes of TFI+DATA."""
+        if length < 0xFF:
+            # LCS = 0x100 - LEN (mod 256)
+            return bytes([0x00, 0x00, 0xFF, length, -length & 0xFF])
+        # Extended frame: 00 FF FF | LENm LENl | LCS
+        len_m, len_l = length >> 8, length & 0xFF
+        return bytes([0x00, 0x00, 0xFF, 0xFF, 0xFF, len_m, len_l, -(len_m + len_l) & 0xFF])
+
+    def abort(self):
+        """Send an ACK frame, which makes the PN532 abort the command in progress."""
+        self.send(b'\x00\x00\xff\x00\xff\x00')
+
+    def nfcFindCard(self, max_targets=1):
+        """Search for ISO14443A cards and return the UID bytes of the first one or 'noCard'.
+
+        Up to `max_targets` (1 or 2) cards are activated; their `TargetInfo` (full UID, ATQA,
+        SAK, ATS) end up in `self.targets` and InDataExchange goes to the first one, with
+        `max_lc` bounded by that card's FSC.
+        """
+        with self.lock:
+            # InListPassiveTarget (0x4A) with MaxTg targets, 106 kbps type A
+            self.sendToNfc([0xD4, 0x4A, max_targets, 0x00], custom_data=True)
+            try:
+                recdata = self.recv()
+            except ValueError:
+                # Nothing in the field before the serial timeout, cancel the pending poll
+                self.abort()
+                recdata = b''
+            self.targets = self._parse_targets(recdata[3:], recdata[2]) if recdata[0:2] == b'\xd5\x4b' else []
+            if not self.targets:
+                self.use_target(None)
+                return 'noCard'
+            self.use_target(self.targets[0])
+            return self.targets[0].uid
+
+    @staticmethod
+    def _parse_targets(data, count):
+        """TargetInfo list from the target data of InListPassiveTarget / InAutoPoll (106 kbps type A)."""
+        # Per target: Tg | SENS_RES(2) | SEL_RES | NFCIDLength | NFCID | [ATS (TL counts itself)]
+        targets = []
+        pos = 0
+        for _ in range(count):
+            if pos + 5 > len(data):
+                break
+            tg, atqa, sak, uid_len = data[pos], data[pos + 1:pos + 3], data[pos + 3], data[pos + 4]
+            pos += 5
+            uid = data[pos:pos + uid_len]
+            pos += uid_len
+            if len(uid) != uid_len:
+                raise ValueError("PN532 target data truncated")
+            ats = None
+            if sak & 0x20 and pos < len(data):
+                ats = data[pos:pos + data[pos]]
+                pos += data[pos]
+            targets.append(TargetInfo(tg, uid, atqa, sak, ats))
+        return targets
+
+    def use_target(self, info):
+        """Address InDataExchange to the target described by `info` (None: Tg 1, nothing known)."""
+        self.target = 0x01 if info == None else info.tg
+        self.target_info = info
+        self.max_lc = 0xFF if info == None else info.max_lc
+
+    def list_targets(self, max_targets=2):
+        """Activate up to two cards in the field and return a `PN532Target` for each."""
+        self.nfcFindCard(max_targets)
+        return [PN532Target(self, info) for info in self.targets]
+
+    def wait_for_card(self, timeout=None, interval=None):
+        """Block until an ISO14443-4A card is found, using the PN532's InAutoPoll loop.
+
+        The PN532 polls every 150 ms by itself and answers as soon as a target shows up,
+        so there is no host-side sleep/poll loop.
+
+        Args:
+            timeout (float|None): Seconds to wait, None polls forever.
+
+        Returns:
+            bool: True when a card was activated (as target 1), False on timeout.
+        """
+        # InAutoPoll (0x60): PollNr, Period (x150 ms), Type 0x20 = passive 106 kbps ISO14443-4A
+        poll_nr = 0xFF if timeout is None else max(1, min(0xFE, math.ceil(timeout / 0.15)))
+        with self.lock:
+            self.use_target(None)
+            self.targets = []
+            self.sendToNfc([0xD4, 0x60, poll_nr, 0x01, 0x20], custom_data=True)
+
+            serial_timeout = self.nfc.timeout
+            self.nfc.timeout = None if timeout is None else timeout + 1
+            try:
+                recdata = self.recv()
+            except ValueError:
+                self.abort()
+                return False
+            finally:
+                self.nfc.timeout = serial_timeout
+
+        # Response is D5 61 | NbTg | Type | Len | Tg | SENS_RES(2) | SEL_RES | NFCIDLength | NFCID | ATS...
+        if recdata[0:2] != b'\xd5\x61' or recdata[2] == 0:
+            return False
+        with self.lock:
+            self.targets = self._parse_targets(recdata[5:5 + recdata[4]], 1)
+            if self.targets:
+                self.use_target(self.targets[0])
+        return True
+
+    def card_present(self):
+        """Check that the activated card still answers (Diagnose 0x06, card presence detection)."""
+        with self.lock:
+            self.sendToNfc([0xD4, 0x00, 0x06], custom_data=True)
+            try:
+                recdata = self.recv()
+            except ValueError:
+                return False
+        return recdata[0:2] == b'\xd5\x01' and recdata[2] == 0x00
 
     def nfcGetRawRecData(self):
         """Return raw PN532 data payload (excluding TFI/command/status)."""
         recvdata = self.recv()
-        try:
-            data_len = recvdata[9]
-            recvdata = recvdata[11:11 + data_len]
-            if recvdata == 'error':
-                raise ValueError("nfcGetRawRecData returned error [1]")
-            return recvdata[3:]
-        except:
-            raise ValueError("nfcGetRawRecData returned error [2]")
+        if len(recvdata) < 3:
+            raise ValueError("nfcGetRawRecData returned error [1]")
+        return recvdata[3:]
 
     def nfcGetRecData(self):
         """Return data portion from an InDataExchange response; validate status."""
-        # sleep(0.1)
         recvdata = self.recv()
-        try:
-            data_len = recvdata[9]
-            recvdata = recvdata[11:11 + data_len]
-            if recvdata == 'error' or recvdata[0:3] != b'\xd5\x41\x00':
-                raise ValueError("nfcGetRecData returned error [1]")
+        if recvdata[0:3] != b'\xd5\x41\x00':
+            raise ValueError(f"nfcGetRecData returned error [{bytes_to_hexstr(recvdata[0:3])}]")
+        return recvdata[3:]
 
-            return recvdata[3:]
-        except:
-            raise ValueError("nfcGetRecData returned error [2]")
+    def transceive_apdu(self, builder):
+        """Wrap the builder's APDU in an InDataExchange frame in place and exchange it."""
+        apdu = builder.apdu()
+        log.debug("PN532_FMCOS => %s", Hex(apdu))
 
-    def sendRaw(self, raw_bytes):   #This is used for PN532
-        """Send raw bytes as an APDU via InDataExchange and return the response.
+        header = self._frame_header(len(apdu) + 3)
+        head = len(header) + 3
+        frame = builder.frame(head, 2)
+        with self.lock:
+            frame[:len(header)] = header
+            frame[len(header):head] = bytes([0xD4, 0x40, self.target])
+            # DCS over TFI + InDataExchange + Tg + APDU
+            frame[-2] = -(0xD4 + 0x40 + self.target + sum(apdu)) & 0xFF
+            frame[-1] = 0x00
+            self.send(frame)
+            recdata = self.nfcGetRecData()
 
-        Args:
-            raw_bytes (str|bytes|list[int]):
-                - hex str (spaces allowed), e.g., '00 A4 04 00'
-                - bytes, e.g., b"\x00\xA4\x04\x00"
-                - list of ints [0..255]
-        """
-        context = []
-
-        if(isinstance(raw_bytes, str)):
-            context += list( bytes.fromhex(raw_bytes.replace(" ", "")) )
-        elif (isinstance(raw_bytes, bytes)):
-            context += list(raw_bytes)
-        elif(isinstance(raw_bytes, list)):
-            context += raw_bytes
-        else:
-            raise ValueError("Dont know how to process raw_bytes")
+        log.debug("PN532_RAW => %s", Hex(recdata))
+        return recdata
+
+    def transceive(self, apdu):
+        """Send an APDU via InDataExchange (to `self.target`) and return the response."""
+        log.debug("PN532_FMCOS => %s", Hex(apdu))
+
+        with self.lock:
+            self.sendToNfc(apdu)
+            recdata = self.nfcGetRecData()
+
+        log.debug("PN532_RAW => %s", Hex(recdata))
+        return recdata
+
+class PN532Target(Transport):
+    """One of the cards activated by `BRIDGE_PN532.list_targets()`, as a transport of its own.
+
+    Each target gets its own `FMCOS` session; exchanges take the bridge lock and address
+    InDataExchange to this target's Tg, so sessions running in different threads interleave
+    APDU by APDU. The PN532 runs one exchange at a time, so what overlaps is the host side
+    of a session (MAC / 3DES, plan steps, framing) with the other card's exchange.
 
-        if self._debug:
-            print(f"[{color('=', fg='yellow')}] PN532_FMCOS => " + bytes_to_hexstr(bytes(context)) )
+    `nfcFindCard()` reports the UID from the listing instead of polling again, since a new
+    InListPassiveTarget would release the other target.
+    """
+    max_le = BRIDGE_PN532.max_le
+    frame_headroom = BRIDGE_PN532.frame_headroom
+    frame_tailroom = BRIDGE_PN532.frame_tailroom
+
+    def __init__(self, bridge, info):
+        self.bridge = bridge
+        self.target_info = info
+        self.tg = info.tg
+        self.uid = info.uid
+        self.max_lc = info.max_lc
+
+    def __repr__(self):
+        return f"PN532Target(Tg={self.tg}, UID={bytes_to_hexstr(self.uid)})"
 
-        self.sendToNfc(context)
-        recdata = self.nfcGetRecData()
+    def transceive(self, apdu):
+        with self.bridge.lock:
+            self.bridge.use_target(self.target_info)
+            return self.bridge.transceive(apdu)
+
+    def transceive_apdu(self, builder):
+        with self.bridge.lock:
+            self.bridge.use_target(self.target_info)
+            return self.bridge.transceive_apdu(builder)
+
+    def nfcFindCard(self):
+        """UID of this target while it is still listed by the bridge, otherwise 'noCard'."""
+        return self.uid if self.target_info in self.bridge.targets else 'noCard'
 
-        if self._debug:
-            print(f"[{color('=', fg='yellow')}] PN532_RAW => " + bytes_to_hexstr(recdata))
-        return recdata
\ No newline at end of file
+    def card_present(self):
+        """Check that this target still answers (Diagnose 0x06 on the bridge)."""
+        with self.bridge.lock:
+            self.bridge.use_target(self.target_info)
+            return self.bridge.card_present()
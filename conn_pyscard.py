@@ -1,18 +1,12 @@
-import sys
-import time
-from utils import bytes_to_hexstr
+import threading
+from transport import Transport
+from cardlog import transport_log, Hex, enable_debug
 # Optional pyscard imports; annotate types to avoid unresolved warnings if not installed
 from smartcard.System import readers  # type: ignore
 from smartcard.CardMonitoring import CardMonitor, CardObserver  # type: ignore
 from smartcard.util import toHexString  # type: ignore
 
-# Optional color support .. `pip install ansicolors`
-try:
-    from colors import color  # type: ignore
-except ModuleNotFoundError:
-    def color(s, fg=None):
-        _ = fg
-        return str(s)
+log = transport_log.getChild("pyscard")
 
 class PrintObserver(CardObserver):
     """Card presence observer that tracks insertion/removal and opens a connection."""
@@ -20,42 +14,57 @@ class PrintObserver(CardObserver):
         self.bridge = bridge
 
     def update(self, observable, actions):
-        """pyscard callback when cards are added/removed."""
+        """pyscard callback when cards are added/removed (events for other readers are ignored)."""
         (addedcards, removedcards) = actions
-        if addedcards:
-            self.bridge._has_card = True
-            self.bridge.conn.connect()
-
-        if removedcards:
-            self.bridge._has_card = False
-
-class BRIDGE_PYSCARD(object):
+        reader_name = self.bridge.reader_name
+        if any(card.reader == reader_name for card in removedcards):
+            self.bridge._set_card_state(False)
+
+        if any(card.reader == reader_name for card in addedcards):
+            try:
+                self.bridge.conn.connect()
+            except Exception:
+                # Card left again before we could connect; the removal event follows
+                return
+            self.bridge._set_card_state(True)
+
+class BRIDGE_PYSCARD(Transport):
     """Bridge using pyscard to send APDUs to a smartcard reader.
 
     Attributes:
-        _debug: Enable TX/RX logging when True.
+        _debug: Enable TX/RX logging on "fmcos.transport.pyscard" when True.
         conn: pyscard connection object created from a selected reader.
         _has_card: Tracks if a card is currently present (from CardMonitor).
+        reader_name: Name of the reader this bridge is bound to.
     """
     def __init__(self, reader_string, hw_debug):
         self.nfc = None
         self._debug = hw_debug
-        self.recv_buff = None
+        if hw_debug:
+            enable_debug(log)
         self._has_card = False
+        self.reader_name = None
+        # Set/cleared by the CardMonitor observer thread, waited on by wait_for_card()/wait_for_removal()
+        self._card_inserted = threading.Event()
+        self._card_removed = threading.Event()
+        self._card_removed.set()
 
         if not self.connect_reader(reader_string):
             raise ValueError(f"Unable to find {reader_string} reader")
 
     def connect_reader(self, find_me):
-        """Find a reader whose name contains `find_me` and start monitoring."""
+        """Find the reader named `find_me` (else the first whose name contains it) and start monitoring."""
         r = readers()
+        #An exact name wins, so several readers of the same model can be told apart
+        r = sorted(r, key=lambda reader: str(reader) != find_me)
         for i in range(len(r)):
             if str(r[i]).find(find_me) != -1:
                 self.conn = r[i].createConnection()
+                self.reader_name = str(r[i])
 
                 try:
                     self.conn.connect()
-                    self._has_card = True
+                    self._set_card_state(True)
                 except:
                     pass
 
@@ -66,57 +75,52 @@ class BRIDGE_PYSCARD(object):
                 return True
         return False
 
-    def recv(self):
-        """Return the last APDU response (bytes) and optionally log SW1SW2."""
-        if self._debug:
-            if self.recv_buff[-2:] == b"\x90\x00":
-                print(f"[{color('+', fg='green')}] PYSCARD <= {bytes_to_hexstr(self.recv_buff)}")
-            else:
-                print(f"[{color('-', fg='red')}] PYSCARD <= {bytes_to_hexstr(self.recv_buff)}")
+    def transceive(self, apdu):
+        """Transmit APDU bytes and return response data + SW1 SW2 as bytes."""
+        log.debug("PYSCARD => send = %s", Hex(apdu))
 
-        return self.recv_buff
+        data, sw1, sw2 = self.conn.transmit(list(apdu))
+        recv_buff = bytes(data + [sw1, sw2])
 
-    def send(self, data):
-        """Transmit APDU bytes and store response+status in `recv_buff`."""
-        if self._debug:
-            print_data = bytes_to_hexstr(bytes(data))
-            print(f"[{color('+', fg='green')}] PYSCARD => send = {color(print_data, fg='yellow')}")
+        log.debug("PYSCARD <= %s", Hex(recv_buff))
 
-        data, sw1, sw2 = self.conn.transmit(data)
-        self.recv_buff = bytes(data + [sw1, sw2])
+        return recv_buff
 
-    def sendToNfc(self, data):
-        """Compatibility shim to match other bridges' interface."""
-        self.send(data)
+    def _set_card_state(self, present):
+        """Record card insertion/removal and wake up waiters."""
+        self._has_card = present
+        if present:
+            self._card_removed.clear()
+            self._card_inserted.set()
+        else:
+            self._card_inserted.clear()
+            self._card_removed.set()
 
     def nfcFindCard(self):
-        """Return True if a card is present, otherwise 'noCard'."""
-        time.sleep(1)
-        if self._has_card:
-            return True
+        """Return the card UID (PC/SC GET DATA) if a card is present, otherwise 'noCard'.
+
+        Readers without the PC/SC GET DATA pseudo-APDU also report 'noCard', use `card_present()`
+        to tell whether a card is in the field.
+        """
+        if not self._has_card:
+            return "noCard"
+        try:
+            # PC/SC part 3 GET DATA: FF CA 00 00 00 returns the UID
+            ret = self.transceive(b"\xFF\xCA\x00\x00\x00")
+        except Exception:
+            return "noCard"
+        if len(ret) > 2 and ret[-2:] == b"\x90\x00":
+            return ret[:-2]
         return "noCard"
 
-    def nfcGetRecData(self):
-        """Return last received bytes, raising if none."""
-        recvdata = self.recv()
-        if recvdata == None:
-            raise ValueError("Did not recieve any data from PYSCARD")
-        return recvdata
-
-    def sendRaw(self, raw_bytes):
-        """Send raw APDU in multiple input forms (hex str/bytes/list[int])."""
-        context = []
-
-        if(isinstance(raw_bytes, str)):
-            context += list( bytes.fromhex(raw_bytes.replace(" ", "")) )
-        elif (isinstance(raw_bytes, bytes)):
-            context += list(raw_bytes)
-        elif(isinstance(raw_bytes, list)):
-            context += raw_bytes
-        else:
-            raise ValueError("Dont know how to process raw_bytes")
+    def card_present(self):
+        """Return True if the CardMonitor reports a card in this reader."""
+        return self._has_card
 
-        self.send(context)
-        recdata = self.recv()
+    def wait_for_card(self, timeout=None, interval=None):
+        """Block until the CardMonitor reports a card in this reader; False on timeout."""
+        return self._card_inserted.wait(timeout)
 
-        return recdata
\ No newline at end of file
+    def wait_for_removal(self, timeout=None, interval=None):
+        """Block until the CardMonitor reports the card removed; False on timeout."""
+        return self._card_removed.wait(timeout)
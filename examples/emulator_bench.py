@@ -0,0 +1,155 @@
+"""Hardware-free FMCOS scenarios and benchmark on top of the card emulator.
+
+Runs a personalisation (DF, key file, keys, protected files, wallet) followed by
+file and wallet transactions against `BRIDGE_EMULATOR`, then times repeated runs.
+
+Usage:
+    python emulator_bench.py [iterations]
+"""
+import os
+import sys
+import time
+from conn_emulator import BRIDGE_EMULATOR
+from fmcos import CPUFileType, KeyType, BalanceType, Protection, FMCOS
+from cardprofile import compile_profile
+from utils import assert_success, assert_failure
+
+# optional color support .. `pip install ansicolors`
+try:
+    from colors import color  # type: ignore
+except ModuleNotFoundError:
+    def color(s, fg=None):
+        _ = fg
+        return str(s)
+
+DEBUG_FMCOS = False
+DEBUG_EMULATOR = False
+
+internal_key = b"\x34" * 16
+line_protection_key = b"\x36" * 16
+external_auth_key = b"\x39" * 16
+purchase_key = b"\x3e" * 16
+credit_key = b"\x3f" * 16
+pin_code = b"\x12\x34\x56"
+terminal_id = b"\x11\x22\x33\x44\x55\x66"
+
+def personalise(exam):
+    ret = exam.cmd_select('3f00')
+    assert_success(exam, ret)
+    ret = exam.cmd_erase_df()
+    assert_success(exam, ret)
+
+    ret = exam.cmd_create_directory(file_id=0x3f01, file_space=0x1000, create_permissions=0xf0, erase_permission=0xf0, app_id=0x95, df_name=b"benchTest")
+    assert_success(exam, ret)
+    ret = exam.cmd_select(name=b"benchTest")
+    assert_success(exam, ret)
+    ret = exam.cmd_create_keyfile(file_id=0x0001, file_space=0x200, df_sid=0x95, key_permission=0xf0)
+    assert_success(exam, ret)
+
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.ExternalAuthenticationKey, usage_rights=0xf0, \
+                        change_rights=0xf0, followup_status=0xaa, error_counter=0xff, key=external_auth_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.FileLineProtectionKey, usage_rights=0xf0, \
+                        change_rights=0xf0, error_counter=0xff, key=line_protection_key, \
+                        extauth_key=external_auth_key, protection=Protection.LineProtectEncrypt)
+    assert_success(exam, ret)
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.InternalKey, usage_rights=0xf0, \
+                        change_rights=0xf0, key_version=0x00, algo_id=0x01, key=internal_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.PurchaseKey, usage_rights=0xf0, \
+                        change_rights=0xf0, key_version=0x00, algo_id=0x01, key=purchase_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.CreditKey, usage_rights=0xf0, \
+                        change_rights=0xf0, key_version=0x00, algo_id=0x01, key=credit_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_write_key(key_add_update=0x01, key_id=0x00, key_type=KeyType.PinKey, usage_rights=0xf0, \
+                        followup_status=0x01, error_counter=0x33, key=pin_code)
+    assert_success(exam, ret)
+
+    ret = exam.cmd_create_file(file_id=0x0002, file_type=CPUFileType.BinFile, file_size=0x50, read_perm=0xf0, write_perm=0xf0, access_rights=0xff)
+    assert_success(exam, ret)
+    ret = exam.cmd_create_file(file_id=0x0003, file_type=CPUFileType.BinFile, file_size=0x50, read_perm=0xf0, write_perm=0xf0, access_rights=0x7f, protection=Protection.LineProtect)
+    assert_success(exam, ret)
+    ret = exam.cmd_create_file(file_id=0x0004, file_type=CPUFileType.BinFile, file_size=0x50, read_perm=0xf0, write_perm=0xf0, access_rights=0x7f, protection=Protection.LineProtectEncrypt)
+    assert_success(exam, ret)
+    ret = exam.cmd_create_file(file_id=0x0006, file_type=CPUFileType.VariableLength, file_size=0x50, read_perm=0xf0, write_perm=0xf0, access_rights=0xff)
+    assert_success(exam, ret)
+    ret = exam.cmd_create_file(file_id=0x0018, file_type=CPUFileType.LoopFile, file_size=0x0517, read_perm=0xf0, write_perm=0xef, access_rights=0xff)
+    assert_success(exam, ret)
+    ret = exam.cmd_create_edep(balance_type=BalanceType.Wallet, usage_rights=0xf0, loop_file_id=0x18)
+    assert_success(exam, ret)
+
+def file_scenario(exam):
+    for file_id, protection in ((0x0002, None), (0x0003, Protection.LineProtect), (0x0004, Protection.LineProtectEncrypt)):
+        ret = exam.cmd_select(f"{file_id:04x}")
+        assert_success(exam, ret)
+        key = line_protection_key if protection else None
+        ret = exam.cmd_update_binary(p1=0, p2=0, data=b"emulated binfile", key=key, protection=protection)
+        assert_success(exam, ret)
+        ret = exam.cmd_read_binary(p1=0, p2=0, read_length=16, key=key, protection=protection)
+        assert ret[:16] == b"emulated binfile", f"Read back mismatch on {file_id:04x}"
+
+    #Streamed read of a whole protected file, MAC checked per chunk
+    image = b"".join(exam.read_file('0004', key=line_protection_key, protection=Protection.LineProtectEncrypt))
+    assert image[:16] == b"emulated binfile" and len(image) == 0x50, "read_file mismatch"
+
+    ret = exam.cmd_append_record(file_id=0x06, data=b"record one", use_tlv=True)
+    assert_success(exam, ret)
+    ret = exam.cmd_read_record(record_number=1, file_id=0x06, read_length=10, has_tlv=True)
+    assert ret[:10] == b"record one", "Record read back mismatch"
+
+    #Protected file written without MAC must be refused
+    ret = exam.cmd_select('0003')
+    assert_success(exam, ret)
+    ret = exam.cmd_update_binary(p1=0, p2=0, data=b"no mac")
+    assert_failure(exam, ret)
+
+def wallet_scenario(exam):
+    ret = exam.cmd_select(name=b"benchTest")
+    assert_success(exam, ret)
+    ret = exam.cmd_verify_pin(key_id=0, pin_code=pin_code)
+    assert_success(exam, ret)
+    ret = exam.cmd_add_credit(balance_type=BalanceType.Wallet, key_id=0, amount=1000, terminal_id=terminal_id, \
+                        credit_key=credit_key, internal_key=internal_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_purchase_wallet(key_id=0, amount=250, terminal_id=terminal_id, purchase_key=purchase_key, internal_key=internal_key)
+    assert_success(exam, ret)
+    ret = exam.cmd_get_balance(BalanceType.Wallet)
+    assert_success(exam, ret)
+    assert int.from_bytes(ret[:4], "big") == 750, "Unexpected wallet balance"
+
+    #Most recent transaction log entry is the purchase
+    ret = exam.cmd_read_record(record_number=1, file_id=0x18, read_length=0x17)
+    assert ret[9] == 0x06, "Purchase was not logged"
+
+def profile_scenario(exam):
+    """Personalise from profiles/bench.json and check what the metadata cache learnt on the way."""
+    exam.nfcFindCard()
+    compile_profile(os.path.join(os.path.dirname(__file__), "profiles", "bench.json")).run(exam)
+    assert exam.selected_path != None, "Selection lost after CREATE DF"
+    info = exam.file_info("3F00/3F01/0002")
+    assert info != None and info.file_type == CPUFileType.BinFile, "EF created after CREATE DF is not in the metadata cache"
+    assert exam.file_info("3F00/3F01/3F02") != None, "Child DF is not in the metadata cache"
+
+def run(exam):
+    personalise(exam)
+    file_scenario(exam)
+    wallet_scenario(exam)
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    hw_conn = BRIDGE_EMULATOR(hw_debug=DEBUG_EMULATOR)
+    exam = FMCOS(hw_conn=hw_conn, fmcos_debug=DEBUG_FMCOS)
+
+    run(exam)
+    profile_scenario(FMCOS(hw_conn=BRIDGE_EMULATOR(hw_debug=DEBUG_EMULATOR), fmcos_debug=DEBUG_FMCOS))
+    print(f"[{color('+', fg='green')}] Scenarios passed ({hw_conn.apdu_count} APDUs per run)")
+
+    hw_conn.apdu_count = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run(exam)
+    elapsed = time.perf_counter() - start
+    print(f"[{color('=', fg='yellow')}] {iterations} runs in {elapsed:.3f}s, " \
+          f"{hw_conn.apdu_count / elapsed:.0f} APDU/s, {elapsed / hw_conn.apdu_count * 1e6:.1f} us/APDU")
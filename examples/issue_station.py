@@ -0,0 +1,62 @@
+"""Issue cards from a profile on several readers at once.
+
+Every PC/SC reader whose name contains --match and every PN532 given with
+--pn532 gets its own worker; cards presented to any of them take the next job.
+
+Usage:
+    python issue_station.py profiles/bench.json --count 100 --match ACR122
+    python issue_station.py profiles/bench.json --count 100 --pn532 COM11 COM12
+    python issue_station.py profiles/bench.json --count 100 --pn532 COM11 --targets 2
+"""
+import sys
+import logging
+import argparse
+from station import IssuanceStation, discover_pyscard, discover_pn532
+from cardprofile import compile_profile, ProfileError
+from cardlog import LOG_FORMAT
+
+def parseCli():
+    """Parse CLI arguments."""
+    parser = argparse.ArgumentParser(description='FMCOS multi-reader issuance station')
+    parser.add_argument('profile', help="Card profile (.json, or .yaml with PyYAML)")
+    parser.add_argument('--count', dest="count", type=int, required=True, help="Number of cards to issue")
+    parser.add_argument('--match', dest="match", default=None, help="Use the PC/SC readers whose name contains this")
+    parser.add_argument('--pn532', dest="pn532", nargs="*", default=None, help="PN532 COM ports (none listed: every serial port)")
+    parser.add_argument('--targets', dest="targets", type=int, default=1, choices=(1, 2), help="Cards issued together per PN532 field")
+    parser.add_argument('--retries', dest="retries", type=int, default=1, help="Retries of a failed card")
+    return parser.parse_args()
+
+def main():
+    args = parseCli()
+    try:
+        plan = compile_profile(args.profile)
+    except ProfileError as e:
+        print(e)
+        return 1
+
+    logging.basicConfig(format=LOG_FORMAT)
+    logging.getLogger("fmcos.station").setLevel(logging.INFO)
+
+    readers = []
+    if args.match != None:
+        readers += discover_pyscard(args.match)
+    if args.pn532 != None:
+        readers += discover_pn532(args.pn532 or None, targets=args.targets)
+    if not readers:
+        print("No readers found, use --match and/or --pn532")
+        return 1
+    print(f"{len(readers)} readers: {', '.join(spec.name for spec in readers)}")
+
+    def issue(fmcos, job):
+        plan.run(fmcos)
+        return fmcos.card_uid
+
+    station = IssuanceStation(readers, retries=args.retries)
+    station.run(issue, jobs=range(args.count))
+    print(station.report())
+    for job, error in station.failed_jobs:
+        print(f"Card {job} not issued: {error}")
+    return 0 if not station.failed_jobs else 2
+
+if __name__ == '__main__':
+    sys.exit(main())
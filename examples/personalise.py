@@ -0,0 +1,87 @@
+"""Issue cards from a declarative card profile.
+
+Validates the profile offline, prints the compiled plan and runs it on every
+card presented to the reader, one session per card.
+
+Usage:
+    python personalise.py profiles/bench.json --dry-run
+    python personalise.py profiles/bench.json --transport emulator --count 1
+    python personalise.py profiles/bench.json --transport pn532 --port COM11
+"""
+import sys
+import time
+import argparse
+from transport import open_transport
+from fmcos import FMCOS
+from cardprofile import compile_profile, ProfileError
+from status_words import CardError
+
+# optional color support .. `pip install ansicolors`
+try:
+    from colors import color  # type: ignore
+except ModuleNotFoundError:
+    def color(s, fg=None):
+        _ = fg
+        return str(s)
+
+DEBUG_FMCOS = False
+DEBUG_READER = False
+
+def parseCli():
+    """Parse CLI arguments."""
+    parser = argparse.ArgumentParser(description='FMCOS card profile personalisation')
+    parser.add_argument('profile', help="Card profile (.json, or .yaml with PyYAML)")
+    parser.add_argument('--dry-run', dest="dry_run", action="store_true", help="Validate and print the plan only")
+    parser.add_argument('--transport', dest="transport", default="pn532", help="Reader backend (pn532, pyscard, pm3, emulator)")
+    parser.add_argument('--port', dest="port", default="COM11", help="COM port (pn532) or reader name (pyscard)")
+    parser.add_argument('--count', dest="count", type=int, default=0, help="Stop after this many cards (0 = until Ctrl+C)")
+    return parser.parse_args()
+
+def open_reader(args):
+    """Open the reader backend selected on the command line."""
+    match args.transport:
+        case 'pn532':
+            return open_transport("pn532", com_port=args.port, hw_debug=DEBUG_READER)
+        case 'pyscard':
+            return open_transport("pyscard", reader_string=args.port, hw_debug=DEBUG_READER)
+        case _:
+            return open_transport(args.transport, hw_debug=DEBUG_READER)
+
+def main():
+    args = parseCli()
+    try:
+        plan = compile_profile(args.profile)
+    except ProfileError as e:
+        print(f"[{color('-', fg='red')}] {e}")
+        return 1
+
+    print(plan)
+    print(f"[{color('=', fg='yellow')}] {len(plan)} steps, {plan.count('cmd_select')} SELECTs, " \
+          f"{plan.count('cmd_external_authenticate') + plan.count('cmd_verify_pin')} authentications")
+    if args.dry_run:
+        return 0
+
+    exam = FMCOS(hw_conn=open_reader(args), fmcos_debug=DEBUG_FMCOS)
+    issued = 0
+    try:
+        while True:
+            print(f"[{color('=', fg='yellow')}] Present a card...")
+            exam.wait_for_card()
+            exam.nfcFindCard()
+            start = time.perf_counter()
+            try:
+                plan.run(exam)
+            except CardError as e:
+                print(f"[{color('-', fg='red')}] {e}")
+            else:
+                issued += 1
+                print(f"[{color('+', fg='green')}] Card {issued} issued in {time.perf_counter() - start:.3f}s")
+                if issued == args.count:
+                    break
+            exam.wait_for_removal()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,19 +35,11 @@ except ModuleNotFoundError:
         _ = fg
         return str(s)
     
-def waitForCard(max_tries=5):
-    """Poll for a card up to max_tries. Return True if found, else False."""
+def waitForCard(timeout=5):
+    """Wait up to `timeout` seconds for a card. Return True if found, else False."""
     global pm3_conn, fmcos_conn
 
-    tries = 0
-    while (fmcos_conn.nfcFindCard() == 'noCard'):
-        print('noCard')
-        tries += 1
-        if tries >= max_tries: break
-
-    if tries >= max_tries:
-        return False
-    return True
+    return fmcos_conn.wait_for_card(timeout)
 
 def parseCli():
     """Parse CLI arguments for the demo commands."""
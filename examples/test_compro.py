@@ -49,8 +49,7 @@ if __name__ == '__main__':
 
         elif inp.find('select') != -1:
             try:
-                while (exam.nfcFindCard() == 'noCard'):
-                    print('noCard')
+                exam.wait_for_card()
 
                 selections = inp.split(" ")[1:]
 
@@ -60,8 +59,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "reset":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f00')
@@ -76,8 +74,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "setup":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 #exam.simulation(enabled=True)
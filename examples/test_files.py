@@ -50,8 +50,7 @@ if __name__ == '__main__':
 
         elif inp.find('select') != -1:
             try:
-                while (exam.nfcFindCard() == 'noCard'):
-                    print('noCard')
+                exam.wait_for_card()
 
                 selections = inp.split(" ")[1:]
 
@@ -61,8 +60,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "reset":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f00')
@@ -74,8 +72,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "setup":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 #===============================================================================================================
@@ -212,8 +209,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "write_binary":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -238,8 +234,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "write_loop":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -264,8 +259,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "write_record":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -303,8 +297,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "read_binary":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -331,8 +324,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "read_record":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -352,8 +344,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "read_loop":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f01')
@@ -363,6 +354,9 @@ if __name__ == '__main__':
                 assert_success(exam, ret)
                 print(f"Data: {bytes_to_hexstr(ret[:-2])}\n")
 
+                for i, record in enumerate(exam.read_all_records(file_id=0x0a, record_length=0x10)):
+                    print(f"Record {i + 1}: {bytes_to_hexstr(record)}")
+
                 ret = exam.cmd_read_record(record_number=0x01, file_id=0x0b, key=line_protection_key, protection=Protection.LineProtect)
                 assert_success(exam, ret)
                 print(f"Data: {bytes_to_hexstr(ret[:-6])} MAC => {bytes_to_hexstr(ret[-6:-2])}\n")
@@ -373,8 +367,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "card_block":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"blockTest")
@@ -390,8 +383,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "app_block":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"blockTest")
@@ -407,8 +399,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "app_unblock":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"blockTest")
@@ -1,6 +1,6 @@
 """MAC helper test vectors for DES/3DES MAC routines in FMCOS.
 
-Executes fmcos_3des_mac on known inputs and asserts expected 4-byte outputs.
+Executes fmcos_3des_mac / fmcos_des_mac / fmcos_mac_many on known inputs and asserts expected 4-byte outputs.
 Does not require a physical card; uses a dummy hw_conn object.
 """
 import sys
@@ -17,7 +17,7 @@ if __name__ == '__main__':
     class _Dummy:
         def nfcFindCard(self): return None
         def nfcGetRecData(self): return b"\x90\x00"
-        def sendToNfc(self, *_a, **_k): pass
+        def transceive(self, _apdu): return b"\x90\x00"
     exam = FMCOS(hw_conn=_Dummy(), fmcos_debug=DEBUG_FMCOS)
 
     key_all_ffs = b"\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff"
@@ -50,3 +50,14 @@ if __name__ == '__main__':
                             iv=b"\x88\xbb\xe4\xe3\x00\x00\x00\x00", key=b"\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff")
     print(bytes_to_hexstr(ret))
     assert ret == b"\xae\x8d\x87\x74", f"MAC does not match"
+
+    print("->")
+    bufs = [b"\x11\x22\x33\x44\x55\x66\x77\x88\x99\x00\xaa\xbb\xcc\xdd\xee\xff", b"\x04\xb0\x00\x00\x04"]
+    ret = exam.fmcos_mac_many(bufs=bufs, iv=b"\xd0\xfe\x4f\xb9\x00\x00\x00\x00", key=key_all_ffs)
+    print(' | '.join(bytes_to_hexstr(mac) for mac in ret))
+    assert ret == [b"\x8d\x31\x85\x77", b"\xf0\x9c\x8a\x19"], f"MAC does not match"
+
+    print("->")
+    ret = exam.fmcos_des_mac(buf=b"\x00\x00\x03\xe8\x02\x11\x22\x33\x44\x55\x66", key=b"\x36\x36\x36\x36\x36\x36\x36\x36")
+    print(bytes_to_hexstr(ret))
+    assert ret == b"\xfe\x0b\xe3\x6a", f"MAC does not match"
@@ -59,8 +59,7 @@ if __name__ == '__main__':
 
         elif inp.find('select') != -1:
             try:
-                while (exam.nfcFindCard() == 'noCard'):
-                    print('noCard')
+                exam.wait_for_card()
 
                 selections = inp.split(" ")[1:]
 
@@ -70,8 +69,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "reset":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select('3f00')
@@ -83,8 +81,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "setup":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 #Create an ADF
@@ -182,8 +179,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "verify_pin":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -195,8 +191,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "get_balance":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -219,8 +214,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "add_money":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -243,8 +237,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "spend_wallet":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -260,8 +253,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "spend_passbook":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -277,8 +269,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "withdraw_money":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -294,8 +285,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "pin_block":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -308,8 +298,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "pin_unblock":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -321,8 +310,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "online_debit":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -338,8 +326,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "update_overdraft":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -354,8 +341,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "pin_change":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
@@ -380,8 +366,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "pin_reset":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 ret = exam.cmd_select(name=b"walletTest")
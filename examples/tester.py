@@ -15,6 +15,7 @@ import traceback
 from Crypto.Cipher import DES  # type: ignore
 from conn_pn532 import BRIDGE_PN532
 from conn_pyscard import BRIDGE_PYSCARD
+from conn_emulator import BRIDGE_EMULATOR
 from fmcos import CPUFileType, KeyType, BalanceType, Protection, parse_return_code, FMCOS
 from utils import bytes_to_hexstr, assert_success
 
@@ -37,6 +38,7 @@ DEBUG_ACR1518 = True
 if __name__ == '__main__':
     #pn532_conn = BRIDGE_PN532(com_port="COM11", hw_debug=DEBUG_PN532)
     hw_conn = BRIDGE_PYSCARD(reader_string="ACS ACR1581 1S Dual Reader PICC 0", hw_debug=DEBUG_ACR1518)
+    #hw_conn = BRIDGE_EMULATOR(hw_debug=DEBUG_ACR1518)
     exam = FMCOS(hw_conn=hw_conn, fmcos_debug=DEBUG_FMCOS)
     while True:  # REPL loop
         inp = input("> ")
@@ -47,8 +49,7 @@ if __name__ == '__main__':
         if inp.find("pn532_") != -1:
             pn_cmd = inp.split(" ")[0]
 
-            while (exam.nfcFindCard() == 'noCard'):
-                    print('noCard')
+            exam.wait_for_card()
 
             match pn_cmd:
                 case "pn532_GetFirmwareVersion":
@@ -67,26 +68,22 @@ if __name__ == '__main__':
             break
 
         elif inp.find("fmcos_raw") != -1:
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             ret = exam.hw_conn.sendRaw(inp[10:])
             parse_return_code(ret[-2:])
 
         elif inp == "get4":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             exam.cmd_get_challenge()
 
         elif inp == "get8":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             exam.cmd_get_challenge(8)
 
         elif inp.find('select') != -1:
             try:
-                while (exam.nfcFindCard() == 'noCard'):
-                    print('noCard')
+                exam.wait_for_card()
 
                 selections = inp.split(" ")[1:]
 
@@ -96,8 +93,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "external_auth":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             if not exam.is_success(exam.cmd_external_authenticate(key_id=0)):
                 print("Failed to auth to card with default key")
@@ -105,8 +101,7 @@ if __name__ == '__main__':
                 print("Authentication successful")
 
         elif inp == "reset":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 exam.cmd_select('3f00')
@@ -132,16 +127,14 @@ if __name__ == '__main__':
 
         
         elif inp == 'wipe17':
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             try:
                 exam.cmd_external_authenticate(key_id=0, key=b'\x10\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1A\x1B\x1C\x1D\x1E\x1F')
             except:
                 print(traceback.format_exc())
 
         elif inp == "size_test":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             try:
 
                 #Select MF
@@ -174,8 +167,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == 'example_1':
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             try:
 
                 #Example from https://github.com/gao19970120/fmcosByPn532/blob/master/run.py
@@ -224,14 +216,11 @@ if __name__ == '__main__':
                 ret = exam.cmd_create_file(file_id=0x0001, file_type=CPUFileType.BinFile, file_size=0x000d, read_perm=0xf0, write_perm=0xf4, access_rights=0xf1)
                 assert_success(exam, ret)
 
-                ret = exam.cmd_select('0001')
+                #exam.sendCommand(0x00, 0xd6, 0x81, 0x00, Data=b'appForTlulock'), SFI addressing saves the SELECT of 0001
+                ret = exam.update_binary_sfi(sfi=0x01, data=b"appForTlulock")
                 assert_success(exam, ret)
 
-                #exam.sendCommand(0x00, 0xd6, 0x00, 0x00, Data=b'appForTlulock')
-                ret = exam.cmd_update_binary(p1=0, p2=0, data=b"appForTlulock")
-                assert_success(exam, ret)
-
-                ret = exam.cmd_read_binary(p1=0, p2=0, read_length=0x0D)
+                ret = exam.read_binary_sfi(sfi=0x01, length=0x0D)
                 assert_success(exam, ret)
 
                 #duka
@@ -262,8 +251,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "example_2":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
 
             try:
                 #Example from https://blog.csdn.net/robur/article/details/137655286
@@ -370,8 +358,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "example_3":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             try:
                 #Example from https://blog.csdn.net/lupengfei1009/article/details/53002341
 
@@ -525,8 +512,7 @@ if __name__ == '__main__':
                 print(traceback.format_exc())
 
         elif inp == "example_3a":
-            while (exam.nfcFindCard() == 'noCard'):
-                print('noCard')
+            exam.wait_for_card()
             try:
                 terminal_id = b"\x66\x66\x66\x66\x66\x66"
                 credit_key_1 = b"\x3F\x01\x3F\x01\x3F\x01\x3F\x01\x3F\x01\x3F\x01\x3F\x01\x3F\x01"
@@ -1,10 +1,18 @@
-import sys
+import logging
 import os
 import struct
 import datetime
+from collections import Counter
 from enum import IntEnum
 from utils import strToint16, bytes_to_hexstr
-from Crypto.Cipher import DES, DES3  # type: ignore
+from cardcrypto import CipherCache, MacEngine, xor_block
+from cardfile import CardBinaryFile
+from cardmeta import MetadataCache, normalise_path
+from cardsession import SecuritySession, EXTERNAL_AUTH, PIN, allows
+from cardlog import apdu_log, crypto_log, transaction_log, Hex, Lazy, enable_debug
+from status_words import CardError, UNKNOWN_MESSAGE, describe, error_class, raise_for_status
+from tlv import FCI, iter_tlv, encode_tag, encode_tlv
+from apdu import ApduBuilder, GET_CHALLENGE_4, GET_CHALLENGE_8, GET_BALANCE_PASSBOOK, GET_BALANCE_WALLET
 from Crypto.Util.Padding import pad, unpad  # type: ignore
 
 # Optional color support .. `pip install ansicolors`
@@ -62,7 +70,7 @@ class KeyType(IntEnum):
     CreditKey = 0x3f                        #Also called Captive/Trap/Stored/Recharge Key
 
 def parse_return_code(ret_code, console_print=True):
-    """Decode SW1/SW2 or extended status words into a readable message.
+    """Decode SW1/SW2 into a readable message, see `status_words.STATUS_TABLE`.
 
     Args:
         ret_code (bytes): Buffer ending in SW1 SW2.
@@ -76,164 +84,28 @@ def parse_return_code(ret_code, console_print=True):
     if len(ret_code) < 2:
         if console_print:
             print(f"Insufficient length of ret_code : {len(ret_code)}")
+        return UNKNOWN_MESSAGE
 
-    ret_string = "Unknown return code"
-
-    match ret_code[0]:
-        case 0x62:
-            if ret_code[1] >= 2 and ret_code[1] <= 0x80:
-                ret_string = "Triggering by the card"
-            match ret_code[1]:
-                case 0x81:
-                    ret_string = "Part of returned data may be corrupted"
-                case 0x82:
-                    ret_string = "End of file or record reached before reading Ne bytes"
-                case 0x83:
-                    ret_string = "Selected file deactivated"
-                case 0x84:
-                    ret_string = "File control information not formatted"
-                case 0x85:
-                    ret_string = "Selected file in termination state"
-                case 0x86:
-                    ret_string = "No input data available from a sensor on the card"
-
-        case 0x63:
-            if ret_code[1] == 0x81:
-                ret_string = "File filled up by the last write"
-            elif (ret_code[1] & 0xF0) == 0xC0:
-                ret_string = "Counter from 0 to 15 encoded by 'X'(SW2&0xF)"
-
-        case 0x64:
-            if ret_code[1] >= 2 and ret_code[1] <= 0x80:
-                ret_string = "Triggering by the card"
-            elif ret_code[1] == 1:
-                ret_string = "Immediate response required by the card"
-
-        case 0x65:
-            if ret_code[1] == 0x81:
-                ret_string = "Memory failure"
-
-        case 0x67:
-            if ret_code[1] == 0x00:
-                ret_string = "Invalid length"
-
-        case 0x68:
-            match ret_code[1]:
-                case 0x81:
-                    ret_string = "Logical channel not supported"
-                case 0x82:
-                    ret_string = "Secure messaging not supported"
-                case 0x83:
-                    ret_string = "Last command of the chain expected"
-                case 0x84:
-                    ret_string = "Command chaining not supported"
-
-        case 0x69:
-            match ret_code[1]:
-                case 0x81:
-                    ret_string = "Command incompatible with file structure"
-                case 0x82:
-                    ret_string = "Security status not satisfied"
-                case 0x83:
-                    ret_string = "Authentication method blocked"
-                case 0x84:
-                    ret_string = "Reference data not usable"
-                case 0x85:
-                    ret_string = "Conditions of use not satisfied"
-                case 0x86:
-                    ret_string = "Command not allowed (no current EF)"
-                case 0x87:
-                    ret_string = "Expected secure messaging data objects missing"
-                case 0x88:
-                    ret_string = "Incorrect secure messaging data objects"
-
-        case 0x6A:
-            match ret_code[1]:
-                case 0x80:
-                    ret_string = "Incorrect parameters in the command data field"
-                case 0x81:
-                    ret_string = "Function not supported"
-                case 0x82:
-                    ret_string = "File or application not found"
-                case 0x83:
-                    ret_string = "Record not found"
-                case 0x84:
-                    ret_string = "Not enough memory space in the file"
-                case 0x85:
-                    ret_string = "Nc inconsistent with TLV structure"
-                case 0x86:
-                    ret_string = "Incorrect parameters P1-P2"
-                case 0x87:
-                    ret_string = "Nc inconsistent with parameters P1-P2"
-                case 0x88:
-                    ret_string = "Referenced data or reference data not found"
-                case 0x89:
-                    ret_string = "File already exists"
-                case 0x8A:
-                    ret_string = "DF name already exists"
-
-        case 0x6D:
-            match ret_code[1]:
-                case 0x00:
-                    ret_string = "Invalid INS parameter"
-
-        case 0x6E:
-            match ret_code[1]:
-                case 0x00:
-                    ret_string = "Invalid CLA parameter"
-
-        case 0x93:
-            match ret_code[1]:
-                case 0x02:
-                    ret_string = "Invalid MAC"
-
-        case 0x94:
-            match ret_code[1]:
-                case 0x01:
-                    ret_string = "The amount is insufficient"
-                case 0x03:
-                    ret_string = "Key indexes are not supported"
-
-        case 0x90:
-            if ret_code[1] == 0:
-                ret_string = "Operation Successful"
-
+    ret_string = describe(ret_code)
     if console_print:
-        print(f"[{color('=', fg='yellow')}] SW1_SW2 <= {bytes_to_hexstr(ret_code)} => {ret_string}")
+        print(f"[{color('=', fg='yellow')}] SW1_SW2 <= {bytes_to_hexstr(ret_code[-2:])} => {ret_string}")
 
     return ret_string
 
 def TLVanalysis(TLV, tagLen=1):
-    """Parse a simple TLV structure into a dict.
+    """Parse one level of BER-TLV into a dict mapping tag bytes -> value bytes.
 
-    Expects 1-byte tag by default; set tagLen=2 for 2-byte tags.
-    Returns dict mapping tag bytes -> value bytes, or 'error' on failure.
+    Returns 'error' on malformed input. `tagLen` is ignored, multi-byte tags are
+    recognised from the tag itself; new code should use `tlv.iter_tlv()`.
     """
-    sum = 0
-    TLVdict = {}
-    while (1):
-        try:
-            tag = TLV[sum:sum + tagLen]
-            try:
-                length = TLV[sum + tagLen]
-            except:
-                TLVdict[tag] = b'None'
-                break
-            value = TLV[sum + tagLen + 1:sum + tagLen + 1 + length]
-            TLVdata = {'tag': tag, 'length': length, 'value': value}
-            TLVdict[tag] = value
-            sum = sum + length + tagLen + 1
-            if sum >= len(TLV):
-                break
-        except:
-            return 'error'
-    return TLVdict
-    
+    try:
+        return {encode_tag(item.tag): bytes(item.value) for item in iter_tlv(TLV)}
+    except (ValueError, IndexError):
+        return 'error'
+
 def TLVcreate(tag, value):
-    """Create TLV bytes (1-byte length) from tag and value."""
-    len = len(value)
-    TLVdata = tag + bytes([len]) + value
-    return TLVdata
+    """Create TLV bytes from tag (bytes or int) and value, long-form length when needed."""
+    return encode_tlv(tag, value)
 
 class FMCOS():
     """High-level FMCOS card API with MAC/encryption support and helpers.
@@ -245,13 +117,175 @@ class FMCOS():
         self.hw_conn = hw_conn
         self.simulation_status = False
         self.fmcos_debug = fmcos_debug
+        if fmcos_debug:
+            enable_debug(apdu_log, crypto_log, transaction_log)
+        self.read_all_supported = None    #ISO "read all records" P2 mode, None until probed
+        self.selected_path = None         #FIDs of the selected MF/DF chain, None when unknown
+        self.selected_ef = None           #FID of the selected EF, None when unknown or none
+        self.created_df = None            #Path of the DF created last when the card may have made it current
+        self.cipher_cache = CipherCache()
+        self.mac_engine = MacEngine(self.cipher_cache)
+        #One APDU buffer per card, with room for the bridge to frame it in place
+        self.apdu_builder = ApduBuilder(headroom=getattr(hw_conn, "frame_headroom", 0), tailroom=getattr(hw_conn, "frame_tailroom", 0))
+        self.auto_response = True         #Follow 61xx with GET RESPONSE and retry 6Cxx with the corrected Le
+        self.response_fixups = Counter()  #(INS, SW1) -> number of 61xx / 6Cxx responses handled
+        self.card_uid = None              #UID of the card in the field, None until known
+        self.card_info = None             #TargetInfo (UID, ATQA, SAK, ATS) when the bridge decodes the activation
+        self.metadata = MetadataCache()   #(UID, path) -> FileInfo from FCIs and CREATE parameters
+        self.read_cache = None            #Optional ReadCache for files marked immutable
+        self.cache_token = None           #Change indicator of the card in the field, see refresh_cache_token()
+        self._immutable = set()           #(DF path, FID) of the files whose reads may be cached
+        self.session = SecuritySession()  #Security state of the current DF, lets satisfied authentications be skipped
 
     def nfcFindCard(self):
-        return self.hw_conn.nfcFindCard()
+        """Activate the card in the field and remember its UID for the metadata cache."""
+        uid = self.hw_conn.nfcFindCard()
+        self.reset_selection()
+        self.cache_token = None
+        if uid == 'noCard':
+            self.card_uid = None
+            self.card_info = None
+        else:
+            #Only a real UID keys the caches; bridges that cannot read it leave them off
+            self.card_uid = bytes(uid) if isinstance(uid, (bytes, bytearray, memoryview)) and len(uid) else None
+            self.card_info = getattr(self.hw_conn, "target_info", None)
+        return uid
+
+    def get_uid(self):
+        """UID of the card in the field; asks the reader on first use, which may re-activate the card."""
+        if self.card_uid == None:
+            self.nfcFindCard()
+        return self.card_uid
+
+    def file_info(self, path):
+        """Cached `FileInfo` for a file, without talking to the card.
+
+        Args:
+            path (str|list[int]|int): Absolute path ('3F00/3F01/0002' or FID list), or an
+                int FID in the currently selected DF.
+
+        Returns:
+            FileInfo|None: None when nothing is known about the file.
+        """
+        if isinstance(path, int):
+            if self.selected_path == None:
+                return None
+            path = self.selected_path + [path]
+        if self.card_uid == None:
+            #Without a UID from the bridge the cache could answer for another card
+            return None
+        return self.metadata.get(self.card_uid, path)
+
+    def find_df(self, df_name):
+        """Cached `FileInfo` of the DF named `df_name` (its `path` tells where it sits), or None."""
+        if self.card_uid == None:
+            return None
+        return self.metadata.find_df(self.card_uid, df_name)
+
+    def _record_created(self, parent, file_id, ret, **fields):
+        """Store the parameters of a successful CREATE in the metadata cache."""
+        if parent == None or self.card_uid == None or not self.is_success(ret):
+            return
+        path = parent + [file_id]
+        self.metadata.invalidate(self.card_uid, path)
+        self.metadata.update(self.card_uid, path, **fields)
+
+    def enable_read_cache(self, cache):
+        """Serve reads of immutable files from `cache` (a `readcache.ReadCache`, None to disable).
+
+        Entries are only used while `cache_token` is set for the card in the field, see
+        `refresh_cache_token()`, and only for files registered with `mark_immutable()`.
+        """
+        self.read_cache = cache
+
+    def mark_immutable(self, file_id, df_path=None):
+        """Declare that the content of an EF only changes together with the cache token.
+
+        Args:
+            file_id (str|int): FID of the EF (its SFI for EFs addressed by SFI, e.g. 0x0015).
+            df_path (str|list[int]|None): Path of the DF holding the EF, the selected DF by default.
+        """
+        if df_path == None:
+            if self.selected_path == None:
+                raise ValueError("No DF selected, pass df_path")
+            df_path = self.selected_path
+        fid = int(file_id, 16) if isinstance(file_id, str) else file_id
+        self._immutable.add((normalise_path(df_path), fid))
+
+    def refresh_cache_token(self, key_id, terminal_id, balance_type:BalanceType = BalanceType.Wallet):
+        """Read the change indicator of the card in the field and use it as `cache_token`.
+
+        Sends INITIALIZE FOR PURCHASE with a zero amount in the current (purse) DF; the old
+        balance and offline transaction serial it returns change with every load or purchase.
+        No purchase is started, the card drops the pending initialise with the next command.
+
+        Returns:
+            bytes: The token (balance + offline serial), None when the card refused the command.
+        """
+        self.cache_token = None
+        if len(terminal_id) != 6:
+            raise ValueError("terminal_id needs to be 6 bytes")
+        data = key_id.to_bytes(1, "big") + bytes(4) + terminal_id
+        ret = self.sendCommand(cla=0x80, ins=0x50, p1=0x01, p2=balance_type.value, Data=data, le=0x0F)
+        if self.is_success(ret) and self.card_uid != None:
+            self.cache_token = bytes(ret[:6])
+        transaction_log.info("CACHE_TOKEN => %s", Hex(ret))
+        return self.cache_token
+
+    def _cache_file(self, ins, p1, p2):
+        """Read cache file name for a READ/UPDATE BINARY/RECORD, None when the file may change."""
+        if self.read_cache == None or self.cache_token == None or self.card_uid == None or self.selected_path == None:
+            return None
+        if ins in (0xb0, 0xd6):
+            fid = p1 & 0x1f if p1 & 0x80 else self.selected_ef
+        else:
+            fid = p2 >> 3 if p2 >> 3 else self.selected_ef
+        if fid == None or (tuple(self.selected_path), fid) not in self._immutable:
+            return None
+        return "/".join(f"{f:04X}" for f in self.selected_path + [fid])
+
+    def _cached_read(self, ins, p1, p2, read_length, key, protection):
+        """`_cmd_read_bin_rec()` answered from the read cache for immutable files."""
+        #Decrypted payloads never go to disk
+        file = self._cache_file(ins, p1, p2) if protection != Protection.LineProtectEncrypt else None
+        if file == None:
+            return self._cmd_read_bin_rec(ins=ins, p1=p1, p2=p2, read_length=read_length, key=key, protection=protection)
+
+        request = f"{ins:02X}{p1:02X}{p2:02X}{read_length:02X}{'' if protection == None else 'M'}"
+        ret = self.read_cache.get(self.card_uid, self.cache_token, file, request)
+        if ret != None:
+            apdu_log.debug("READ_CACHE %s %s => %s", file, request, Hex(ret))
+            return ret
+        ret = self._cmd_read_bin_rec(ins=ins, p1=p1, p2=p2, read_length=read_length, key=key, protection=protection)
+        self.read_cache.put(self.card_uid, self.cache_token, file, request, ret)
+        return ret
 
     def nfcGetRecData(self):
         return self.hw_conn.nfcGetRecData()
 
+    def wait_for_card(self, timeout=None):
+        """Block until a card is presented to the reader; return False on timeout."""
+        self.reset_selection()
+        self.card_uid = None
+        self.card_info = None
+        self.cache_token = None
+        return self.hw_conn.wait_for_card(timeout)
+
+    def wait_for_removal(self, timeout=None):
+        """Block until the card has been taken away; return False on timeout."""
+        self.reset_selection()
+        self.card_uid = None
+        self.card_info = None
+        self.cache_token = None
+        return self.hw_conn.wait_for_removal(timeout)
+
+    def reset_selection(self):
+        """Forget the tracked selection, the next `select_path()` starts from the MF."""
+        self.selected_path = None
+        self.selected_ef = None
+        self.created_df = None
+        self.session.reset()
+
     def simulation(self, enabled):
         self.simulation_status = enabled
 
@@ -263,38 +297,11 @@ class FMCOS():
 
     def data_xor(self, src, dst):
         """XOR two 8-byte blocks and return the result."""
-        out_buf = b""
-        for i in range(8):
-            out_buf += (src[i] ^ dst[i]).to_bytes()
-        return out_buf
+        return xor_block(src, dst)
 
-    #https://github.com/Legrandin/pycryptodome/issues/297#issuecomment-500383674
     def make_cipher(self, key):
-        """Return DES/3DES ECB cipher matching key size and duplication rules.
-
-    Key interpretation:
-    - 8 bytes -> DES
-    - 16 bytes -> if halves equal, DES; else 2-key 3DES
-    - 24 bytes -> reduce to DES or 2-key 3DES when halves repeat, else 3DES
-        """
-        cipher = None
-        if len(key) == 8:
-            cipher = DES.new(key, DES.MODE_ECB)
-        elif len(key) == 16:
-            if key[:8] == key[8:16]:
-                cipher = DES.new(key[:8], DES.MODE_ECB)
-            else:
-                cipher = DES3.new(key, DES3.MODE_ECB)
-        else:
-            if key[:8] == key[8:16] and key[-8:] == key[8:16]:
-                cipher = DES.new(key[:8], DES.MODE_ECB)
-            elif key[:8] == key[8:16]:
-                cipher = DES3.new(key[8:], DES3.MODE_ECB)
-            elif key[-8:] == key[8:16]:
-                cipher = DES3.new(key[:-8], DES3.MODE_ECB)
-            else:
-                cipher = DES3.new(key, DES3.MODE_ECB)
-        return cipher
+        """Return the cached DES/3DES ECB cipher for `key` (see cardcrypto.new_cipher for the key rules)."""
+        return self.cipher_cache.cipher(key)
 
     def encrypt(self, data, key):
         """ISO7816-pad and encrypt with the cipher returned by make_cipher."""
@@ -310,29 +317,15 @@ class FMCOS():
 
     def fmcos_des_mac(self, buf, key, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00", ret_cnt=4):
         """Compute single-DES CBC-MAC over ISO7816-padded data; return first ret_cnt bytes."""
-        new_buf = pad(buf, DES.block_size, style='iso7816')
-        x = len(new_buf) // 8
-        val = iv
-        DESECB = DES.new(key, DES.MODE_ECB)
-
-        for i in range(x):
-            xor_data = self.data_xor(val, new_buf[(i*8):(i*8)+8])
-            val = DESECB.encrypt(xor_data)
-
-        return val[:ret_cnt]
+        return self.mac_engine.des_mac(buf=buf, key=key, iv=iv, ret_cnt=ret_cnt)
 
     def fmcos_3des_mac(self, buf, key, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00", ret_cnt=4):
         """Compute 3DES CBC-MAC (DES-L, DES-R, DES-L) variant; return first ret_cnt bytes."""
-        key_l = key[:8]
-        key_r = key[8:]
-        DESECB_L = DES.new(key_l, DES.MODE_ECB)
-        DESECB_R = DES.new(key_r, DES.MODE_ECB)
+        return self.mac_engine.tdes_mac(buf=buf, key=key, iv=iv, ret_cnt=ret_cnt)
 
-        val = self.fmcos_des_mac(buf=buf, key=key_l, iv=iv, ret_cnt=8)
-        val = DESECB_R.decrypt(val)
-        val = DESECB_L.encrypt(val)
-
-        return val[:ret_cnt]
+    def fmcos_mac_many(self, bufs, key, iv=b"\x00\x00\x00\x00\x00\x00\x00\x00", ret_cnt=4):
+        """MAC a batch of messages with one key (DES for 8-byte keys, 3DES otherwise)."""
+        return self.mac_engine.mac_many(bufs=bufs, key=key, iv=iv, ret_cnt=ret_cnt)
 
     def fmcos_packet_mac(self, cla, ins, p1, p2, data, iv, key):
         """Build MAC for APDU header + optional data as per FMCOS spec."""
@@ -351,16 +344,10 @@ class FMCOS():
             full_mac_data += ( (len(data)+4) & 0xff ).to_bytes()   #LC
             full_mac_data += data
         #Calculate MAC
-        if len(key) == 8:
-            ret_mac = self.fmcos_des_mac(buf=full_mac_data, iv=iv, key=key)
-        else:
-            ret_mac = self.fmcos_3des_mac(buf=full_mac_data, iv=iv, key=key)
-        return ret_mac
+        return self.mac_engine.mac(buf=full_mac_data, key=key, iv=iv)
 
     def cmd_select(self, fileID=None, name=None):
         """SELECT by fileID (short File ID) or name (AID)."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if fileID == None and name == None:
             raise ValueError("fileID or name cannot be empty")
 
@@ -373,61 +360,181 @@ class FMCOS():
             ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=name)
         else:
             p1 = 0x00
+            if isinstance(fileID, int):
+                fileID = f"{fileID:04x}"
             fileIDlist = strToint16(fileID)
             ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=fileIDlist,le=0x00)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] SELECT => {bytes_to_hexstr(ret)}\n")
-            if ret[-2:] == b"\x90\x00":
-                self.parse_tlv(ret)
+        before = None if self.selected_path == None else tuple(self.selected_path)
+        self._track_select(fileID, name, ret)
+        if self.selected_path == None or tuple(self.selected_path) != before \
+           or getattr(self.hw_conn, "select_resets_card", False):
+            #Selecting another DF clears the card's security state, on readers that re-activate
+            #the card for every SELECT so does selecting the same DF again
+            self.session.reset(known=self.selected_path != None)
+        apdu_log.info("SELECT => %s", Hex(ret))
+        if ret[-2:] == b"\x90\x00" and apdu_log.isEnabledFor(logging.DEBUG):
+            self.parse_tlv(ret)
 
         return ret
 
+    def _track_select(self, fileID, name, ret):
+        """Update `selected_path` / `selected_ef` from a SELECT response."""
+        if getattr(self.hw_conn, "select_resets_card", False):
+            #The reader re-activates the card for every SELECT, which lands it back in the MF
+            self.selected_path = [0x3f00]
+            self.selected_ef = None
+
+        created, self.created_df = self.created_df, None
+        if not self.is_success(ret) or name:
+            #DF names do not tell where the DF sits in the tree, unless the DF is in the metadata cache
+            self.reset_selection()
+            info = self.metadata.find_df(self.card_uid, name) if name and self.card_uid != None and self.is_success(ret) else None
+            if info != None:
+                self.selected_path = list(info.path)
+            return
+
+        fid = int(fileID, 16)
+        if created != None and fid not in (0x3f00, created[-1], created[-2]):
+            #After CREATE DF only the MF, the new DF and its parent resolve the same from either DF
+            self.reset_selection()
+            return
+        if fid == 0x3f00:
+            self.selected_path = [0x3f00]
+            self.selected_ef = None
+        elif ret[:1] == b"\x6f":
+            #Only DF selections return an FCI
+            path = self.selected_path
+            if path == None:
+                pass
+            elif len(path) > 1 and path[-2] == fid:
+                path.pop()
+            elif path[-1] != fid:
+                path.append(fid)
+            self.selected_ef = None
+        else:
+            self.selected_ef = fid
+            return
+
+        #MF / DF selected, keep what its FCI tells
+        if self.selected_path != None and self.card_uid != None and ret[:1] == b"\x6f":
+            try:
+                fci = FCI.parse(memoryview(ret)[:-2])
+            except ValueError:
+                return
+            self.metadata.update(self.card_uid, self.selected_path, df_name=fci.df_name, sfi=fci.sfi)
+
+    def select_path(self, path):
+        """SELECT a file by absolute or relative path, skipping the SELECTs that are already current.
+
+        Args:
+            path (str|list[int]): e.g. "3f00/3f01/0001" (absolute) or "0001" (relative to the
+                current DF). Every element but the last must be a DF.
+
+        Returns:
+            bytes: Response of the last SELECT sent, or SW 90 00 alone when nothing had to be sent.
+        """
+        if isinstance(path, str):
+            target = [int(fid, 16) for fid in path.split("/") if fid]
+        else:
+            target = list(path)
+        if not target:
+            raise ValueError("path cannot be empty")
+
+        current = self.selected_path
+        if getattr(self.hw_conn, "select_resets_card", False):
+            current = None
+        if target[0] != 0x3f00:
+            if current == None:
+                raise ValueError(f"Relative path {path!r} needs a known current DF")
+            target = current + target
+
+        dfs, last = target[:-1], target[-1]
+        created = self.created_df
+        if created == None and (current == target or (current == dfs and self.selected_ef == last)):
+            return b"\x90\x00"
+
+        steps = target
+        if current == target:
+            steps = []
+        elif current != None:
+            common = 0
+            while common < min(len(current), len(dfs)) and current[common] == dfs[common]:
+                common += 1
+            if common == len(current):
+                steps = target[common:]
+            elif target == current[:-1]:
+                steps = [last]
+            elif common == len(current) - 1 and common > 0:
+                #One level up: select the parent DF by its FID, then walk down
+                steps = [current[common - 1]] + target[common:]
+        if created != None and steps[:1] != [created[-1]] and steps[:1] != [0x3f00]:
+            #The card may still be in the DF it just created, go back to the parent first
+            steps = [current[-1]] + steps
+
+        ret = b"\x90\x00"
+        for fid in steps:
+            ret = self.cmd_select(fid)
+            if not self.is_success(ret):
+                break
+        return ret
+
     def cmd_get_challenge(self, challenge_length=4):
         """GET CHALLENGE (4 or 8 bytes)."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if challenge_length != 4 and challenge_length != 8:
             raise ValueError("Invalid challenge_length size, only 4 or 8 accepted")
 
         if self.simulation_status:
             return b"\xff\xff\xff\xff\xff\xff\xff\xff\x90\x00"
 
-        cla = 0x00
-        ins = 0x84
-        p1 = 0
-        p2 = 0
-        chlg = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,le=challenge_length)
+        chlg = self.sendStatic(GET_CHALLENGE_4 if challenge_length == 4 else GET_CHALLENGE_8)
         if challenge_length == 4:
             chlg = chlg + b'\x00\x00\x00\x00'
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] GET_CHALLENGE => {bytes_to_hexstr(chlg)}\n")
+        apdu_log.info("GET_CHALLENGE => %s", Hex(chlg))
 
         return chlg
 
     def cmd_erase_df(self):
         """ERASE DF command."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         cla = 0x80
         ins = 0x0e
         p1 = 0
         p2 = 0
            
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2)
-
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] ERASE_DF => {bytes_to_hexstr(ret)}\n")
+        if self.is_success(ret) and self.created_df != None:
+            #Either the new DF or its parent was erased
+            if self.card_uid != None:
+                self.metadata.invalidate(self.card_uid, self.selected_path, keep_root=True)
+                if self.read_cache != None:
+                    self.read_cache.invalidate(self.card_uid)
+            self.reset_selection()
+        elif self.is_success(ret):
+            #The DF stays selected, its EFs are gone
+            self.selected_ef = None
+            self.session.reset(known=True)
+            if self.card_uid != None:
+                self.metadata.invalidate(self.card_uid, self.selected_path, keep_root=True)
+                if self.read_cache != None:
+                    self.read_cache.invalidate(self.card_uid)
+
+        apdu_log.info("ERASE_DF => %s", Hex(ret))
 
         return ret
 
-    def cmd_external_authenticate(self, key_id, key=b'\xff\xff\xff\xff\xff\xff\xff\xff'):
-        """EXTERNAL AUTHENTICATE using single/2-key/3-key DES depending on key length."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
+    def cmd_external_authenticate(self, key_id, key=b'\xff\xff\xff\xff\xff\xff\xff\xff', force=False):
+        """EXTERNAL AUTHENTICATE using single/2-key/3-key DES depending on key length.
 
+        Returns 9000 without talking to the card when the same key already authenticated
+        in the current DF, unless `force` is set.
+        """
         if len(key) != 8 and len(key) != 16:
             raise ValueError("Invalid key size, only 8 or 16 bytes accepted")
+        if not force and self.session.is_satisfied(EXTERNAL_AUTH, key_id, key):
+            self.session.skipped += 1
+            apdu_log.info("EXTERNAL_AUTHENTICATE key %d already in effect", key_id)
+            return b"\x90\x00"
 
         chlg = self.cmd_get_challenge(8)
         if chlg[-2:] != b"\x90\x00":
@@ -443,27 +550,72 @@ class FMCOS():
         chlg_resp =  cipher.encrypt(chlg)
 
         ret  = self.sendCommand(cla=cla, ins=ins, p1=p1, p2=p2, Data=chlg_resp)
+        self._track_auth(EXTERNAL_AUTH, key_id, key, ret)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] EXTERNAL_AUTHENTICATE => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("EXTERNAL_AUTHENTICATE => %s", Hex(ret))
         return ret
 
+    def _track_auth(self, kind, key_id, secret, ret):
+        """Update the tracked security state after EXTERNAL AUTHENTICATE / VERIFY PIN."""
+        if self.is_success(ret):
+            followup = self.session.followup(self.card_uid, self.selected_path, kind, key_id)
+            self.session.record(kind, key_id, secret, followup)
+        else:
+            #FMCOS versions differ in what a failed attempt does to the state
+            self.session.reset()
+
+    def ensure_rights(self, perm, external_auth=None, pin=None):
+        """Make sure access condition `perm` is met, authenticating only when it is not.
+
+        The credentials are tried in order (external authentication first) until the
+        tracked security state meets `perm`; keys whose follow-up state is known not to
+        meet it are not presented.
+
+        Args:
+            perm (int): Access condition byte, e.g. an EF's read_perm (see NOTES.md).
+            external_auth (tuple|None): (key_id, key) for EXTERNAL AUTHENTICATE.
+            pin (tuple|None): (key_id, pin_code) for VERIFY PIN.
+
+        Returns:
+            bool: True when `perm` is met, or a credential was accepted whose follow-up
+                state is unknown; False otherwise.
+        """
+        if self.session.allows(perm):
+            return True
+
+        for kind, cred in ((EXTERNAL_AUTH, external_auth), (PIN, pin)):
+            if cred == None:
+                continue
+            key_id, secret = cred
+            followup = self.session.followup(self.card_uid, self.selected_path, kind, key_id)
+            if followup != None and not allows(perm, followup):
+                continue
+            if kind == EXTERNAL_AUTH:
+                ret = self.cmd_external_authenticate(key_id, secret)
+            else:
+                ret = self.cmd_verify_pin(key_id, secret)
+            if self.is_success(ret) and (self.session.state == None or self.session.allows(perm)):
+                return True
+        return False
+
+    def file_rights(self, file_id, write=False):
+        """Read (or write) access condition of an EF in the current DF, from the metadata cache; None when unknown."""
+        info = self.file_info(file_id)
+        if info == None:
+            return None
+        return info.write_perm if write else info.read_perm
+
     def cmd_internal_authenticate(self, p1, p2, data):
         """INTERNAL AUTHENTICATE passthrough."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         cla = 0x00
         ins = 0x88
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] INTERNAL_AUTHENTICATE => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("INTERNAL_AUTHENTICATE => %s", Hex(ret))
         return ret
 
     def cmd_create_directory(self, file_id, file_space, create_permissions, erase_permission, app_id, df_name):
         """CREATE FILE for MF/DF directory objects."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         cla = 0x80
         ins = 0xe0
         p1 = (file_id & 0xFF00) >> 8
@@ -478,15 +630,20 @@ class FMCOS():
         data += b"\xff\xff" #Not used parameters
         data += df_name
 
+        parent = self.selected_path
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] CREATE_DIRECTORY => {bytes_to_hexstr(ret)}\n")
+        self._record_created(parent, file_id, ret, file_type=CPUFileType.MFDF, size=file_space, df_name=bytes(df_name), \
+                             sfi=app_id, create_perm=create_permissions, erase_perm=erase_permission)
+        if self.is_success(ret):
+            #Some FMCOS versions make a new DF current: keep the parent and resolve it with the next SELECT
+            self.selected_ef = None
+            self.created_df = None if parent == None else parent + [file_id]
+            self.session.reset()
+        apdu_log.info("CREATE_DIRECTORY => %s", Hex(ret))
         return ret
 
     def cmd_create_edep(self, balance_type, usage_rights, loop_file_id):
         """CREATE WALLET (EDEP) for passbook/wallet balances."""
-        if self.fmcos_debug: print(f"Calling : {sys._getframe(0).f_code.co_name}({balance_type.name})")
-
         cla = 0x80
         ins = 0xe0
         file_id = balance_type.value
@@ -501,14 +658,11 @@ class FMCOS():
         data += loop_file_id.to_bytes()
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] CREATE_WALLET => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("CREATE_WALLET => %s", Hex(ret))
         return ret
 
     def cmd_create_keyfile(self, file_id, file_space, df_sid, key_permission):
         """CREATE KEYFILE with space and permissions."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         cla = 0x80
         ins = 0xe0
         p1 = (file_id & 0xFF00) >> 8
@@ -522,14 +676,12 @@ class FMCOS():
         data += b"\xff\xff" #Not used parameters
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] CREATE_KEYFILE => {bytes_to_hexstr(ret)}\n")
+        self._record_created(self.selected_path, file_id, ret, file_type=CPUFileType.Keyfile, size=file_space, write_perm=key_permission)
+        apdu_log.info("CREATE_KEYFILE => %s", Hex(ret))
         return ret
 
     def cmd_create_file(self, file_id, file_type, file_size, read_perm, write_perm, access_rights, protection:Protection = None):
         """CREATE BINARY/RECORD/LOOP files with optional protection flags."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}({file_type.name})")
-
         cla = 0x80
         ins = 0xe0
         p1 = (file_id & 0xFF00) >> 8
@@ -548,15 +700,14 @@ class FMCOS():
         data += access_rights.to_bytes()
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] CREATE_FILE => {bytes_to_hexstr(ret)}\n")
+        self._record_created(self.selected_path, file_id, ret, file_type=file_type, size=file_size, read_perm=read_perm, \
+                             write_perm=write_perm, access_rights=access_rights, protection=protection)
+        apdu_log.info("CREATE_FILE => %s", Hex(ret))
         return ret
 
     def cmd_write_key(self, key_add_update, key_id, key_type, usage_rights, key, change_rights=None, key_version=None, algo_id=None, \
                       followup_status=None, error_counter=None, extauth_key=None, protection:Protection = None):
         """WRITE KEY variants for multiple key types; supports MAC/enc line protection."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}({key_type.name})")
-
         cla = 0x80
         ins = 0xD4
         if isinstance(key_add_update, KeyType):
@@ -627,14 +778,16 @@ class FMCOS():
             data += self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=data, iv=chlg_iv, key=extauth_key)
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] WRITE_KEY => {bytes_to_hexstr(ret)}\n")
+        kind = {KeyType.ExternalAuthenticationKey: EXTERNAL_AUTH, KeyType.PinKey: PIN}.get(key_type)
+        if kind != None and self.is_success(ret):
+            self.session.forget(kind, key_id)
+            if self.selected_path != None:
+                self.session.register_key(self.card_uid, self.selected_path, kind, key_id, followup_status)
+        apdu_log.info("WRITE_KEY => %s", Hex(ret))
         return ret
         
     def _cmd_update_bin_rec(self, ins, p1, p2, data, key=None, protection:Protection = None):
         """Common helper for UPDATE BINARY/RECORD with optional line protection."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name} ({protection=})")
-
         #Need to account for padding + mac
         if len(data) > 245:
             raise ValueError("data MAX length can only be 245")
@@ -659,22 +812,20 @@ class FMCOS():
             data_bin += self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=data_bin, iv=chlg_iv, key=key)
 
         ret = self.sendCommand(cla,ins,p1,p2,Data=data_bin)
+        file = self._cache_file(ins, p1, p2)
+        if file != None:
+            self.read_cache.invalidate(self.card_uid, file)
         return ret
 
     def cmd_update_binary(self, p1, p2, data, key=None, protection:Protection = None):
         """UPDATE BINARY wrapper."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         ins = 0xd6
         ret = self._cmd_update_bin_rec(ins=ins, p1=p1, p2=p2, data=data, key=key, protection=protection)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] UPDATE_BINARY => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("UPDATE_BINARY => %s", Hex(ret))
         return ret
 
     def cmd_update_record(self, record_number, file_id, data, key=None, use_tlv=False, protection:Protection = None):
         """UPDATE RECORD wrapper; can wrap data in a simple TLV (tag 0xF7)."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         ins = 0xdc
         p1 = record_number
         p2 = ( (file_id & 0x1f) << 3 ) | 4
@@ -683,14 +834,11 @@ class FMCOS():
             data = b"\xF7" + len(data).to_bytes() + data
 
         ret = self._cmd_update_bin_rec(ins=ins, p1=p1, p2=p2, data=data, key=key, protection=protection)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] UPDATE_RECORD => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("UPDATE_RECORD => %s", Hex(ret))
         return ret
 
     def _cmd_read_bin_rec(self, ins, p1, p2, read_length=1, key=None, protection:Protection = None):
         """Common helper for READ BINARY/RECORD with optional MAC validation and decrypt."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if read_length > 0xff:
             raise ValueError("read_length MAX length can only be 255")
 
@@ -713,16 +861,11 @@ class FMCOS():
             ret_msg = ret[:-6]
 
             #Calculate msg MAC
-            if len(key) == 8:
-                calc_mac = self.fmcos_des_mac(buf=ret_msg, iv=chlg_iv, key=key)
-            else:
-                calc_mac = self.fmcos_3des_mac(buf=ret_msg, iv=chlg_iv, key=key)
+            calc_mac = self.mac_engine.mac(buf=ret_msg, key=key, iv=chlg_iv)
 
-            if self.fmcos_debug:
-                print(f"[{color('=', fg='yellow')}] RET_MSG => {bytes_to_hexstr(ret_msg)}")
-                print(f"[{color('=', fg='yellow')}] MAC_MSG => {bytes_to_hexstr(ret_mac)} <> MAC_CALC => {bytes_to_hexstr(calc_mac)}")
-                assert calc_mac == ret_mac, f"MAC validation failed"
-                print(f"[{color('+', fg='green')}] MAC validation successful")
+            crypto_log.debug("RET_MSG => %s", Hex(ret_msg))
+            crypto_log.debug("MAC_MSG => %s <> MAC_CALC => %s", Hex(ret_mac), Hex(calc_mac))
+            assert calc_mac == ret_mac, f"MAC validation failed"
 
         if protection == Protection.LineProtectEncrypt:
             ret = self.decrypt(data=ret_msg, key=key)[1:] #First byte is the size
@@ -732,39 +875,260 @@ class FMCOS():
 
     def cmd_read_binary(self, p1, p2, read_length=1, key=None, protection:Protection = None):
         """READ BINARY wrapper."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         ins = 0xB0
-        ret = self._cmd_read_bin_rec(ins=ins, p1=p1, p2=p2, read_length=read_length, key=key, protection=protection)
+        ret = self._cached_read(ins, p1, p2, read_length, key, protection)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] READ_BINARY => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("READ_BINARY => %s", Hex(ret))
         return ret
 
+    def _sfi_p1(self, sfi, offset):
+        if not 1 <= sfi <= 0x1e:
+            raise ValueError("sfi must be between 0x01 and 0x1E")
+        if not 0 <= offset <= 0xff:
+            raise ValueError("offset MAX can only be 0xFF when addressing by SFI")
+        return 0x80 | sfi
+
+    def read_binary_sfi(self, sfi, offset=0, length=1, key=None, protection:Protection = None):
+        """READ BINARY addressed by short file identifier, no SELECT needed.
+
+        The EF becomes the current EF. Under protection the MAC is always verified and
+        stripped, MAC+ENC payloads are decrypted.
+
+        Returns:
+            bytes: Data + SW1 SW2.
+        """
+        p1 = self._sfi_p1(sfi, offset)
+        if not 0 < length <= self.read_chunk_size(protection):
+            raise ValueError(f"length must be between 1 and {self.read_chunk_size(protection)}")
+        if protection and key == None:
+            raise ValueError("key is required for MAC/encryption")
+
+        data, sw = self._read_chunk(0xB0, p1, offset, length, key, protection)
+        ret = bytes(data) + sw
+        apdu_log.info("READ_BINARY_SFI => %s", Hex(ret))
+        return ret
+
+    def update_binary_sfi(self, sfi, data, offset=0, key=None, protection:Protection = None):
+        """UPDATE BINARY addressed by short file identifier, no SELECT needed."""
+        p1 = self._sfi_p1(sfi, offset)
+        ret = self._cmd_update_bin_rec(ins=0xd6, p1=p1, p2=offset, data=data, key=key, protection=protection)
+        apdu_log.info("UPDATE_BINARY_SFI => %s", Hex(ret))
+        return ret
+
+    def open_binary(self, file_id, size, key=None, protection:Protection = None):
+        """Return a `CardBinaryFile` write-back buffer over a binary EF.
+
+        Reads are paged in on first access, writes are kept locally until `flush()`
+        (or the end of a `with` block) sends them in as few UPDATE BINARY APDUs as possible.
+
+        Args:
+            file_id (str|int): File ID (e.g. '0002' or 0x3F01), an int in 1..0x1E is an SFI (files up to 256 bytes).
+            size (int): File size in bytes.
+        """
+        return CardBinaryFile(self, file_id, size, key=key, protection=protection)
+
+    def read_chunk_size(self, protection:Protection = None):
+        """Largest READ BINARY payload that fits the reader's `max_le` once MAC / encryption overhead is added."""
+        max_le = min(getattr(self.hw_conn, "max_le", 0xFF), 0xFF)
+        if protection == None:
+            return max_le
+        if protection == Protection.LineProtect:
+            return max_le - 4
+        #Ciphertext is len|data|padding rounded to whole blocks, followed by the MAC
+        return ((max_le - 4) // 8) * 8 - 2
+
+    def write_chunk_size(self, protection:Protection = None):
+        """Largest UPDATE BINARY / RECORD payload whose APDU fits one frame to the card (`max_lc`, from the FSC)."""
+        max_lc = min(getattr(self.hw_conn, "max_lc", 0xFF), 0xFF)
+        if protection == None:
+            size = max_lc
+        elif protection == Protection.LineProtect:
+            size = max_lc - 4
+        else:
+            #len|data|padding rounded to whole blocks, followed by the MAC
+            size = ((max_lc - 4) // 8) * 8 - 2
+        #Below that the bridge has to chain the frames anyway
+        return max(8, min(245, size))
+
+    def read_file(self, fid_or_sfi=None, offset=0, length=None, chunk=None, key=None, protection:Protection = None):
+        """Stream a binary EF as memoryview chunks.
+
+        Args:
+            fid_or_sfi (str|int|None): File ID to SELECT (e.g. '0002' or 0x0002), SFI (1..0x1F),
+                or None for the current EF.
+            offset (int): First byte to read.
+            length (int|None): Number of bytes to read, None reads to the end of the file.
+            chunk (int|None): Preferred chunk size, capped to `read_chunk_size(protection)`.
+            key (bytes): Line protection key, required with `protection`.
+            protection (Protection): Every chunk's MAC is verified, LineProtectEncrypt chunks are decrypted.
+        """
+        if protection and key == None:
+            raise ValueError("key is required for MAC/encryption")
+        if offset > 0x7fff:
+            raise ValueError("offset MAX can only be 0x7FFF")
+
+        max_chunk = self.read_chunk_size(protection)
+        chunk = max_chunk if chunk == None else min(chunk, max_chunk)
+        if chunk <= 0:
+            raise ValueError("chunk size must be positive")
+
+        sfi = None
+        if isinstance(fid_or_sfi, int) and fid_or_sfi <= 0x1f:
+            sfi = fid_or_sfi
+            if offset > 0xff:
+                #SFI addressing only carries an 8-bit offset, a first 1-byte read makes the EF current
+                self._read_chunk(0xB0, 0x80 | sfi, 0, 1, key, protection)
+                sfi = None
+        elif fid_or_sfi != None:
+            fid = fid_or_sfi if isinstance(fid_or_sfi, str) else f"{fid_or_sfi:04x}"
+            ret = self.cmd_select(fid)
+            if not self.is_success(ret):
+                raise_for_status(ret, f"SELECT {fid}")
+
+        remaining = length
+        first = True
+        while remaining == None or remaining > 0:
+            le = chunk if remaining == None else min(chunk, remaining)
+            if sfi != None:
+                p1, p2 = 0x80 | sfi, offset
+                sfi = None
+            else:
+                p1, p2 = offset >> 8, offset & 0xff
+
+            data, sw = self._read_chunk(0xB0, p1, p2, le, key, protection)
+            if sw[0] == 0x6c and sw[1] != 0:
+                #Fewer bytes left than asked for, this is the last chunk
+                data, sw = self._read_chunk(0xB0, p1, p2, sw[1], key, protection)
+                remaining = 0
+            elif sw == b"\x6b\x00" and not first:
+                #The previous chunk ended exactly on the end of the file
+                break
+            first = False
+            if sw != b"\x90\x00":
+                raise error_class(sw)(sw, f"READ BINARY at offset {offset}")
+
+            yield memoryview(data)
+            offset += len(data)
+            if remaining != None:
+                remaining -= len(data)
+            if len(data) < le or offset > 0x7fff:
+                break
+
+    def _read_chunk(self, ins, p1, p2, le, key=None, protection:Protection = None):
+        """One READ BINARY / READ RECORD; return (data, SW1 SW2) with the MAC verified and the payload decrypted."""
+        cla = 0x00
+        data = None
+        if protection:
+            cla |= 0x04
+            chlg_iv = self.cmd_get_challenge(8)
+            data = self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=data, iv=chlg_iv, key=key)
+
+        ret = self.sendCommand(cla, ins, p1, p2, Data=data, le=le)
+        sw = ret[-2:]
+        if sw != b"\x90\x00" or not protection:
+            return ret[:-2], sw
+
+        ret_msg = ret[:-6]
+        if self.mac_engine.mac(buf=ret_msg, key=key, iv=chlg_iv) != ret[-6:-2]:
+            raise ValueError(f"MAC validation failed on {ins:02X} {p1:02X}{p2:02X}")
+        if protection == Protection.LineProtectEncrypt:
+            plain = self.decrypt(data=ret_msg, key=key)
+            ret_msg = plain[1:1 + plain[0]]
+        return ret_msg, sw
+
     def cmd_read_record(self, record_number, file_id, read_length=0, has_tlv=False, key=None, protection:Protection = None):
         """READ RECORD wrapper; optional TLV unwrapping (tag 0xF7)."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if has_tlv:
             read_length += 2
 
         ins = 0xB2
         p1 = record_number
         p2 = ( (file_id & 0x1f) << 3 ) | 4
-        ret = self._cmd_read_bin_rec(ins=ins, p1=p1, p2=p2, read_length=read_length, key=key, protection=protection)
+        ret = self._cached_read(ins, p1, p2, read_length, key, protection)
 
         if has_tlv:
             assert ret[0] == 0xf7, f"TLV Tag incorrect"
             ret = ret[2:]
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] READ_RECORD => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("READ_RECORD => %s", Hex(ret))
         return ret
 
+    def iter_records(self, file_id, record_length=None, has_tlv=False, key=None, protection:Protection = None):
+        """Yield every record of a record / loop file, starting at record 1.
+
+        When the record boundaries are known (`record_length` for fixed and loop files, or
+        `has_tlv` for 0xF7-wrapped records) the ISO "read all records from P1" mode (P2 b3..b1 = 101)
+        returns as many records per APDU as the reader allows. Cards that refuse that mode fall
+        back to one READ RECORD per record; both stop on 6A83 (record not found).
+
+        Args:
+            file_id (int): Short file identifier of the EF.
+            record_length (int|None): Fixed record length, including the TLV header if any.
+            has_tlv (bool): Records are wrapped as F7 L V; the value is yielded.
+            key (bytes): Line protection key, required with `protection`.
+            protection (Protection): MAC is verified per APDU, LineProtectEncrypt payloads are decrypted.
+        """
+        if protection and key == None:
+            raise ValueError("key is required for MAC/encryption")
+
+        sfi = (file_id & 0x1f) << 3
+        record_number = 1
+        if (record_length or has_tlv) and self.read_all_supported != False:
+            max_le = self.read_chunk_size(protection)
+            le = (max_le // record_length) * record_length if record_length else max_le
+            while record_number <= 0xff:
+                data, sw = self._read_chunk(0xB2, record_number, sfi | 0x05, le, key, protection)
+                if sw == b"\x6a\x83":
+                    return
+                if sw == b"\x6a\x82":
+                    raise error_class(sw)(sw, f"READ RECORD {record_number} (all)")
+                if sw != b"\x90\x00" or not data:
+                    if self.read_all_supported == None:
+                        self.read_all_supported = False
+                        break
+                    raise error_class(sw)(sw, f"READ RECORD {record_number} (all)")
+                self.read_all_supported = True
+
+                records = self._split_records(data, record_length, has_tlv)
+                yield from records
+                record_number += len(records)
+                #Room left for another fixed-length record means the last one has been returned
+                if record_length and len(data) + record_length <= le:
+                    return
+
+        while record_number <= 0xff:
+            data, sw = self._read_chunk(0xB2, record_number, sfi | 0x04, 0, key, protection)
+            if sw == b"\x6a\x83":
+                return
+            if sw != b"\x90\x00":
+                raise error_class(sw)(sw, f"READ RECORD {record_number}")
+            if has_tlv:
+                assert data[0] == 0xf7, f"TLV Tag incorrect"
+                data = data[2:2 + data[1]]
+            yield data
+            record_number += 1
+
+    def read_all_records(self, file_id, record_length=None, has_tlv=False, key=None, protection:Protection = None):
+        """Return every record of a record / loop file as a list, see `iter_records()`."""
+        return list(self.iter_records(file_id, record_length=record_length, has_tlv=has_tlv, key=key, protection=protection))
+
+    def _split_records(self, data, record_length, has_tlv):
+        """Split a "read all records" answer into records."""
+        records = []
+        pos = 0
+        while pos < len(data):
+            if has_tlv:
+                assert data[pos] == 0xf7, f"TLV Tag incorrect"
+                size = data[pos + 1]
+                records.append(data[pos + 2:pos + 2 + size])
+                pos += record_length or size + 2
+            else:
+                records.append(data[pos:pos + record_length])
+                pos += record_length
+        return records
+
     def cmd_append_record(self, file_id, data, key=None, use_tlv=False, protection:Protection = None):
         """APPEND RECORD, optionally TLV-wrapped."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if use_tlv:
             data = b"\xF7" + len(data).to_bytes() + data
 
@@ -773,27 +1137,30 @@ class FMCOS():
         p2 = ( (file_id & 0x1f) << 3 ) | 4
         ret = self._cmd_update_bin_rec(ins=ins, p1=p1, p2=p2, data=data, key=key, protection=protection)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] APPEND_RECORD => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("APPEND_RECORD => %s", Hex(ret))
         return ret
 
     def cmd_get_balance(self, balance_type):
         """GET BALANCE for passbook or wallet."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
-        cla = 0x80
-        ins = 0x5c
-        p1 = 0x00
-        p2 = balance_type.value
-        
-        ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2, le=4)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] GET_BALANCE => {bytes_to_hexstr(ret)}\n")
+        if balance_type == BalanceType.Passbook:
+            ret = self.sendStatic(GET_BALANCE_PASSBOOK)
+        elif balance_type == BalanceType.Wallet:
+            ret = self.sendStatic(GET_BALANCE_WALLET)
+        else:
+            ret = self.sendCommand(cla=0x80, ins=0x5c, p1=0x00, p2=balance_type, le=4)
+        transaction_log.info("GET_BALANCE => %s", Hex(ret))
         return ret
 
-    def cmd_verify_pin(self, key_id, pin_code):
-        """VERIFY PIN given key slot and PIN bytes."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
+    def cmd_verify_pin(self, key_id, pin_code, force=False):
+        """VERIFY PIN given key slot and PIN bytes.
+
+        Returns 9000 without talking to the card when the same PIN was already verified
+        in the current DF, unless `force` is set.
+        """
+        if not force and self.session.is_satisfied(PIN, key_id, pin_code):
+            self.session.skipped += 1
+            apdu_log.info("VERIFY_PIN key %d already in effect", key_id)
+            return b"\x90\x00"
 
         cla = 0x00
         ins = 0x20
@@ -801,15 +1168,13 @@ class FMCOS():
         p2 = key_id
         
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=pin_code)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] VERIFY_PIN => {bytes_to_hexstr(ret)}\n")
+        self._track_auth(PIN, key_id, pin_code, ret)
+        apdu_log.info("VERIFY_PIN => %s", Hex(ret))
         return ret
 
     #Key is a credit or debit key
     def _transfer(self, balance_type, key_id, amount, terminal_id, crde_key, internal_key, transfer_type):
         """Two-step credit/debit flow with MAC verification and TAC validation."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if self.simulation_status:  #Simulation needs work here
             return b"\x90\x00"
 
@@ -841,8 +1206,7 @@ class FMCOS():
         cla = 0x80
         ins = 0x50
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data,le=0x10)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] TRANSFER_PT1 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("TRANSFER_PT1 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("First part of transfer failed...")
@@ -861,10 +1225,9 @@ class FMCOS():
         #Verify MAC_1 (Old Balance)(amount)(balance_type)(terminal_id)
         mac_verify_buffer = ret[:4] + packed_amount + transaction_type.to_bytes() + terminal_id
         mac1_calculated = self.fmcos_des_mac(mac_verify_buffer, process_key)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] mac_verify_buffer => {bytes_to_hexstr(mac_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] Process Key => {bytes_to_hexstr(process_key)}")
-            print(f"[{color('=', fg='yellow')}] mac_1 => {bytes_to_hexstr(mac_1)} <> mac1_calculated => {bytes_to_hexstr(mac1_calculated)}")
+        crypto_log.debug("mac_verify_buffer => %s", Hex(mac_verify_buffer))
+        crypto_log.debug("Process Key => %s", Hex(process_key))
+        crypto_log.debug("mac_1 => %s <> mac1_calculated => %s", Hex(mac_1), Hex(mac1_calculated))
 
         assert mac1_calculated == mac_1, "MAC_1 does not match"
 
@@ -875,9 +1238,8 @@ class FMCOS():
         mac2_verify_buffer = packed_amount + transaction_type.to_bytes() + terminal_id + transaction_date + transaction_time
         mac2_calculated = self.fmcos_des_mac(mac2_verify_buffer, process_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] mac2_verify_buffer => {bytes_to_hexstr(mac2_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] mac2_calculated => {bytes_to_hexstr(mac2_calculated)}")
+        crypto_log.debug("mac2_verify_buffer => %s", Hex(mac2_verify_buffer))
+        crypto_log.debug("mac2_calculated => %s", Hex(mac2_calculated))
 
         data = b""
         data += transaction_date
@@ -887,8 +1249,7 @@ class FMCOS():
         cla = 0x80
         p2 = 0x00
         ret = self.sendCommand(cla=cla,ins=ins_v2,p1=p1_v2,p2=p2,Data=data,le=0x4)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] TRANSFER_PT2 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("TRANSFER_PT2 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("Second part of transfer failed...")
@@ -897,7 +1258,7 @@ class FMCOS():
         CARD_TAC = ret[:4]
         if transfer_type == 0x00:
             new_balance = old_balance + amount
-            tac_key = self.data_xor(internal_key[0:8], internal_key[8:])
+            tac_key = self.cipher_cache.xor_halves(internal_key)
         elif transfer_type == 0x05:
             new_balance = old_balance - amount
             tac_key = process_key
@@ -905,10 +1266,9 @@ class FMCOS():
         tac_verify_buffer = struct.pack(">I", new_balance) + online_transaction_serial + mac2_verify_buffer
         tac_calculated = self.fmcos_des_mac(tac_verify_buffer, tac_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] tac_key => {bytes_to_hexstr(tac_key)}")
-            print(f"[{color('=', fg='yellow')}] tac_verify_buffer => {bytes_to_hexstr(tac_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] CARD_TAC => {bytes_to_hexstr(CARD_TAC)} <> tac_calculated => {bytes_to_hexstr(tac_calculated)}\n")
+        crypto_log.debug("tac_key => %s", Hex(tac_key))
+        crypto_log.debug("tac_verify_buffer => %s", Hex(tac_verify_buffer))
+        crypto_log.debug("CARD_TAC => %s <> tac_calculated => %s", Hex(CARD_TAC), Hex(tac_calculated))
 
         assert CARD_TAC == tac_calculated, "TAC does not match"
         
@@ -916,43 +1276,31 @@ class FMCOS():
 
     def cmd_add_credit(self, balance_type, key_id, amount, terminal_id, credit_key, internal_key):
         """Add credit to wallet/passbook."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         return self._transfer(balance_type=balance_type, key_id=key_id, amount=amount, terminal_id=terminal_id, \
                             crde_key=credit_key, internal_key=internal_key, transfer_type=0x00)
 
     def cmd_online_transfer(self, key_id, amount, terminal_id, debit_key, internal_key, transaction_serial=None):
         """Online transfer (debit) to passbook."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         return self._transfer(balance_type=BalanceType.Passbook, key_id=key_id, amount=amount, terminal_id=terminal_id, \
                             crde_key=debit_key, internal_key=internal_key, transfer_type=0x05)
 
     def cmd_cash_withdraw(self, key_id, amount, terminal_id, purchase_key, internal_key, transaction_serial=None):
         """Cash withdrawal flow using purchase key."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         return self._transaction(balance_type=BalanceType.Passbook, key_id=key_id, amount=amount, terminal_id=terminal_id,\
                                     transaction_type_id=0x04, purchase_key=purchase_key, internal_key=internal_key, transaction_serial=None)
 
     def cmd_purchase_passbook(self, key_id, amount, terminal_id, purchase_key, internal_key, transaction_serial=None):
         """Purchase using passbook balance."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         return self._transaction(balance_type=BalanceType.Passbook, key_id=key_id, amount=amount, terminal_id=terminal_id,\
                                     transaction_type_id=0x05, purchase_key=purchase_key, internal_key=internal_key, transaction_serial=None)
 
     def cmd_purchase_wallet(self, key_id, amount, terminal_id, purchase_key, internal_key, transaction_serial=None):
         """Purchase using wallet balance."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         return self._transaction(balance_type=BalanceType.Wallet, key_id=key_id, amount=amount, terminal_id=terminal_id,\
                                     transaction_type_id=0x06, purchase_key=purchase_key, internal_key=internal_key, transaction_serial=None)
 
     def _transaction(self, balance_type:BalanceType, key_id, amount, transaction_type_id, terminal_id, purchase_key, internal_key, transaction_serial=None):
         """Two-step purchase/cash-withdrawal flow with MACs and TAC validation."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-
         if self.simulation_status:  #Simulation needs work here
             return b"\x90\x00"
 
@@ -984,8 +1332,7 @@ class FMCOS():
         cla = 0x80
         ins = 0x50
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data,le=0x0F)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] TRANSACTION_PT1 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("TRANSACTION_PT1 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("First part of transaction failed...")
@@ -1009,10 +1356,9 @@ class FMCOS():
         process_key = self.encrypt(data=pk_buffer, key=purchase_key)
         process_key = process_key[:8]
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] pk_buffer => {bytes_to_hexstr(pk_buffer)}")
-            print(f"[{color('=', fg='yellow')}] Process Key => {bytes_to_hexstr(process_key)}")
-            print(f"[{color('=', fg='yellow')}] Transaction Serial => {bytes_to_hexstr(transaction_serial)}")
+        crypto_log.debug("pk_buffer => %s", Hex(pk_buffer))
+        crypto_log.debug("Process Key => %s", Hex(process_key))
+        crypto_log.debug("Transaction Serial => %s", Hex(transaction_serial))
 
         #Compute MAC1
         now = datetime.datetime.now()
@@ -1022,9 +1368,8 @@ class FMCOS():
         mac1_verify_buffer = packed_amount + transaction_type_id.to_bytes() + terminal_id + transaction_date + transaction_time
         mac1_calculated = self.fmcos_des_mac(buf=mac1_verify_buffer, key=process_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] mac1_verify_buffer => {bytes_to_hexstr(mac1_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] mac1_calculated => {bytes_to_hexstr(mac1_calculated)}")
+        crypto_log.debug("mac1_verify_buffer => %s", Hex(mac1_verify_buffer))
+        crypto_log.debug("mac1_calculated => %s", Hex(mac1_calculated))
 
         data = b""
         data += transaction_serial
@@ -1037,8 +1382,7 @@ class FMCOS():
         p1 = 0x01
         p2 = 0x00
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data,le=0x8)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] TRANSACTION_PT2 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("TRANSACTION_PT2 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("Second part of transaction failed...")
@@ -1046,15 +1390,14 @@ class FMCOS():
         #Calculate & Validate Transaction Verification Code (TAC)
         CARD_TAC = ret[:4]
         mac2_card = ret[4:8]
-        tac_key = self.data_xor(internal_key[0:8], internal_key[8:])
+        tac_key = self.cipher_cache.xor_halves(internal_key)
 
         tac_verify_buffer = packed_amount + transaction_type_id.to_bytes() + terminal_id + transaction_serial + transaction_date + transaction_time
         tac_calculated = self.fmcos_des_mac(tac_verify_buffer, tac_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] tac_key => {bytes_to_hexstr(tac_key)}")
-            print(f"[{color('=', fg='yellow')}] tac_verify_buffer => {bytes_to_hexstr(tac_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] CARD_TAC => {bytes_to_hexstr(CARD_TAC)} <> tac_calculated => {bytes_to_hexstr(tac_calculated)}\n")
+        crypto_log.debug("tac_key => %s", Hex(tac_key))
+        crypto_log.debug("tac_verify_buffer => %s", Hex(tac_verify_buffer))
+        crypto_log.debug("CARD_TAC => %s <> tac_calculated => %s", Hex(CARD_TAC), Hex(tac_calculated))
 
         assert CARD_TAC == tac_calculated, "TAC does not match"
 
@@ -1062,8 +1405,6 @@ class FMCOS():
 
     def cmd_update_overdraft_limit(self, key_id, new_overdraft_limit, terminal_id, overdraft_key, internal_key, transaction_serial=None):
         """Update overdraft limit with MAC verification and TAC validation."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         if len(overdraft_key) != 16:
             raise ValueError("overdraft_key needs to be 16 bytes")
 
@@ -1083,8 +1424,7 @@ class FMCOS():
         cla = 0x80
         ins = 0x50
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data,le=0x13)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] OVERDRAFT_PT1 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("OVERDRAFT_PT1 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("First part of overdraft failed...")
@@ -1105,10 +1445,9 @@ class FMCOS():
         mac1_verify_buffer = old_balance + old_overdraft_limit + transaction_type.to_bytes() + terminal_id
         mac1_calculated = self.fmcos_des_mac(buf=mac1_verify_buffer, key=process_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] mac1_verify_buffer => {bytes_to_hexstr(mac1_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] mac1_calculated => {bytes_to_hexstr(mac1_calculated)}")
-            print(f"[{color('=', fg='yellow')}] card_mac_1 => {bytes_to_hexstr(card_mac_1)} <> mac1_calculated => {bytes_to_hexstr(mac1_calculated)}\n")
+        crypto_log.debug("mac1_verify_buffer => %s", Hex(mac1_verify_buffer))
+        crypto_log.debug("mac1_calculated => %s", Hex(mac1_calculated))
+        crypto_log.debug("card_mac_1 => %s <> mac1_calculated => %s", Hex(card_mac_1), Hex(mac1_calculated))
 
         assert mac1_calculated == card_mac_1, "MAC_1 does not match"
 
@@ -1131,8 +1470,7 @@ class FMCOS():
         p1 = 0x00
         p2 = 0x00
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data,le=0x4)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] OVERDRAFT_PT2 => {bytes_to_hexstr(ret)}\n")
+        transaction_log.info("OVERDRAFT_PT2 => %s", Hex(ret))
 
         if not self.is_success(ret):
             raise ValueError("Second part of overdraft failed...")
@@ -1140,16 +1478,15 @@ class FMCOS():
         #Calculate & Validate Transaction Verification Code (TAC)
         CARD_TAC = ret[:4]
 
-        tac_key = self.data_xor(internal_key[0:8], internal_key[8:])
+        tac_key = self.cipher_cache.xor_halves(internal_key)
         new_balance = struct.unpack(">I", old_balance)[0] + new_overdraft_limit
 
         tac_verify_buffer = struct.pack(">I", new_balance) + online_transaction_serial + mac2_verify_buffer
         tac_calculated = self.fmcos_des_mac(tac_verify_buffer, tac_key)
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] tac_key => {bytes_to_hexstr(tac_key)}")
-            print(f"[{color('=', fg='yellow')}] tac_verify_buffer => {bytes_to_hexstr(tac_verify_buffer)}")
-            print(f"[{color('=', fg='yellow')}] CARD_TAC => {bytes_to_hexstr(CARD_TAC)} <> tac_calculated => {bytes_to_hexstr(tac_calculated)}\n")
+        crypto_log.debug("tac_key => %s", Hex(tac_key))
+        crypto_log.debug("tac_verify_buffer => %s", Hex(tac_verify_buffer))
+        crypto_log.debug("CARD_TAC => %s <> tac_calculated => %s", Hex(CARD_TAC), Hex(tac_calculated))
 
         assert CARD_TAC == tac_calculated, "TAC does not match"
 
@@ -1157,8 +1494,6 @@ class FMCOS():
 
     def cmd_card_block(self, line_key):
         """Block entire card using line-protection MAC."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         cla = 0x84
         ins = 0x16
         p1 = 0x00
@@ -1168,15 +1503,13 @@ class FMCOS():
         data = self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=None, iv=chlg_iv, key=line_key)
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] CARD_BLOCK => {bytes_to_hexstr(ret)}\n")
+        self.session.reset()
+        apdu_log.info("CARD_BLOCK => %s", Hex(ret))
 
         return ret
 
     def cmd_app_block(self, block_type:ApplicationBlock, line_key):
         """Block application (temporary or permanent)."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         cla = 0x84
         ins = 0x1e
         p1 = 0x00
@@ -1186,15 +1519,13 @@ class FMCOS():
         data = self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=None, iv=chlg_iv, key=line_key)
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] APPLICATION_BLOCK => {bytes_to_hexstr(ret)}\n")
+        self.session.reset()
+        apdu_log.info("APPLICATION_BLOCK => %s", Hex(ret))
 
         return ret
 
     def cmd_app_unblock(self, line_key):
         """Unblock application using line-protection MAC."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         cla = 0x84
         ins = 0x18
         p1 = 0x00
@@ -1204,15 +1535,12 @@ class FMCOS():
         data = self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=None, iv=chlg_iv, key=line_key)
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] APPLICATION_UNBLOCK => {bytes_to_hexstr(ret)}\n")
+        apdu_log.info("APPLICATION_UNBLOCK => %s", Hex(ret))
 
         return ret
 
     def cmd_pin_unblock(self, key_id, pin_code, unlock_pin_key):
         """Unblock PIN by encrypting new PIN and appending MAC."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         cla = 0x84
         ins = 0x24
         p1 = key_id
@@ -1224,15 +1552,13 @@ class FMCOS():
         data += self.fmcos_packet_mac(cla=cla, ins=ins, p1=p1, p2=p2, data=data, iv=chlg_iv, key=unlock_pin_key)
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] PIN_UNBLOCK => {bytes_to_hexstr(ret)}\n")
+        self.session.forget(PIN, key_id)
+        apdu_log.info("PIN_UNBLOCK => %s", Hex(ret))
             
         return ret
 
     def cmd_pin_change(self, key_id, old_pin, new_pin):
         """Change PIN using old/new PIN with filler 0xFF separator."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         cla = 0x80
         ins = 0x5E
         p1 = 0x01
@@ -1244,15 +1570,13 @@ class FMCOS():
         data += new_pin
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] PIN_UNBLOCK => {bytes_to_hexstr(ret)}\n")
+        self.session.forget(PIN, key_id)
+        apdu_log.info("PIN_UNBLOCK => %s", Hex(ret))
             
         return ret
 
     def cmd_pin_reset(self, key_id, new_pin, change_pin_key):
         """Reset PIN with MAC generated from change-pin key halves xor."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        
         if len(change_pin_key) != 16:
             raise ValueError("change_pin_key needs to be 16 bytes")
 
@@ -1264,90 +1588,138 @@ class FMCOS():
         data = b""
         data += new_pin
 
-        mac_key = self.data_xor(change_pin_key[0:8], change_pin_key[8:])
+        mac_key = self.cipher_cache.xor_halves(change_pin_key)
         mac_calculated = self.fmcos_des_mac(data, mac_key)
         data += mac_calculated
 
         ret = self.sendCommand(cla=cla,ins=ins,p1=p1,p2=p2,Data=data)
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] PIN_UNBLOCK => {bytes_to_hexstr(ret)}\n")
+        self.session.forget(PIN, key_id)
+        apdu_log.info("PIN_UNBLOCK => %s", Hex(ret))
             
         return ret
 
     def sendCommand(self, cla, ins, p1, p2, Data=None, le=None):
-        """Compose and send an APDU via the underlying hardware connection."""
-        context = [cla, ins, p1, p2]
-        if Data != None:
-            lc = len(Data)
-            context = context + [lc] + list(Data)
-        else:
-            lc = None
-
-        if le != None:
-            context = context + [le]
-
-        if lc == None and le == None:
-            context = context + [0x00]
+        """Compose an APDU in the reusable `ApduBuilder` and exchange it through the transport.
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] FMCOS => {bytes_to_hexstr(bytes(context))}" )
+        Data longer than 255 bytes or Le above 256 are sent with extended length.
+        """
+        if Data == None and le == None:
+            le = 0x00
+        self.apdu_builder.build(cla, ins, p1, p2, Data, le)
+        return self._exchange()
+
+    def sendStatic(self, apdu):
+        """Exchange a precomputed APDU (see `apdu.static_apdu()`) without encoding it again."""
+        self.apdu_builder.load(apdu)
+        return self._exchange()
+
+    def _exchange(self):
+        """Send the APDU held by `apdu_builder`.
+
+        Bridges with `transceive_apdu()` get the builder and may frame the APDU in place;
+        others get a memoryview through `transceive()`. 61xx / 6Cxx answers are resolved
+        here when `auto_response` is set, see `_fix_response()`.
+        """
+        apdu = self.apdu_builder.apdu()
+        ins, p1, p2 = apdu[1], apdu[2], apdu[3]
 
         if self.simulation_status:
+            apdu_log.debug("FMCOS => %s", Hex(apdu))
             return b"\x90\x00"
-        else:
-            self.hw_conn.sendToNfc(context)
-            recdata = self.fmcosGetRecData()
-            return recdata
+
+        #SFI addressing (READ/UPDATE BINARY P1 b8, record commands P2 b8..b4) changes the current EF
+        if (ins in (0xb0, 0xd6) and p1 & 0x80) or (ins in (0xb2, 0xdc, 0xe2) and p2 >> 3):
+            self.selected_ef = None
+
+        recdata = self._transceive()
+        if self.auto_response and len(recdata) >= 2 and recdata[-2] in (0x61, 0x6c):
+            recdata = self._fix_response(recdata)
+        if apdu_log.isEnabledFor(logging.DEBUG):
+            apdu_log.debug("SW1_SW2 <= %s => %s", Hex(recdata[-2:]), Lazy(describe, recdata))
+        return recdata
+
+    def _transceive(self):
+        apdu = self.apdu_builder.apdu()
+        #One level check per exchange keeps the disabled path to a single call
+        debug = apdu_log.isEnabledFor(logging.DEBUG)
+        if debug:
+            apdu_log.debug("FMCOS => %s", Hex(apdu))
+        try:
+            transceive_apdu = getattr(self.hw_conn, "transceive_apdu", None)
+            if transceive_apdu != None:
+                recdata = transceive_apdu(self.apdu_builder)
+            else:
+                recdata = self.hw_conn.transceive(apdu)
+        except Exception:
+            #Card lost or reader error, the card may have been reset or swapped
+            self.reset_selection()
+            self.card_uid = None
+            self.card_info = None
+            self.cache_token = None
+            raise
+        if debug:
+            apdu_log.debug("FMCOS <= %s", Hex(recdata))
+        return recdata
+
+    def _fix_response(self, recdata):
+        """Handle 6Cxx (resend with Le = xx) and 61xx (GET RESPONSE until done) in the send path.
+
+        Protected (CLA b3) commands are not resent on 6Cxx, the card would need a fresh
+        challenge for the MAC; the caller gets the 6Cxx instead.
+        """
+        apdu = self.apdu_builder.apdu()
+        cla, ins = apdu[0], apdu[1]
+        #Short case 2 / case 4 APDU, Le is the last byte
+        has_le = len(apdu) == 5 or (len(apdu) > 5 and apdu[4] != 0 and len(apdu) == 6 + apdu[4])
+        if recdata[-2] == 0x6c and has_le and not cla & 0x04:
+            self.response_fixups[(ins, 0x6c)] += 1
+            apdu_log.info("Wrong Le %02X for INS %02X, resending with Le = %02X", apdu[-1], ins, recdata[-1])
+            apdu[-1] = recdata[-1]
+            recdata = self._transceive()
+
+        if recdata[-2] == 0x61:
+            self.response_fixups[(ins, 0x61)] += 1
+            data = bytearray()
+            while len(recdata) >= 2 and recdata[-2] == 0x61:
+                apdu_log.info("%02X bytes pending for INS %02X, GET RESPONSE", recdata[-1], ins)
+                data += recdata[:-2]
+                self.apdu_builder.build(0x00, 0xc0, 0x00, 0x00, le=recdata[-1])
+                recdata = self._transceive()
+            recdata = bytes(data) + recdata
+        return recdata
 
     def fmcosGetRecData(self):
         """Fetch last NFC data and decode status for logs; return raw bytes."""
         nfcdata = self.hw_conn.nfcGetRecData()
 
-        if self.fmcos_debug:
-            print(f"[{color('=', fg='yellow')}] FMCOS <= " + bytes_to_hexstr(nfcdata) )
-
-        parse_return_code(nfcdata[-2:], self.fmcos_debug)
+        apdu_log.debug("FMCOS <= %s", Hex(nfcdata))
+        apdu_log.debug("SW1_SW2 <= %s => %s", Hex(nfcdata[-2:]), Lazy(describe, nfcdata))
 
         return nfcdata
 
+    def parse_fci(self, ret):
+        """Decode the FCI of a SELECT response (data + SW1 SW2) into an `FCI` object."""
+        if ret[-2:] != b"\x90\x00":
+            raise ValueError("Failed to parse TLV")
+        return FCI.parse(memoryview(ret)[:-2])
+
     def parse_tlv(self, tlv_data):
-        """Parse and print basic SELECT response TLV tree; return DFName if present."""
-        if self.fmcos_debug: print(f"[{color('+', fg='green')}] Calling : {sys._getframe(0).f_code.co_name}")
-        SW1_SW2 = tlv_data[-2:]
+        """Parse a SELECT response FCI; return the DF name, or the raw data when there is none."""
         answer = tlv_data[:-2]
-
-        if SW1_SW2 == b"\x90\x00":
-            try:
-                TLVdict = TLVanalysis(answer)
-                TLVdict1 = TLVanalysis(TLVdict[b'\x6f'])
-
-                #if self.fmcos_debug:
-                #    print(f"[{color('=', fg='yellow')}] {TLVdict=}")
-                #    print(f"[{color('=', fg='yellow')}] {TLVdict1=}")
-
-                DFName = TLVdict1[b'\x84']
-                try:
-                    ctrlMsg = TLVdict1[b'\xa5']
-                    try:
-                        ctrlMsg = TLVanalysis(ctrlMsg)[b'\x88']
-                    except:
-                        try:
-                            ctrlMsg = TLVanalysis(ctrlMsg, tagLen=2)[b'\x9f\x0c']
-                        except:
-                            ctrlMsg = b'noCtrlMsg'
-
-                except:
-                    ctrlMsg = b'noCtrlMsg'
-
-                if self.fmcos_debug:
-                    if ctrlMsg != b"noCtrlMsg":
-                        print(f"[{color('=', fg='yellow')}] parse_tlv(ctrlMsg) => {ctrlMsg}")
-                    print(f"[{color('=', fg='yellow')}] parse_tlv(DFName) => {DFName}\n")
-
-                return DFName
-            except:
-                if self.fmcos_debug:
-                    print(f"[{color('=', fg='yellow')}] parse_tlv => {bytes_to_hexstr(answer)}\n")
-                return answer
-        else:
-            raise ValueError("Failed to parse TLV")
+        try:
+            fci = self.parse_fci(tlv_data)
+        except ValueError:
+            if tlv_data[-2:] != b"\x90\x00":
+                raise
+            fci = None
+
+        if fci == None or fci.df_name == None:
+            apdu_log.debug("parse_tlv => %s", Hex(answer))
+            return answer
+
+        if fci.sfi != None:
+            apdu_log.debug("parse_tlv(SFI) => %02X", fci.sfi)
+        if fci.issuer_data != None:
+            apdu_log.debug("parse_tlv(9F0C) => %s", Hex(fci.issuer_data))
+        apdu_log.debug("parse_tlv(DFName) => %s", fci.df_name)
+        return fci.df_name
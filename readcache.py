@@ -0,0 +1,88 @@
+"""Persistent cache for reads of files the application declares immutable.
+
+Entries are keyed by card UID, a change token (e.g. the purse transaction serial
+from INITIALIZE) and the read request. When a card shows up with a different
+token all of its entries are dropped. The store is a small sqlite3 database
+bounded to `max_entries` rows with least-recently-used eviction. One cache can
+be shared by the workers of an `IssuanceStation`, access is serialised by a lock.
+"""
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 4096
+
+class ReadCache(object):
+    """LRU read cache stored in sqlite3.
+
+    Args:
+        path (str): Database file, ":memory:" for a cache that lives with the process.
+        max_entries (int): Maximum number of cached responses over all cards.
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        #Losing the last writes on a power cut only costs a few re-reads
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS reads (
+                                uid BLOB NOT NULL, token BLOB NOT NULL, file TEXT NOT NULL,
+                                request TEXT NOT NULL, data BLOB NOT NULL, used INTEGER NOT NULL,
+                                PRIMARY KEY (uid, file, request))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reads_used ON reads (used)")
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        return self._db.execute("SELECT COUNT(*) FROM reads").fetchone()[0]
+
+    def get(self, uid, token, file, request):
+        """Cached response for `request` on `file`, or None when missing or the token changed."""
+        with self._lock:
+            row = self._db.execute("SELECT data, token FROM reads WHERE uid=? AND file=? AND request=?",
+                                   (bytes(uid), file, request)).fetchone()
+            if row is None or row[1] != bytes(token):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE reads SET used=? WHERE uid=? AND file=? AND request=?",
+                             (time.time_ns(), bytes(uid), file, request))
+            self.hits += 1
+            return row[0]
+
+    def put(self, uid, token, file, request, data):
+        """Store a response, dropping the card's entries made under another token."""
+        uid, token = bytes(uid), bytes(token)
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM reads WHERE uid=? AND token<>?", (uid, token))
+                self._db.execute("INSERT OR REPLACE INTO reads VALUES (?, ?, ?, ?, ?, ?)",
+                                 (uid, token, file, request, bytes(data), time.time_ns()))
+                excess = self._count() - self.max_entries
+                if excess > 0:
+                    self._db.execute("DELETE FROM reads WHERE rowid IN (SELECT rowid FROM reads ORDER BY used LIMIT ?)", (excess,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def invalidate(self, uid=None, file=None):
+        """Drop the entries of one card (and optionally one file), or everything."""
+        with self._lock:
+            if uid is None:
+                self._db.execute("DELETE FROM reads")
+            elif file is None:
+                self._db.execute("DELETE FROM reads WHERE uid=?", (bytes(uid),))
+            else:
+                self._db.execute("DELETE FROM reads WHERE uid=? AND file=?", (bytes(uid), file))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
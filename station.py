@@ -0,0 +1,254 @@
+"""Multi-reader issuance station.
+
+One worker thread per reader, each with its own transport and `FMCOS` session,
+takes jobs from a shared queue whenever a card is presented to its reader.
+Readers are found with `discover_pyscard()` / `discover_pn532()`, or given as
+transport names and arguments (see `transport.open_transport()`).
+
+    station = IssuanceStation(discover_pyscard("ACR122") + discover_pn532(["COM11", "COM12"]))
+    plan = compile_profile("profiles/transit.json")
+    station.run(lambda fmcos, job: plan.run(fmcos), jobs=range(40000))
+    print(station.report())
+"""
+import queue
+import threading
+import time
+from transport import open_transport
+from fmcos import FMCOS
+from cardlog import station_log
+
+#How often idle workers look at the stop flag while waiting for a card
+POLL_INTERVAL = 0.2
+
+class ReaderSpec(object):
+    """How to open one reader: `open_transport(transport, **kwargs)`, or an already open `Transport`.
+
+    `targets` > 1 issues that many cards per field on bridges with `list_targets()` (PN532).
+    """
+    __slots__ = ("name", "transport", "targets", "kwargs")
+
+    def __init__(self, name, transport, targets=1, **kwargs):
+        self.name = name
+        self.transport = transport
+        self.targets = targets
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"ReaderSpec({self.name!r}, {self.transport!r})"
+
+    def open(self):
+        if not isinstance(self.transport, str):
+            return self.transport
+        return open_transport(self.transport, **self.kwargs)
+
+def discover_pyscard(match=""):
+    """ReaderSpec for every PC/SC reader whose name contains `match`."""
+    from smartcard.System import readers  # type: ignore
+    return [ReaderSpec(str(r), "pyscard", reader_string=str(r), hw_debug=False) for r in readers() if match in str(r)]
+
+def discover_pn532(ports=None, targets=1):
+    """ReaderSpec for PN532 modules on the given serial ports (every serial port when None).
+
+    Ports that do not answer like a PN532 are reported by the worker that opens them.
+    With `targets=2` each module issues two cards lying in its field together.
+    """
+    if ports == None:
+        from serial.tools import list_ports  # type: ignore
+        ports = [port.device for port in list_ports.comports()]
+    return [ReaderSpec(port, "pn532", targets=targets, com_port=port, hw_debug=False) for port in ports]
+
+class ReaderStats(object):
+    """Per-reader counters.
+
+    Attributes:
+        issued (int): Jobs completed.
+        failed (int): Attempts that raised.
+        busy (float): Seconds spent running jobs.
+        errors (list[str]): Last failure messages (up to 20).
+    """
+    __slots__ = ("name", "issued", "failed", "busy", "started", "stopped", "errors", "state")
+
+    def __init__(self, name):
+        self.name = name
+        self.issued = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self.stopped = None
+        self.errors = []
+        self.state = "starting"
+
+    def elapsed(self):
+        return (self.stopped or time.monotonic()) - self.started
+
+    def cards_per_hour(self):
+        elapsed = self.elapsed()
+        return self.issued * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        per_card = f"{self.busy / self.issued:.2f}s/card" if self.issued else "-"
+        return f"{self.name}: {self.issued} issued, {self.failed} failed, {per_card}, " \
+               f"{self.cards_per_hour():.0f} cards/h ({self.state})"
+
+class IssuanceStation(object):
+    """Run issuance jobs on several readers at once.
+
+    Args:
+        readers (list[ReaderSpec]): Readers to drive, one worker thread each.
+        retries (int): How often a failed job goes back to the queue before it lands in `failed_jobs`.
+        card_timeout (float|None): Give up waiting for a card after this many seconds (None: wait for `stop()`).
+    """
+    def __init__(self, readers, retries=1, card_timeout=None):
+        if not readers:
+            raise ValueError("No readers to run the station on")
+        self.readers = list(readers)
+        self.retries = retries
+        self.card_timeout = card_timeout
+        self.jobs = queue.Queue()
+        self.failed_jobs = []
+        self.results = []
+        self.stats = {spec.name: ReaderStats(spec.name) for spec in self.readers}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, *jobs):
+        """Queue jobs; a job is anything the issue function understands (card data, a serial number...)."""
+        for job in jobs:
+            self.jobs.put((job, 0))
+
+    def start(self, issue):
+        """Start the workers; `issue(fmcos, job)` personalises the card in the field and may return a result."""
+        self._stop.clear()
+        for spec in self.readers:
+            thread = threading.Thread(target=self._worker, args=(spec, issue), name=f"issuance-{spec.name}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        """Let the workers finish their current card and exit."""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+    def run(self, issue, jobs=None):
+        """Submit `jobs`, run until the queue is drained, and return the results in completion order."""
+        if jobs != None:
+            self.submit(*jobs)
+        self.start(issue)
+        try:
+            while self._threads and not self._drained():
+                self.join(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+        self.join()
+        return self.results
+
+    def _drained(self):
+        with self._lock:
+            return self.jobs.unfinished_tasks == 0
+
+    def report(self):
+        """Per-reader throughput and failures, plus the station total."""
+        lines = [str(stats) for stats in self.stats.values()]
+        issued = sum(stats.issued for stats in self.stats.values())
+        failed = sum(stats.failed for stats in self.stats.values())
+        per_hour = sum(stats.cards_per_hour() for stats in self.stats.values())
+        lines.append(f"Total: {issued} issued, {failed} failed attempts, {len(self.failed_jobs)} jobs given up, {per_hour:.0f} cards/h")
+        return "\n".join(lines)
+
+    def _worker(self, spec, issue):
+        stats = self.stats[spec.name]
+        try:
+            fmcos = FMCOS(hw_conn=spec.open(), fmcos_debug=False)
+        except (Exception, SystemExit) as e:
+            #BRIDGE_PN532 calls sys.exit() when its port cannot be opened
+            stats.state = "unavailable"
+            stats.errors.append(f"open: {e!r}")
+            stats.stopped = time.monotonic()
+            station_log.error("%s: cannot open reader: %r", spec.name, e)
+            return
+
+        try:
+            self._serve(spec, issue, fmcos, stats)
+        except Exception as e:
+            stats.errors.append(f"reader: {e!r}")
+            station_log.error("%s: reader failed: %r", spec.name, e)
+            stats.state = "failed"
+        else:
+            stats.state = "stopped"
+        stats.stopped = time.monotonic()
+
+    def _serve(self, spec, issue, fmcos, stats):
+        """Issue jobs to the cards presented to one reader until stopped or out of work."""
+        stats.state = "idle"
+        waited = 0.0
+        while not self._stop.is_set():
+            if not fmcos.wait_for_card(POLL_INTERVAL):
+                waited += POLL_INTERVAL
+                if self.card_timeout != None and waited >= self.card_timeout:
+                    break
+                continue
+            waited = 0.0
+            sessions = [fmcos]
+            if spec.targets > 1 and hasattr(fmcos.hw_conn, "list_targets"):
+                sessions = [FMCOS(hw_conn=target, fmcos_debug=False) for target in fmcos.hw_conn.list_targets(spec.targets)] or sessions
+            #Only claim jobs once cards are there, so idle readers do not hold work back
+            claimed = []
+            for session in sessions:
+                try:
+                    claimed.append((session, self.jobs.get_nowait()))
+                except queue.Empty:
+                    break
+            if not claimed:
+                if self._drained():
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            stats.state = "issuing"
+            start = time.monotonic()
+            if len(claimed) == 1:
+                self._issue(spec, issue, *claimed[0])
+            else:
+                #The bridge serialises the exchanges, one session runs its host side while the other card answers
+                threads = [threading.Thread(target=self._issue, args=(spec, issue) + args) for args in claimed]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            stats.busy += time.monotonic() - start
+
+            stats.state = "remove card"
+            while not self._stop.is_set() and not fmcos.wait_for_removal(POLL_INTERVAL):
+                pass
+            stats.state = "idle"
+
+    def _issue(self, spec, issue, fmcos, claim):
+        """Run one job on the card behind `fmcos`; requeue or record it on failure."""
+        job, attempt = claim
+        stats = self.stats[spec.name]
+        start = time.monotonic()
+        try:
+            fmcos.nfcFindCard()
+            result = issue(fmcos, job)
+        except Exception as e:
+            station_log.warning("%s: job %r failed: %s", spec.name, job, e)
+            with self._lock:
+                stats.failed += 1
+                stats.errors = (stats.errors + [f"{job!r}: {e}"])[-20:]
+                if attempt < self.retries:
+                    self.jobs.put((job, attempt + 1))
+                else:
+                    self.failed_jobs.append((job, e))
+        else:
+            with self._lock:
+                stats.issued += 1
+                self.results.append((spec.name, job, result))
+            station_log.info("%s: job %r issued in %.3fs", spec.name, job, time.monotonic() - start)
+        finally:
+            self.jobs.task_done()
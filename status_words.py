@@ -0,0 +1,271 @@
+"""SW1 SW2 lookup table and the matching exception hierarchy.
+
+Every known status word maps to an interned message and an exception class; range
+rules (62xx, 63Cx, 64xx, 61xx, 6Cxx) are expanded into the same table at import
+time, so decoding a response is a single dict lookup and only happens on demand.
+"""
+
+SW_OK = 0x9000
+
+class CardError(ValueError):
+    """Card answered with a status word other than 90 00.
+
+    Attributes:
+        sw (bytes): SW1 SW2.
+        message (str): Description from the status word table.
+    """
+    def __init__(self, sw, context=None):
+        self.sw = bytes(sw[-2:])
+        self.message = describe(self.sw)
+        text = f"SW1_SW2 = {self.sw.hex(' ').upper()} => {self.message}"
+        super().__init__(f"{context} failed, {text}" if context else text)
+
+class CardWarning(CardError):
+    """Warning processing (62xx, 63xx), the card state may have changed."""
+
+class ExecutionError(CardError):
+    """Execution error (64xx - 66xx)."""
+
+class CheckingError(CardError):
+    """Checking error (67xx - 6Fxx), the command was rejected."""
+
+class ApplicationError(CardError):
+    """FMCOS application errors (93xx, 94xx)."""
+
+# One exception class per status word in _STATUS_WORDS
+class ResponseAvailable(CardWarning):
+    """6100: SW2 bytes still available, use GET RESPONSE."""
+
+class CorruptedData(CardWarning):
+    """6281: Part of returned data may be corrupted."""
+
+class EndOfFileReached(CardWarning):
+    """6282: End of file or record reached before reading Ne bytes."""
+
+class FileDeactivated(CardWarning):
+    """6283: Selected file deactivated."""
+
+class FciNotFormatted(CardWarning):
+    """6284: File control information not formatted."""
+
+class FileTerminated(CardWarning):
+    """6285: Selected file in termination state."""
+
+class NoSensorData(CardWarning):
+    """6286: No input data available from a sensor on the card."""
+
+class FileFilledUp(CardWarning):
+    """6381: File filled up by the last write."""
+
+class VerificationFailed(CardWarning):
+    """63C0: Counter from 0 to 15 encoded by 'X'(SW2&0xF)."""
+
+class ImmediateResponseRequired(ExecutionError):
+    """6401: Immediate response required by the card."""
+
+class MemoryFailure(ExecutionError):
+    """6581: Memory failure."""
+
+class WrongLength(CheckingError):
+    """6700: Invalid length."""
+
+class LogicalChannelNotSupported(CheckingError):
+    """6881: Logical channel not supported."""
+
+class SecureMessagingNotSupported(CheckingError):
+    """6882: Secure messaging not supported."""
+
+class LastCommandExpected(CheckingError):
+    """6883: Last command of the chain expected."""
+
+class ChainingNotSupported(CheckingError):
+    """6884: Command chaining not supported."""
+
+class IncompatibleFileStructure(CheckingError):
+    """6981: Command incompatible with file structure."""
+
+class SecurityStatusNotSatisfied(CheckingError):
+    """6982: Security status not satisfied."""
+
+class AuthenticationBlocked(CheckingError):
+    """6983: Authentication method blocked."""
+
+class ReferenceDataNotUsable(CheckingError):
+    """6984: Reference data not usable."""
+
+class ConditionsNotSatisfied(CheckingError):
+    """6985: Conditions of use not satisfied."""
+
+class NoCurrentEF(CheckingError):
+    """6986: Command not allowed (no current EF)."""
+
+class SecureMessagingMissing(CheckingError):
+    """6987: Expected secure messaging data objects missing."""
+
+class SecureMessagingIncorrect(CheckingError):
+    """6988: Incorrect secure messaging data objects."""
+
+class IncorrectData(CheckingError):
+    """6A80: Incorrect parameters in the command data field."""
+
+class FunctionNotSupported(CheckingError):
+    """6A81: Function not supported."""
+
+class FileNotFound(CheckingError):
+    """6A82: File or application not found."""
+
+class RecordNotFound(CheckingError):
+    """6A83: Record not found."""
+
+class NotEnoughMemory(CheckingError):
+    """6A84: Not enough memory space in the file."""
+
+class TlvInconsistent(CheckingError):
+    """6A85: Nc inconsistent with TLV structure."""
+
+class IncorrectP1P2(CheckingError):
+    """6A86: Incorrect parameters P1-P2."""
+
+class LcInconsistent(CheckingError):
+    """6A87: Nc inconsistent with parameters P1-P2."""
+
+class ReferencedDataNotFound(CheckingError):
+    """6A88: Referenced data or reference data not found."""
+
+class FileAlreadyExists(CheckingError):
+    """6A89: File already exists."""
+
+class DfNameAlreadyExists(CheckingError):
+    """6A8A: DF name already exists."""
+
+class WrongP1P2(CheckingError):
+    """6B00: Wrong parameters P1-P2 (offset outside the EF)."""
+
+class WrongLe(CheckingError):
+    """6C00: Wrong Le, SW2 indicates the exact length."""
+
+class InsNotSupported(CheckingError):
+    """6D00: Invalid INS parameter."""
+
+class ClaNotSupported(CheckingError):
+    """6E00: Invalid CLA parameter."""
+
+class InvalidMac(ApplicationError):
+    """9302: Invalid MAC."""
+
+class InsufficientBalance(ApplicationError):
+    """9401: The amount is insufficient."""
+
+class KeyIndexNotSupported(ApplicationError):
+    """9403: Key indexes are not supported."""
+
+# (SW, mask, exception class, message); the mask selects which bits of the SW are matched
+_STATUS_WORDS = (
+    (0x6100, 0xFF00, ResponseAvailable, "SW2 bytes still available, use GET RESPONSE"),
+    (0x6281, 0xFFFF, CorruptedData, "Part of returned data may be corrupted"),
+    (0x6282, 0xFFFF, EndOfFileReached, "End of file or record reached before reading Ne bytes"),
+    (0x6283, 0xFFFF, FileDeactivated, "Selected file deactivated"),
+    (0x6284, 0xFFFF, FciNotFormatted, "File control information not formatted"),
+    (0x6285, 0xFFFF, FileTerminated, "Selected file in termination state"),
+    (0x6286, 0xFFFF, NoSensorData, "No input data available from a sensor on the card"),
+    (0x6381, 0xFFFF, FileFilledUp, "File filled up by the last write"),
+    (0x63C0, 0xFFF0, VerificationFailed, "Counter from 0 to 15 encoded by 'X'(SW2&0xF)"),
+    (0x6401, 0xFFFF, ImmediateResponseRequired, "Immediate response required by the card"),
+    (0x6581, 0xFFFF, MemoryFailure, "Memory failure"),
+    (0x6700, 0xFFFF, WrongLength, "Invalid length"),
+    (0x6881, 0xFFFF, LogicalChannelNotSupported, "Logical channel not supported"),
+    (0x6882, 0xFFFF, SecureMessagingNotSupported, "Secure messaging not supported"),
+    (0x6883, 0xFFFF, LastCommandExpected, "Last command of the chain expected"),
+    (0x6884, 0xFFFF, ChainingNotSupported, "Command chaining not supported"),
+    (0x6981, 0xFFFF, IncompatibleFileStructure, "Command incompatible with file structure"),
+    (0x6982, 0xFFFF, SecurityStatusNotSatisfied, "Security status not satisfied"),
+    (0x6983, 0xFFFF, AuthenticationBlocked, "Authentication method blocked"),
+    (0x6984, 0xFFFF, ReferenceDataNotUsable, "Reference data not usable"),
+    (0x6985, 0xFFFF, ConditionsNotSatisfied, "Conditions of use not satisfied"),
+    (0x6986, 0xFFFF, NoCurrentEF, "Command not allowed (no current EF)"),
+    (0x6987, 0xFFFF, SecureMessagingMissing, "Expected secure messaging data objects missing"),
+    (0x6988, 0xFFFF, SecureMessagingIncorrect, "Incorrect secure messaging data objects"),
+    (0x6A80, 0xFFFF, IncorrectData, "Incorrect parameters in the command data field"),
+    (0x6A81, 0xFFFF, FunctionNotSupported, "Function not supported"),
+    (0x6A82, 0xFFFF, FileNotFound, "File or application not found"),
+    (0x6A83, 0xFFFF, RecordNotFound, "Record not found"),
+    (0x6A84, 0xFFFF, NotEnoughMemory, "Not enough memory space in the file"),
+    (0x6A85, 0xFFFF, TlvInconsistent, "Nc inconsistent with TLV structure"),
+    (0x6A86, 0xFFFF, IncorrectP1P2, "Incorrect parameters P1-P2"),
+    (0x6A87, 0xFFFF, LcInconsistent, "Nc inconsistent with parameters P1-P2"),
+    (0x6A88, 0xFFFF, ReferencedDataNotFound, "Referenced data or reference data not found"),
+    (0x6A89, 0xFFFF, FileAlreadyExists, "File already exists"),
+    (0x6A8A, 0xFFFF, DfNameAlreadyExists, "DF name already exists"),
+    (0x6B00, 0xFFFF, WrongP1P2, "Wrong parameters P1-P2 (offset outside the EF)"),
+    (0x6C00, 0xFF00, WrongLe, "Wrong Le, SW2 indicates the exact length"),
+    (0x6D00, 0xFFFF, InsNotSupported, "Invalid INS parameter"),
+    (0x6E00, 0xFFFF, ClaNotSupported, "Invalid CLA parameter"),
+    (0x9302, 0xFFFF, InvalidMac, "Invalid MAC"),
+    (0x9401, 0xFFFF, InsufficientBalance, "The amount is insufficient"),
+    (0x9403, 0xFFFF, KeyIndexNotSupported, "Key indexes are not supported"),
+)
+
+# SW2 ranges that share a message but have no dedicated exception
+_STATUS_RANGES = (
+    (0x6202, 0x6280, "Triggering by the card"),
+    (0x6402, 0x6480, "Triggering by the card"),
+)
+
+UNKNOWN_MESSAGE = "Unknown return code"
+
+def _category(sw):
+    sw1 = sw >> 8
+    if sw1 in (0x61, 0x62, 0x63):
+        return CardWarning
+    if 0x64 <= sw1 <= 0x66:
+        return ExecutionError
+    if 0x67 <= sw1 <= 0x6F:
+        return CheckingError
+    if sw1 in (0x93, 0x94):
+        return ApplicationError
+    return CardError
+
+def _build_table():
+    table = {SW_OK: ("Operation Successful", None)}
+    for start, stop, message in _STATUS_RANGES:
+        for sw in range(start, stop + 1):
+            table[sw] = (message, _category(sw))
+    for value, mask, cls, message in _STATUS_WORDS:
+        for sw in range(value, value + (~mask & 0xFFFF) + 1):
+            table[sw] = (message, cls)
+    return table
+
+# SW (int) -> (message, exception class)
+STATUS_TABLE = _build_table()
+
+def sw_value(sw):
+    """SW1 SW2 (the last two bytes of a response) as an int."""
+    return (sw[-2] << 8) | sw[-1]
+
+def describe(sw):
+    """Message for the status word at the end of `sw`."""
+    entry = STATUS_TABLE.get(sw_value(sw))
+    return entry[0] if entry else UNKNOWN_MESSAGE
+
+def error_class(sw):
+    """Exception class for the status word at the end of `sw` (CardError when unknown)."""
+    entry = STATUS_TABLE.get(sw_value(sw))
+    if entry and entry[1]:
+        return entry[1]
+    return _category(sw_value(sw))
+
+def raise_for_status(ret, context=None):
+    """Raise the matching `CardError` subclass unless the response ends in 90 00.
+
+    Args:
+        ret (bytes): Response data + SW1 SW2.
+        context (str): Operation name prefixed to the error message, e.g. "READ BINARY at offset 16".
+
+    Returns:
+        bytes: `ret` unchanged on success.
+    """
+    if len(ret) < 2:
+        raise CardError(b"\x00\x00", context or "Response without SW1 SW2")
+    if ret[-2] != 0x90 or ret[-1] != 0x00:
+        raise error_class(ret)(ret, context)
+    return ret
@@ -0,0 +1,183 @@
+"""BER-TLV decoding over memoryviews, and the matching encoder.
+
+Tags are handled as ints (0x84, 0x9F0C), values as memoryview slices of the input,
+so walking a response copies nothing. Nested objects are only decoded when
+`TLV.children()` is iterated.
+"""
+
+TAG_CLASS_UNIVERSAL = 0
+TAG_CLASS_APPLICATION = 1
+TAG_CLASS_CONTEXT = 2
+TAG_CLASS_PRIVATE = 3
+
+class TLV(object):
+    """One decoded data object.
+
+    Attributes:
+        tag (int): Tag, all tag bytes big endian (e.g. 0x9F0C).
+        value (memoryview): Value field, a view into the parsed buffer.
+    """
+    __slots__ = ("tag", "value")
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def __repr__(self):
+        return f"TLV({self.tag:02X}, {bytes(self.value).hex().upper()})"
+
+    def _first_byte(self):
+        return self.tag >> (8 * (max(self.tag.bit_length() - 1, 0) // 8))
+
+    @property
+    def tag_class(self):
+        """TAG_CLASS_UNIVERSAL / APPLICATION / CONTEXT / PRIVATE from b8-b7 of the first tag byte."""
+        return self._first_byte() >> 6
+
+    @property
+    def constructed(self):
+        """True when the value holds nested data objects (b6 of the first tag byte)."""
+        return bool(self._first_byte() & 0x20)
+
+    def children(self):
+        """Iterate the nested data objects of a constructed TLV."""
+        if not self.constructed:
+            raise ValueError(f"Tag {self.tag:02X} is primitive")
+        return iter_tlv(self.value)
+
+def _read_tag(buf, pos):
+    first = buf[pos]
+    tag = first
+    pos += 1
+    if first & 0x1F == 0x1F:
+        #Subsequent tag bytes, b8 set on all but the last
+        while True:
+            if pos >= len(buf):
+                raise ValueError("Truncated BER-TLV tag")
+            tag = (tag << 8) | buf[pos]
+            pos += 1
+            if not buf[pos - 1] & 0x80:
+                break
+    return tag, pos
+
+def _read_length(buf, pos):
+    if pos >= len(buf):
+        raise ValueError("Truncated BER-TLV length")
+    length = buf[pos]
+    pos += 1
+    if length < 0x80:
+        return length, pos
+    count = length & 0x7F
+    if count == 0 or count > 4:
+        raise ValueError(f"Unsupported BER-TLV length byte {length:02X}")
+    if pos + count > len(buf):
+        raise ValueError("Truncated BER-TLV length")
+    length = int.from_bytes(buf[pos:pos + count], "big")
+    return length, pos + count
+
+def iter_tlv(data):
+    """Iterate the data objects in `data` (bytes-like), skipping 00 / FF padding between them."""
+    buf = data if isinstance(data, memoryview) else memoryview(data)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        if buf[pos] in (0x00, 0xFF):
+            pos += 1
+            continue
+        tag, pos = _read_tag(buf, pos)
+        length, pos = _read_length(buf, pos)
+        if pos + length > end:
+            raise ValueError(f"BER-TLV value of tag {tag:02X} overruns the buffer")
+        yield TLV(tag, buf[pos:pos + length])
+        pos += length
+
+def find_tlv(data, *path):
+    """Return the value (memoryview) at the tag `path`, e.g. find_tlv(fci, 0x6F, 0xA5, 0x88), or None."""
+    items = iter_tlv(data)
+    for depth, tag in enumerate(path):
+        for item in items:
+            if item.tag == tag:
+                if depth == len(path) - 1:
+                    return item.value
+                items = item.children()
+                break
+        else:
+            return None
+    return None
+
+def encode_tag(tag):
+    """Tag bytes for an int tag (bytes are returned unchanged)."""
+    if isinstance(tag, (bytes, bytearray)):
+        return bytes(tag)
+    return tag.to_bytes(max(1, (tag.bit_length() + 7) // 8), "big")
+
+def encode_length(length):
+    """Short form below 0x80, otherwise 81 xx / 82 xxxx / 83 xxxxxx."""
+    if length < 0x80:
+        return bytes([length])
+    count = (length.bit_length() + 7) // 8
+    if count > 4:
+        raise ValueError("BER-TLV length too large")
+    return bytes([0x80 | count]) + length.to_bytes(count, "big")
+
+def encode_tlv(tag, value):
+    """Encode one data object; `value` is bytes-like or an iterable of encoded children."""
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        value = b"".join(value)
+    return encode_tag(tag) + encode_length(len(value)) + bytes(value)
+
+class FCI(object):
+    """File control information returned by SELECT, decoded in one pass.
+
+    Layout: 6F [84 DF name] [A5 [88 SFI] [9F0C issuer discretionary data]]
+
+    Attributes:
+        df_name (bytes|None): DF name (AID) from tag 84.
+        sfi (int|None): Short EF identifier of the directory file from tag 88.
+        issuer_data (bytes|None): FCI issuer discretionary data from tag 9F0C.
+        proprietary (bytes|None): Raw A5 template.
+    """
+    __slots__ = ("df_name", "sfi", "issuer_data", "proprietary")
+
+    def __init__(self, df_name=None, sfi=None, issuer_data=None, proprietary=None):
+        self.df_name = df_name
+        self.sfi = sfi
+        self.issuer_data = issuer_data
+        self.proprietary = proprietary
+
+    def __repr__(self):
+        return f"FCI(df_name={self.df_name!r}, sfi={self.sfi!r}, issuer_data={self.issuer_data!r})"
+
+    @classmethod
+    def parse(cls, data):
+        """Decode an FCI template (response data without SW1 SW2)."""
+        fci = cls()
+        for template in iter_tlv(data):
+            if template.tag != 0x6F:
+                continue
+            for item in template.children():
+                if item.tag == 0x84:
+                    fci.df_name = bytes(item.value)
+                elif item.tag == 0xA5:
+                    fci.proprietary = bytes(item.value)
+                    for prop in item.children():
+                        if prop.tag == 0x88 and len(prop.value) == 1:
+                            fci.sfi = prop.value[0]
+                        elif prop.tag == 0x9F0C:
+                            fci.issuer_data = bytes(prop.value)
+            return fci
+        raise ValueError("No FCI template (6F) in response")
+
+    def encode(self):
+        """Encode back to a 6F template."""
+        items = []
+        if self.df_name is not None:
+            items.append(encode_tlv(0x84, self.df_name))
+        prop = []
+        if self.sfi is not None:
+            prop.append(encode_tlv(0x88, bytes([self.sfi])))
+        if self.issuer_data is not None:
+            prop.append(encode_tlv(0x9F0C, self.issuer_data))
+        if prop:
+            items.append(encode_tlv(0xA5, prop))
+        return encode_tlv(0x6F, items)
@@ -0,0 +1,223 @@
+import importlib
+import time
+
+# Built-in backends, imported on first use so a missing optional dependency
+# (pyserial, pyscard, pm3) only matters for the backend that needs it.
+_TRANSPORTS = {
+    "pn532": "conn_pn532:BRIDGE_PN532",
+    "pm3": "conn_pm3:BRIDGE_PM3",
+    "pyscard": "conn_pyscard:BRIDGE_PYSCARD",
+    "emulator": "conn_emulator:BRIDGE_EMULATOR",
+}
+
+def coerce_apdu(raw_bytes):
+    """Convert the accepted raw APDU forms into bytes.
+
+    Args:
+        raw_bytes (str|bytes|bytearray|memoryview|list[int]):
+            - hex str (spaces allowed), e.g., '00 A4 04 00'
+            - bytes-like, e.g., b"\x00\xA4\x04\x00"
+            - list of ints [0..255]
+    """
+    if isinstance(raw_bytes, str):
+        return bytes.fromhex(raw_bytes.replace(" ", ""))
+    elif isinstance(raw_bytes, (bytes, bytearray, memoryview, list)):
+        return bytes(raw_bytes)
+    raise ValueError("Dont know how to process raw_bytes")
+
+#ISO/IEC 14443-4 FSCI -> FSC (frame size the card accepts, PCB + INF + CRC); FSCI above 8 is treated as 256
+FSC_TABLE = (16, 24, 32, 40, 48, 64, 96, 128, 256)
+#FSCI when the ATS has no T0 byte
+DEFAULT_FSCI = 2
+
+class TargetInfo(object):
+    """ISO14443A activation data of one card.
+
+    Attributes:
+        tg (int): Target number the reader assigned (1 when the reader has no such notion).
+        uid (bytes): UID / NFCID1, 4, 7 or 10 bytes.
+        atqa (bytes): SENS_RES, as the reader reports it.
+        sak (int): SEL_RES.
+        ats (bytes|None): Answer To Select including its TL byte, None for non ISO14443-4 cards.
+    """
+    __slots__ = ("tg", "uid", "atqa", "sak", "ats")
+
+    def __init__(self, tg, uid, atqa, sak, ats=None):
+        self.tg = tg
+        self.uid = bytes(uid)
+        self.atqa = bytes(atqa)
+        self.sak = sak
+        self.ats = bytes(ats) if ats != None else None
+
+    def __repr__(self):
+        ats = f", ATS={self.ats.hex().upper()}" if self.ats else ""
+        return f"TargetInfo(Tg={self.tg}, UID={self.uid.hex().upper()}, ATQA={self.atqa.hex().upper()}, SAK={self.sak:02X}{ats})"
+
+    def _t0(self):
+        return self.ats[1] if self.ats != None and len(self.ats) > 1 else None
+
+    @property
+    def fsci(self):
+        t0 = self._t0()
+        return DEFAULT_FSCI if t0 == None else t0 & 0x0F
+
+    @property
+    def fsc(self):
+        return FSC_TABLE[min(self.fsci, len(FSC_TABLE) - 1)]
+
+    @property
+    def historical_bytes(self):
+        t0 = self._t0()
+        if t0 == None:
+            return b""
+        #TA(1), TB(1), TC(1) follow T0 when bits 5, 6, 7 are set
+        start = 2 + bin(t0 & 0x70).count("1")
+        return self.ats[start:]
+
+    @property
+    def cid_supported(self):
+        t0 = self._t0()
+        if t0 == None or not t0 & 0x40:
+            return False
+        return bool(self.ats[2 + bin(t0 & 0x30).count("1")] & 0x02)
+
+    @property
+    def max_command(self):
+        """Largest command APDU the card takes in one I-block (FSC minus PCB, CID and CRC), None without ATS."""
+        if self.ats == None:
+            return None
+        return self.fsc - 3 - (1 if self.cid_supported else 0)
+
+    @property
+    def max_lc(self):
+        """`Transport.max_lc` for this card: command data that fits one I-block after the APDU header."""
+        if self.ats == None:
+            return 0xFF
+        return min(0xFF, self.max_command - 5)
+
+def register_transport(name, target):
+    """Register a backend under `name`.
+
+    Args:
+        name (str): Lookup name, e.g. "pn532".
+        target (str|type): Either the class itself or a lazy "module:Class" reference.
+    """
+    _TRANSPORTS[name.lower()] = target
+
+def get_transport(name):
+    """Return the backend class registered as `name`, importing it if needed."""
+    try:
+        target = _TRANSPORTS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown transport {name!r}, available: {', '.join(sorted(_TRANSPORTS))}") from None
+
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(":")
+        target = getattr(importlib.import_module(module_name), class_name)
+        _TRANSPORTS[name.lower()] = target
+    return target
+
+def open_transport(name, *args, **kwargs):
+    """Instantiate the backend registered as `name` with the given arguments."""
+    return get_transport(name)(*args, **kwargs)
+
+def available_transports():
+    """Return the names of all registered backends."""
+    return sorted(_TRANSPORTS)
+
+class Transport(object):
+    """Common interface implemented by every reader bridge.
+
+    Backends only have to provide `transceive()` and `nfcFindCard()`. The legacy
+    `sendToNfc()` / `nfcGetRecData()` pair is kept on top of `transceive()` for
+    scripts that still use the two-step protocol.
+
+    Attributes:
+        max_le (int): Largest response data length (excluding SW1 SW2) the reader
+            reliably carries in one exchange.
+        select_resets_card (bool): True when the bridge re-activates the card for
+            SELECT APDUs, which drops the card back to the MF.
+        frame_headroom (int): Bytes the bridge needs in front of an `ApduBuilder` APDU
+            to add its framing in place (see `transceive_apdu()`).
+        frame_tailroom (int): Same, after the APDU.
+        max_lc (int): Largest command data length that fits one frame to the card,
+            bridges that decode the ATS lower it to the card's FSC.
+        target_info (TargetInfo|None): Activation data of the card, when the bridge reports it.
+    """
+    max_le = 0xFF
+    max_lc = 0xFF
+    target_info = None
+    select_resets_card = False
+    frame_headroom = 0
+    frame_tailroom = 0
+
+    def transceive(self, apdu):
+        """Send one APDU (bytes-like) and return the response data + SW1 SW2 as bytes."""
+        raise NotImplementedError
+
+    def transceive_apdu(self, builder):
+        """Send the APDU held by an `apdu.ApduBuilder` and return the response.
+
+        The default hands the builder's memoryview to `transceive()`. Bridges that wrap
+        APDUs in a frame override this and write the framing into the builder's
+        reserved head/tail room instead of copying the APDU.
+        """
+        return self.transceive(builder.apdu())
+
+    def transceive_many(self, apdus):
+        """Send several independent APDUs and return their responses in order.
+
+        Backends that can pipeline or batch exchanges should override this.
+        """
+        return [self.transceive(apdu) for apdu in apdus]
+
+    def nfcFindCard(self):
+        """Return a card identifier when a card is present, otherwise 'noCard'."""
+        raise NotImplementedError
+
+    def card_present(self):
+        """Return True if a card is currently in the field."""
+        return self.nfcFindCard() != 'noCard'
+
+    def wait_for_card(self, timeout=None, interval=0.05):
+        """Block until a card is present.
+
+        The base implementation polls `card_present()`; backends with an event source or
+        a reader-side poll loop override this.
+
+        Args:
+            timeout (float|None): Seconds to wait, None waits forever.
+            interval (float): Delay between two presence probes.
+
+        Returns:
+            bool: True once a card is present, False on timeout.
+        """
+        return self._wait_until(True, timeout, interval)
+
+    def wait_for_removal(self, timeout=None, interval=0.05):
+        """Block until the card has left the field; return False on timeout."""
+        return self._wait_until(False, timeout, interval)
+
+    def _wait_until(self, present, timeout, interval):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.card_present() != present:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def sendToNfc(self, data):
+        """Legacy first half of the two-step protocol, see `transceive()`."""
+        self._last_response = self.transceive(data)
+
+    def nfcGetRecData(self):
+        """Legacy second half of the two-step protocol, see `transceive()`."""
+        recvdata = getattr(self, "_last_response", None)
+        if recvdata == None:
+            raise ValueError(f"Did not recieve any data from {type(self).__name__}")
+        self._last_response = None
+        return recvdata
+
+    def sendRaw(self, raw_bytes):
+        """Send a raw APDU given as hex str / bytes / list[int] and return the response."""
+        return self.transceive(coerce_apdu(raw_bytes))